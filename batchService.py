@@ -0,0 +1,425 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from detector import Detector, UltralyticsTracker, YoloSegDetector
+from loadVideo import open_video_source
+from pipeline import run_synopsis_pipeline
+from profiler import PROFILER
+
+VIDEO_EXTS = (".avi", ".mp4", ".mkv", ".mov", ".ts")
+
+_STOP = object()
+
+
+class _Request:
+    __slots__ = ("frames", "result", "error", "done")
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.result = self.error = None
+        self.done = threading.Event()
+
+
+class SharedDetector(Detector):
+    """
+    One detector model serving every job of a batch run: `detect` may be
+    called from any thread; the calls are queued to a single inference
+    thread, which merges whatever requests are waiting into forward
+    passes of up to max_batch frames and hands each caller its part.
+
+    Frames of different jobs may differ in size; the model sees them in
+    one batch, so a detector that letterboxes (YOLO) handles them as is.
+    """
+
+    def __init__(self, detector, max_batch=16):
+        self.detector = detector
+        self.names = detector.names
+        self.max_batch = max_batch
+        self.passes = self.frames = 0
+        self.busy = 0.0
+        self._q = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="shared-detector", daemon=True
+        )
+        self._thread.start()
+
+    def config(self):
+        return self.detector.config()
+
+    def detect(self, frames):
+        req = _Request(list(frames))
+        self._q.put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _take(self, first):
+        reqs, n = [first], len(first.frames)
+        while n < self.max_batch:
+            try:
+                req = self._q.get_nowait()
+            except queue.Empty:
+                break
+            if req is _STOP:
+                self._q.put(_STOP)
+                break
+            reqs.append(req)
+            n += len(req.frames)
+        return reqs
+
+    def _run(self):
+        while True:
+            req = self._q.get()
+            if req is _STOP:
+                return
+            reqs = self._take(req)
+            frames = [f for r in reqs for f in r.frames]
+            t0 = time.perf_counter()
+            try:
+                with PROFILER.span("detect_shared"):
+                    dets = self.detector.detect(frames)
+            except BaseException as e:
+                for r in reqs:
+                    r.error = e
+            else:
+                k = 0
+                for r in reqs:
+                    r.result = dets[k : k + len(r.frames)]
+                    k += len(r.frames)
+            self.busy += time.perf_counter() - t0
+            self.passes += 1
+            self.frames += len(frames)
+            for r in reqs:
+                r.done.set()
+
+    def close(self):
+        self._q.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        return dict(
+            forward_passes=self.passes,
+            frames=self.frames,
+            mean_batch=self.frames / self.passes if self.passes else 0.0,
+            busy_s=self.busy,
+        )
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """
+    Jobs as video files in a directory: drop files into root/inbox; a
+    runner claims one by renaming it into root/running (atomic, so
+    several runners can share a queue) and moves it to root/done or
+    root/failed afterwards, with a JSON record in root/results.
+
+    A claimed job has a root/running/<name>.claim file naming its owner
+    (host, pid); the owner touches it every few seconds (`heartbeat`), so
+    a claim whose file is older than `lease` seconds, or whose owner
+    process is gone, is known to be abandoned and `recover` requeues it.
+    """
+
+    def __init__(self, root, lease=120):
+        self.root = root
+        self.lease = lease
+        self.host = socket.gethostname()
+        for sub in ("inbox", "running", "done", "failed", "results"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def _dir(self, sub):
+        return os.path.join(self.root, sub)
+
+    def pending(self):
+        return sorted(
+            name
+            for name in os.listdir(self._dir("inbox"))
+            if name.lower().endswith(VIDEO_EXTS)
+        )
+
+    def claim(self):
+        """Path of the next claimed job in root/running, or None."""
+        for name in self.pending():
+            path = os.path.join(self._dir("running"), name)
+            try:
+                os.rename(os.path.join(self._dir("inbox"), name), path)
+            except FileNotFoundError:
+                continue  # claimed by another runner
+            with open(path + ".claim", "w") as f:
+                json.dump(dict(host=self.host, pid=os.getpid(), start=time.time()), f)
+            return path
+        return None
+
+    def heartbeat(self, path):
+        """Renew the lease of a claimed job."""
+        try:
+            os.utime(path + ".claim")
+        except FileNotFoundError:
+            pass
+
+    def finish(self, path, record, ok=True):
+        name = os.path.basename(path)
+        os.replace(path, os.path.join(self._dir("done" if ok else "failed"), name))
+        try:
+            os.remove(path + ".claim")
+        except FileNotFoundError:
+            pass
+        with open(os.path.join(self._dir("results"), name + ".json"), "w") as f:
+            json.dump(record, f, indent=1)
+
+    def _stale(self, path):
+        now = time.time()
+        try:
+            with open(path + ".claim") as f:
+                owner = json.load(f)
+            age = now - os.stat(path + ".claim").st_mtime
+        except (FileNotFoundError, ValueError):
+            # claimed but its claim file not written (yet): the rename
+            # updated the job's ctime
+            st = os.stat(path)
+            return now - max(st.st_mtime, st.st_ctime) > self.lease
+        if owner.get("host") == self.host and not _pid_alive(owner.get("pid", -1)):
+            return True
+        return age > self.lease
+
+    def recover(self):
+        """
+        Put jobs abandoned in root/running (owner dead or lease expired)
+        back in the inbox; returns their names. Jobs of live runners stay.
+        """
+        requeued = []
+        for name in os.listdir(self._dir("running")):
+            if name.endswith(".claim"):
+                continue
+            path = os.path.join(self._dir("running"), name)
+            try:
+                if not self._stale(path):
+                    continue
+                os.replace(path, os.path.join(self._dir("inbox"), name))
+            except FileNotFoundError:
+                continue  # finished meanwhile
+            try:
+                os.remove(path + ".claim")
+            except FileNotFoundError:
+                pass
+            requeued.append(name)
+        if requeued:
+            print(f"[BATCH] requeued abandoned jobs: {', '.join(requeued)}")
+        return requeued
+
+
+class BatchRunner:
+    """
+    Long-running synopsis service: n_jobs videos are processed at once,
+    each by pipeline.run_synopsis_pipeline (decode, tracking, background,
+    scheduling, rendering and encoding in its own threads), all sharing
+    one SharedDetector, so the model is loaded once and its forward
+    passes are filled from every running job.
+
+    Args:
+      detector        : detector.Detector, wrapped in a SharedDetector
+      tracker_factory : returns a fresh detector.Tracker per job
+      out_dir         : outputs go to out_dir/<video name>/
+      n_jobs          : videos processed concurrently
+      max_batch       : max frames per shared forward pass
+      size            : (W, H) the videos are decoded at
+      pipeline_kwargs : passed to run_synopsis_pipeline (keep_classes,
+                        batch_size, scheduler, codec, segment_len, ...)
+    """
+
+    def __init__(
+        self,
+        detector,
+        tracker_factory=UltralyticsTracker,
+        out_dir="batch_output",
+        n_jobs=2,
+        max_batch=16,
+        size=(640, 380),
+        **pipeline_kwargs,
+    ):
+        self.detector = SharedDetector(detector, max_batch)
+        self.tracker_factory = tracker_factory
+        self.out_dir = out_dir
+        self.n_jobs = n_jobs
+        self.size = size
+        self.pipeline_kwargs = pipeline_kwargs
+        self.records = []
+        self._active = set()  # claimed job paths being processed
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def run_job(self, path):
+        """Process one video; returns its result record (never raises)."""
+        name = os.path.splitext(os.path.basename(path))[0]
+        out = os.path.join(self.out_dir, name)
+        os.makedirs(out, exist_ok=True)
+        record = dict(job=os.path.basename(path), start=time.time())
+        t0 = time.perf_counter()
+        frames = None
+        try:
+            frames = open_video_source(path, None, *self.size)
+            outputs, stats = run_synopsis_pipeline(
+                frames,
+                detector=self.detector,
+                tracker=self.tracker_factory(),
+                out_pattern=os.path.join(out, "synopsis_cls_{}"),
+                **self.pipeline_kwargs,
+            )
+            record.update(
+                ok=True,
+                frames=len(frames),
+                outputs=outputs,
+                stages=[s.as_dict() for s in stats],
+            )
+        except Exception as e:
+            record.update(ok=False, error=repr(e), traceback=traceback.format_exc())
+            print(f"[BATCH] job {name} failed: {e!r}")
+        finally:
+            if frames is not None:
+                frames.release()
+        record["latency_s"] = time.perf_counter() - t0
+        return record
+
+    def _worker(self, jobs, poll):
+        while True:
+            path = jobs.claim()
+            if path is None:
+                if poll is None:
+                    return
+                time.sleep(poll)
+                continue
+            print(f"[BATCH] started {os.path.basename(path)}")
+            with self._lock:
+                self._active.add(path)
+            record = self.run_job(path)
+            with self._lock:
+                self._active.discard(path)
+            try:
+                jobs.finish(path, record, record["ok"])
+            except OSError as e:
+                # e.g. the claim was taken over after a lost heartbeat
+                record["finish_error"] = repr(e)
+                print(f"[BATCH] could not file {record['job']}: {e!r}")
+            with self._lock:
+                self.records.append(record)
+            print(
+                f"[BATCH] finished {record['job']} in {record['latency_s']:.1f}s "
+                f"({len(self.records)} done)"
+            )
+
+    def run(self, jobs, poll=None):
+        """
+        Process jobs of a JobQueue until the inbox is empty, or forever
+        (checking every `poll` seconds) with poll set. Returns report().
+        """
+        jobs.recover()
+        self._t0 = time.perf_counter()
+        workers = [
+            threading.Thread(target=self._worker, args=(jobs, poll), daemon=True)
+            for _ in range(self.n_jobs)
+        ]
+        for w in workers:
+            w.start()
+        stop = threading.Event()
+        beat = threading.Thread(
+            target=self._heartbeat, args=(jobs, stop), name="heartbeat", daemon=True
+        )
+        beat.start()
+        for w in workers:
+            w.join()
+        stop.set()
+        beat.join()
+        return self.report()
+
+    def _heartbeat(self, jobs, stop):
+        # renew the claims of the running jobs; with poll set, also take
+        # back jobs abandoned by runners that died meanwhile
+        while not stop.wait(jobs.lease / 4):
+            with self._lock:
+                active = list(self._active)
+            for path in active:
+                jobs.heartbeat(path)
+            jobs.recover()
+
+    def report(self):
+        """Jobs/hour, per-job latency and shared detector use so far."""
+        wall = time.perf_counter() - self._t0
+        lat = np.array([r["latency_s"] for r in self.records if r["ok"]])
+        return dict(
+            jobs=len(self.records),
+            failed=sum(not r["ok"] for r in self.records),
+            wall_s=wall,
+            jobs_per_hour=3600 * len(lat) / wall if wall else 0.0,
+            latency_mean_s=float(lat.mean()) if len(lat) else 0.0,
+            latency_p50_s=float(np.percentile(lat, 50)) if len(lat) else 0.0,
+            latency_p95_s=float(np.percentile(lat, 95)) if len(lat) else 0.0,
+            detector=self.detector.stats(),
+        )
+
+    def print_report(self):
+        r = self.report()
+        d = r["detector"]
+        print(
+            f"[BATCH] {r['jobs']} jobs ({r['failed']} failed) in {r['wall_s']:.1f}s: "
+            f"{r['jobs_per_hour']:.1f} jobs/hour, latency mean "
+            f"{r['latency_mean_s']:.1f}s p50 {r['latency_p50_s']:.1f}s "
+            f"p95 {r['latency_p95_s']:.1f}s; detector {d['forward_passes']} "
+            f"passes, {d['mean_batch']:.1f} frames/pass"
+        )
+
+    def close(self):
+        self.detector.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch video synopsis service")
+    parser.add_argument("jobs", help="job directory (videos go in <jobs>/inbox)")
+    parser.add_argument("--out", default="batch_output")
+    parser.add_argument("--jobs-parallel", type=int, default=2)
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--classes", nargs="+", default=["person"])
+    parser.add_argument("--conf", type=float, default=0.4)
+    parser.add_argument("--codec", default="mp4v")
+    parser.add_argument("--segment-len", type=int, default=None)
+    parser.add_argument(
+        "--poll", type=float, default=None, help="keep watching the inbox"
+    )
+    parser.add_argument(
+        "--lease",
+        type=float,
+        default=120,
+        help="seconds without heartbeat before a claimed job is requeued",
+    )
+    args = parser.parse_args()
+    runner = BatchRunner(
+        YoloSegDetector(conf=args.conf),
+        n_jobs=args.jobs_parallel,
+        max_batch=args.max_batch,
+        out_dir=args.out,
+        keep_classes=args.classes,
+        conf=args.conf,
+        codec=args.codec,
+        segment_len=args.segment_len,
+    )
+    try:
+        runner.run(JobQueue(args.jobs, args.lease), args.poll)
+    finally:
+        runner.print_report()
+        runner.close()
@@ -0,0 +1,1663 @@
+import argparse
+import functools
+import gc
+import json
+import multiprocessing as mp
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from batchService import BatchRunner, JobQueue
+from checkpoint import ExtractionCheckpoint, load_tubes, save_tubes
+from computeBackground import (
+    BackgroundTimeline,
+    MotionGate,
+    compute_background_median,
+    compute_background_timeline,
+)
+from detectionTable import DetectionTable, frame_rows
+from detector import (
+    ColorKeyDetector,
+    Detections,
+    Detector,
+    IouTracker,
+    UltralyticsTracker,
+    YoloSegDetector,
+)
+from extractTube import TubeAssembler, extract_segmentation_tubes, iter_detections
+from liveSynopsis import LiveSynopsis, update_live_synopsis
+from loadVideo import open_video_source, resize_frames
+from maskCodec import encode_tubes
+from processTubes import merge_masks_by_class, refine_tubes_by_bbox_disp
+from profiler import PROFILER
+from scheduleTubes import (
+    CollisionTable,
+    OccupancyVolume,
+    groub_tubes_by_classid,
+    schedule_tubes,
+    schedule_tubes_bbox,
+    schedule_tubes_dynamic,
+)
+from shardedExtract import extract_tubes_sharded
+from tube import Tube, TubeBuilder, crop_mask
+from tubeStore import TubeStore
+from videoOutput import CODECS, WriterPool, ffmpeg_path, output_path
+from writeVideo import (
+    SpriteCache,
+    build_synopsis_reference,
+    build_synopsis_with_time,
+    iter_multi_synopsis_frames,
+    iter_synopsis_frames,
+    write_video,
+)
+
+
+# synthetic data
+def make_synthetic_tubes(n_tubes, H=380, W=640, min_len=20, max_len=80, seed=0):
+    """
+    Tubes of discs moving in straight lines, spread over 10x their
+    max length of source time, with masks built directly as bbox patches.
+    """
+    rng = np.random.default_rng(seed)
+    tubes = []
+    for k in range(n_tubes):
+        L = int(rng.integers(min_len, max_len + 1))
+        t0 = int(rng.integers(0, 10 * max_len))
+        r = int(rng.integers(8, 30))
+        x0, y0 = rng.uniform(r, W - r), rng.uniform(r, H - r)
+        vx, vy = rng.uniform(-4, 4, size=2)
+        yy, xx = np.mgrid[-r : r + 1, -r : r + 1]
+        disc = xx * xx + yy * yy <= r * r
+
+        frames, centroids, bboxes, mask_boxes, patches = [], [], [], [], []
+        for j in range(L):
+            cx = int(np.clip(x0 + vx * j, r, W - r - 1))
+            cy = int(np.clip(y0 + vy * j, r, H - r - 1))
+            box = (cx - r, cy - r, cx + r + 1, cy + r + 1)
+            frames.append(t0 + j)
+            centroids.append((cx, cy))
+            bboxes.append(box)
+            mask_boxes.append(box)
+            patches.append(disc)
+        tubes.append(
+            Tube.from_patches(
+                k, frames, centroids, bboxes, [k % 3] * L, mask_boxes, patches
+            )
+        )
+    return tubes
+
+
+# colour keys of the synthetic objects, for ColorKeyDetector
+SYNTHETIC_CLASSES = {
+    0: ("person", (0, 0, 255)),
+    2: ("car", (0, 255, 0)),
+    3: ("motorcycle", (255, 0, 0)),
+}
+
+
+def make_synthetic_clip(n_frames=200, H=380, W=640, n_objects=8, seed=0, drift=0.0):
+    """
+    Surveillance-like clip: a static grey gradient with `n_objects`
+    key-coloured ellipses (see SYNTHETIC_CLASSES) crossing it at 2-6 px
+    per frame, entering at random times. With `drift`, the background
+    brightness changes linearly by that fraction over the clip (lighting
+    drift); n_objects=0 gives the true background of every frame.
+
+    Returns:
+      frames  : list of (H, W, 3) uint8 BGR frames
+      objects : list of dicts (cls, t0, t1, y, x_from, x_to, axes); the
+                object is visible for t0 <= t < t1
+    """
+    rng = np.random.default_rng(seed)
+    grad = np.linspace(60, 180, W, dtype=np.float32)
+    bg = np.repeat(np.repeat(grad[None, :, None], H, 0), 3, 2).astype(np.uint8)
+    objects = []
+    for k in range(n_objects):
+        axes = (int(rng.integers(12, 40)), int(rng.integers(8, 25)))
+        span = int((W + 2 * axes[0]) / rng.uniform(2, 6))
+        t0 = int(rng.integers(0, max(1, n_frames - span // 2)))
+        y = float(rng.uniform(axes[1], H - axes[1]))
+        x_from, x_to = (-axes[0], W + axes[0])[:: 1 if k % 2 else -1]
+        cid = list(SYNTHETIC_CLASSES)[k % len(SYNTHETIC_CLASSES)]
+        objects.append(
+            dict(cls=cid, t0=t0, t1=t0 + span, y=y, x_from=x_from, x_to=x_to, axes=axes)
+        )
+    frames = []
+    for t in range(n_frames):
+        if drift:
+            gain = 1.0 + drift * t / max(n_frames - 1, 1)
+            f = np.clip(bg * gain, 0, 255).astype(np.uint8)
+        else:
+            f = bg.copy()
+        for o in objects:
+            center = synthetic_object_at(o, t)
+            if center is None:
+                continue
+            color = SYNTHETIC_CLASSES[o["cls"]][1]
+            cv2.ellipse(f, center, o["axes"], 0, 0, 360, color, -1)
+        frames.append(f)
+    return frames, objects
+
+
+def synthetic_object_at(o, t):
+    """Ellipse centre of a make_synthetic_clip object at frame t, or None."""
+    if not o["t0"] <= t < o["t1"]:
+        return None
+    a = (t - o["t0"]) / (o["t1"] - o["t0"])
+    return int(o["x_from"] + a * (o["x_to"] - o["x_from"])), int(o["y"])
+
+
+class GroundTruthDetector(Detector):
+    """
+    Stub detector for make_synthetic_clip videos: returns the exact mask
+    and box of every visible object, so no weights or GPU are needed.
+    Frames must be passed in order, each exactly once.
+    """
+
+    def __init__(self, objects, H, W):
+        self.objects = objects
+        self.H, self.W = H, W
+        self.names = {cid: name for cid, (name, _) in SYNTHETIC_CLASSES.items()}
+        self.t = 0
+
+    def detect(self, frames):
+        out = []
+        for _ in frames:
+            boxes, cls, masks = [], [], []
+            for o in self.objects:
+                center = synthetic_object_at(o, self.t)
+                if center is None:
+                    continue
+                mask = np.zeros((self.H, self.W), dtype=np.uint8)
+                cv2.ellipse(mask, center, o["axes"], 0, 0, 360, 1, -1)
+                x, y, w, h = cv2.boundingRect(mask)
+                if w == 0:
+                    continue  # fully off-screen
+                boxes.append((x, y, x + w, y + h))
+                cls.append(o["cls"])
+                masks.append(mask.view(bool))
+            self.t += 1
+            if boxes:
+                out.append(Detections(boxes, np.ones(len(boxes)), cls, np.stack(masks)))
+            else:
+                out.append(Detections.empty(self.H, self.W))
+        return out
+
+
+class FramePool:
+    """
+    Read-only stand-in for a long source video: frame t is one of `n`
+    random frames, so renderers can be timed without decoding.
+    """
+
+    def __init__(self, n_frames, H=380, W=640, n=8, seed=0):
+        rng = np.random.default_rng(seed)
+        self.pool = rng.integers(0, 256, (n, H, W, 3), dtype=np.uint8)
+        self.n_frames = n_frames
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, t):
+        return self.pool[t % len(self.pool)]
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+# scheduler scaling
+def bench_scheduler(
+    tube_counts=(10, 25, 50, 100), H=380, W=640, min_len=100, max_len=300, seed=0
+):
+    """
+    Time schedule_tubes_dynamic against schedule_tubes_bbox for a growing
+    number of tubes and check that both return the same schedule.
+    Default tube lengths are 4-12 s tracks at 25 fps.
+    """
+    rows = []
+    print(f"{'tubes':>6} {'syn_len':>8} {'greedy s':>10} {'bbox s':>10} {'speedup':>8}")
+    for n in tube_counts:
+        tubes = make_synthetic_tubes(n, H, W, min_len, max_len, seed=seed)
+        ref, t_ref = _timed(schedule_tubes_dynamic, tubes, H, W)
+        out, t_new = _timed(schedule_tubes_bbox, tubes, H, W)
+        assert out == ref, "bbox scheduler diverged from greedy"
+        rows.append(dict(tubes=n, syn_len=ref[1], greedy_s=t_ref, bbox_s=t_new))
+        print(
+            f"{n:>6} {ref[1]:>8} {t_ref:>10.3f} {t_new:>10.3f} {t_ref / t_new:>7.1f}x"
+        )
+    return rows
+
+
+# energy packing vs first-fit
+def bench_energy(
+    n_tubes=60, target_lens=(None, 200, 400), H=380, W=640, seed=1, **kwargs
+):
+    """
+    Synopsis length and total collision area of the energy engine for a
+    few length budgets, next to the zero-overlap greedy schedule.
+    """
+    tubes = make_synthetic_tubes(n_tubes, H, W, 40, 120, seed=seed)
+    table = CollisionTable(tubes)
+
+    def collision_area(shifts):
+        return sum(
+            table.area(i, int(j), shifts[j] - shifts[i])
+            for i in range(len(tubes))
+            for j in table.neighbors[i]
+            if i < j
+        )
+
+    rows = []
+    print(f"{'engine':>14} {'syn_len':>8} {'collision px':>13} {'time s':>8}")
+    (shifts, syn_len), t = _timed(schedule_tubes, tubes, H, W, "bbox")
+    rows.append(dict(engine="greedy", syn_len=syn_len, collision=0, time_s=t))
+    print(f"{'greedy':>14} {syn_len:>8} {0:>13} {t:>8.2f}")
+    for target_len in target_lens:
+        (shifts, syn_len), t = _timed(
+            schedule_tubes, tubes, H, W, "energy", target_len=target_len, **kwargs
+        )
+        area = collision_area(shifts)
+        name = f"energy@{target_len}"
+        rows.append(dict(engine=name, syn_len=syn_len, collision=area, time_s=t))
+        print(f"{name:>14} {syn_len:>8} {area:>13} {t:>8.2f}")
+    return rows
+
+
+# batched detection
+def bench_inference(
+    batch_sizes=(1, 2, 4, 8, 16), n_frames=128, H=380, W=640, yolo=False
+):
+    """
+    Frames/sec of extract_segmentation_tubes per detector batch size.
+    Uses the weight-free ColorKeyDetector + IouTracker unless `yolo`.
+    """
+    frames, _ = make_synthetic_clip(n_frames, H, W)
+    if yolo:
+        detector = YoloSegDetector(conf=0.25, imgsz=max(H, W))
+    else:
+        detector = ColorKeyDetector(SYNTHETIC_CLASSES)
+    keep = list(detector.names.values())
+    rows = []
+    for bs in batch_sizes:
+        tracker = UltralyticsTracker() if yolo else IouTracker()
+        (tubes, _), t = _timed(
+            extract_segmentation_tubes,
+            frames,
+            keep,
+            batch_size=bs,
+            detector=detector,
+            tracker=tracker,
+        )
+        rows.append(dict(batch_size=bs, fps=n_frames / t, tubes=len(tubes)))
+    print(f"{'batch':>6} {'frames/s':>10} {'tubes':>6}")
+    for r in rows:
+        print(f"{r['batch_size']:>6} {r['fps']:>10.1f} {r['tubes']:>6}")
+    return rows
+
+
+# background models
+def bench_background(n_frames=600, H=380, W=640, drift=0.4, interval=100, seed=3):
+    """
+    Per-frame update cost and accuracy of the online median timeline, the
+    MOG2 path of extract_background_mog2 and the stacked median, on a clip
+    whose lighting drifts by `drift`. Error is the mean absolute difference
+    to the true background, averaged over all frames (the static models
+    use one image for the whole clip).
+    """
+    frames, _ = make_synthetic_clip(n_frames, H, W, 12, seed, drift)
+    truth, _ = make_synthetic_clip(n_frames, H, W, 0, seed, drift)
+
+    def error(bg_at):
+        return float(
+            np.mean(
+                [
+                    np.abs(bg_at(t).astype(np.int16) - truth[t]).mean()
+                    for t in range(n_frames)
+                ]
+            )
+        )
+
+    timeline = BackgroundTimeline(interval)
+    t0 = time.perf_counter()
+    for t, f in enumerate(frames):
+        timeline.update(t, f)
+    t_online = time.perf_counter() - t0
+    timeline.finish(n_frames - 1)
+
+    mog = cv2.createBackgroundSubtractorMOG2(500, 16, True)
+    t0 = time.perf_counter()
+    for f in frames:
+        mog.apply(f, learningRate=0.05)
+    t_mog = time.perf_counter() - t0
+    mog_bg = mog.getBackgroundImage()
+
+    median_bg, t_median = _timed(compute_background_median, frames, 5, 200)
+
+    rows = [
+        dict(
+            model="online timeline", fps=n_frames / t_online, error=error(timeline.at)
+        ),
+        dict(model="mog2", fps=n_frames / t_mog, error=error(lambda t: mog_bg)),
+        dict(
+            model="stacked median",
+            fps=n_frames / t_median,
+            error=error(lambda t: median_bg),
+        ),
+    ]
+    print(f"{'model':>16} {'frames/s':>10} {'mean |err|':>11}")
+    for r in rows:
+        print(f"{r['model']:>16} {r['fps']:>10.1f} {r['error']:>11.2f}")
+    return rows
+
+
+# motion-gated inference
+def bench_motion_gate(n_frames=1200, n_objects=4, H=380, W=640, seed=4, yolo=False):
+    """
+    extract_segmentation_tubes with and without a MotionGate on a mostly
+    empty synthetic clip whose motion intervals are known: reports the
+    fraction of frames skipped, the speedup, and how many frames showing
+    an object were skipped (test_computeBackground.py requires none).
+    """
+    frames, objects = make_synthetic_clip(n_frames, H, W, n_objects, seed)
+    visible = np.zeros(n_frames, dtype=bool)
+    for o in objects:
+        visible[o["t0"] : min(o["t1"], n_frames)] = True
+    if yolo:
+        detector = YoloSegDetector(conf=0.25, imgsz=max(H, W))
+        keep = list(detector.names.values())
+    else:
+        detector = ColorKeyDetector(SYNTHETIC_CLASSES)
+        keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+
+    seen = np.zeros(n_frames, dtype=bool)
+
+    class Recorder:
+        # wraps the detector to record which frames reach it
+        names = detector.names
+
+        def __init__(self, frames):
+            self.index = {id(f): t for t, f in enumerate(frames)}
+
+        def detect(self, batch):
+            for f in batch:
+                seen[self.index[id(f)]] = True
+            return detector.detect(batch)
+
+    def tracker():
+        return UltralyticsTracker() if yolo else IouTracker()
+
+    (ref, _), t_ref = _timed(
+        extract_segmentation_tubes, frames, keep, detector=detector, tracker=tracker()
+    )
+    gate = MotionGate()
+    (out, _), t_gate = _timed(
+        extract_segmentation_tubes,
+        frames,
+        keep,
+        detector=Recorder(frames),
+        tracker=tracker(),
+        motion_gate=gate,
+    )
+    missed = int(np.count_nonzero(visible & ~seen))
+    row = dict(
+        frames=n_frames,
+        quiet_fraction=float(1 - visible.mean()),
+        skip_fraction=gate.skip_fraction,
+        missed_object_frames=missed,
+        tubes=len(ref),
+        tubes_gated=len(out),
+        speedup=t_ref / t_gate,
+    )
+    print(
+        f"quiet {100 * row['quiet_fraction']:.1f}%  skipped "
+        f"{100 * row['skip_fraction']:.1f}%  missed object frames {missed}"
+    )
+    print(
+        f"tubes {len(ref)} -> {len(out)}  time {t_ref:.2f}s -> {t_gate:.2f}s "
+        f"({row['speedup']:.2f}x)"
+    )
+    return [row]
+
+
+# tube building
+def _per_detection_tubes(blocks, min_disp):
+    """Tube building + refinement one detection at a time (previous code)."""
+    builders = {}
+    for t, (ids, cls, boxes, masks) in enumerate(blocks):
+        for obj_id, cls_id, mask, box in zip(ids, cls, masks, boxes):
+            patch, mask_box = crop_mask(mask > 0.5)
+            if patch is None:
+                continue
+            ys, xs = np.nonzero(patch)
+            cx, cy = int(xs.mean()) + mask_box[0], int(ys.mean()) + mask_box[1]
+            if obj_id not in builders:
+                builders[obj_id] = TubeBuilder(int(obj_id))
+            builders[obj_id].append(t, patch, mask_box, (cx, cy), box, cls_id)
+    refined = []
+    for b in builders.values():
+        tube = b.build()
+        last_cx = last_cy = None
+        keep = []
+        for idx, (x1, y1, x2, y2) in enumerate(tube.bboxes):
+            cx, cy = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+            if last_cx is None or np.hypot(cx - last_cx, cy - last_cy) >= min_disp:
+                keep.append(idx)
+                last_cx, last_cy = cx, cy
+        if len(keep) > 1:
+            refined.append(tube.take(keep))
+    return refined
+
+
+def _columnar_tubes(blocks, min_disp):
+    table = DetectionTable()
+    for t, (ids, cls, boxes, masks) in enumerate(blocks):
+        table.append(*frame_rows(t, ids, cls, boxes, masks, search_boxes=boxes))
+    return refine_tubes_by_bbox_disp(table.to_tubes(), min_disp=min_disp)
+
+
+def bench_tube_building(n_frames=240, n_objects=24, H=380, W=640, min_disp=5, seed=6):
+    """
+    Detections/sec of tube building + displacement refinement from tracked
+    per-frame detections with full-frame float masks: the previous
+    per-detection code against detectionTable + the vectorized refinement
+    (test_detectionTable.py checks they return the same tubes).
+    """
+    rng = np.random.default_rng(seed)
+    # a pool of 8 frames of detections, replayed with moving track ids
+    pool = []
+    for _ in range(8):
+        masks = np.zeros((n_objects, H, W), dtype=np.float32)
+        boxes = np.zeros((n_objects, 4), dtype=int)
+        for k in range(n_objects):
+            a, b = int(rng.integers(8, 40)), int(rng.integers(8, 40))
+            cx, cy = int(rng.integers(a, W - a)), int(rng.integers(b, H - b))
+            cv2.ellipse(masks[k], (cx, cy), (a, b), 0, 0, 360, 0.9, -1)
+            boxes[k] = (cx - a, cy - b, cx + a, cy + b)
+        pool.append((boxes, masks))
+    cls = np.array([k % 3 for k in range(n_objects)])
+    blocks = []
+    for t in range(n_frames):
+        boxes, masks = pool[t % len(pool)]
+        ids = np.arange(n_objects) + n_objects * (t // 60)  # new tracks every 60
+        blocks.append((ids, cls, boxes, masks))
+    n_dets = n_frames * n_objects
+
+    ref, t_ref = _timed(_per_detection_tubes, blocks, min_disp)
+    out, t_new = _timed(_columnar_tubes, blocks, min_disp)
+    rows = [
+        dict(builder="per-detection", dets_per_s=n_dets / t_ref),
+        dict(builder="columnar", dets_per_s=n_dets / t_new),
+    ]
+    print(f"{n_dets} detections -> {len(out)} tubes")
+    print(f"{'builder':>14} {'dets/s':>10}")
+    for r in rows:
+        print(f"{r['builder']:>14} {r['dets_per_s']:>10.0f}")
+    return rows
+
+
+# class-pair mask merging
+def bench_merge(tube_counts=(100, 300, 1000), window=600, seed=7):
+    """
+    Time merge_masks_by_class for a growing number of tubes packed into
+    `window` source frames (a busy scene); synthetic classes 0 and 1 play
+    rider and vehicle.
+    """
+    rows = []
+    print(f"{'tubes':>6} {'time s':>8}")
+    for n in tube_counts:
+        tubes = make_synthetic_tubes(n, min_len=40, max_len=100, seed=seed)
+        for t in tubes:
+            t.frames[:] = t.frames % window
+        _, t = _timed(merge_masks_by_class, tubes, [(0, 1)], 0.1)
+        rows.append(dict(tubes=n, time_s=t))
+        print(f"{n:>6} {t:>8.3f}")
+    return rows
+
+
+# synopsis rendering
+def bench_render(n_tubes=40, H=380, W=640, seed=2):
+    """
+    Synopsis frames/sec of build_synopsis_with_time (bbox-local, one pass
+    per synopsis frame) against the float reference renderer, checking that
+    they agree to within 1 per pixel.
+    """
+    tubes = make_synthetic_tubes(n_tubes, H, W, 40, 120, seed=seed)
+    shifts, syn_len = schedule_tubes(tubes, H, W, "bbox")
+    frames = FramePool(int(max(t.frames[-1] for t in tubes)) + 1, H, W)
+    background = np.full((H, W, 3), 96, dtype=np.uint8)
+    ref, t_ref = _timed(
+        build_synopsis_reference, frames, tubes, shifts, syn_len, background
+    )
+    out, t_new = _timed(
+        build_synopsis_with_time, frames, tubes, shifts, syn_len, background
+    )
+    diff = max(int(np.abs(a.astype(np.int16) - b).max()) for a, b in zip(ref, out))
+    assert diff <= 1, f"renderer diverged from reference by {diff}"
+    _, t_soft = _timed(
+        build_synopsis_with_time,
+        frames,
+        tubes,
+        shifts,
+        syn_len,
+        background,
+        feather=True,
+    )
+    rows = [
+        dict(renderer="reference", fps=syn_len / t_ref),
+        dict(renderer="roi", fps=syn_len / t_new, max_diff=diff),
+        dict(renderer="roi+feather", fps=syn_len / t_soft),
+    ]
+    print(f"{syn_len} synopsis frames, {n_tubes} tubes, max |diff| = {diff}")
+    print(f"{'renderer':>12} {'frames/s':>10}")
+    for r in rows:
+        print(f"{r['renderer']:>12} {r['fps']:>10.1f}")
+    return rows
+
+
+def bench_multi_render(n_frames=600, n_objects=24, H=380, W=640, seed=8):
+    """
+    Per-class + all-classes synopses of a synthetic video decoded through
+    a VideoFrameSource: one iter_synopsis_frames pass per output against
+    one iter_multi_synopsis_frames pass, with and without feathering;
+    frames decoded and distance transforms come from the profiler.
+    """
+    keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "input.avi")
+        frames, objects = make_synthetic_clip(n_frames, H, W, n_objects, seed)
+        write_video(frames, path, 25)
+        tubes, _ = extract_segmentation_tubes(
+            frames,
+            keep,
+            detector=GroundTruthDetector(objects, H, W),
+            tracker=IouTracker(),
+        )
+        del frames
+        tubes = refine_tubes_by_bbox_disp(tubes)
+        groups = groub_tubes_by_classid(tubes)
+        groups[-1] = tubes
+        outputs = [
+            (g,) + tuple(schedule_tubes(g, H, W, "bbox")) for g in groups.values()
+        ]
+        background = np.full((H, W, 3), 96, dtype=np.uint8)
+        for feather in (False, True):
+            for mode in ("per-output", "multi"):
+                src = open_video_source(path, None, W, H)
+                PROFILER.enable()
+                t0 = time.perf_counter()
+                if mode == "multi":
+                    n = sum(
+                        1
+                        for _ in iter_multi_synopsis_frames(
+                            src, outputs, background, feather=feather
+                        )
+                    )
+                else:
+                    n = sum(
+                        1
+                        for g, shifts, L in outputs
+                        for _ in iter_synopsis_frames(
+                            src, g, shifts, L, background, feather=feather
+                        )
+                    )
+                secs = time.perf_counter() - t0
+                PROFILER.disable()
+                src.release()
+                rows.append(
+                    dict(
+                        mode=mode,
+                        feather=feather,
+                        time_s=secs,
+                        fps=n / secs,
+                        decoded=PROFILER.counters.get("frames_decoded", 0),
+                        dist_transforms=(
+                            PROFILER.stages["feather_alpha"].count if feather else 0
+                        ),
+                    )
+                )
+    print(f"{len(outputs)} outputs, {len(tubes)} tubes, {n_frames} source frames")
+    print(
+        f"{'mode':>11} {'feather':>7} {'time s':>7} {'frames/s':>9} "
+        f"{'decoded':>8} {'dist tf':>8}"
+    )
+    for r in rows:
+        print(
+            f"{r['mode']:>11} {str(r['feather']):>7} {r['time_s']:>7.2f} "
+            f"{r['fps']:>9.1f} {r['decoded']:>8} {r['dist_transforms']:>8}"
+        )
+    return rows
+
+
+def _output_bytes(path):
+    if os.path.isdir(path):
+        return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+    return os.path.getsize(path)
+
+
+def bench_encode(n_frames=300, n_tubes=30, H=380, W=640, n_outputs=4, seed=2):
+    """
+    Encode throughput and output size of every videoOutput codec (ffmpeg
+    codecs only when ffmpeg is installed) and of segmented output, on
+    pre-rendered synopsis frames; then n_outputs synopses written one
+    after another against a WriterPool of 1, 2 and 4 encoder threads.
+    """
+    tubes = make_synthetic_tubes(n_tubes, H, W, 40, 120, seed=seed)
+    shifts, _ = schedule_tubes(tubes, H, W, "bbox")
+    frames = FramePool(int(max(t.frames[-1] for t in tubes)) + 1, H, W)
+    background = np.full((H, W, 3), 96, dtype=np.uint8)
+    synopsis = list(iter_synopsis_frames(frames, tubes, shifts, n_frames, background))
+    has_ffmpeg = ffmpeg_path() is not None
+    options = [
+        (c, None) for c in CODECS if has_ffmpeg or CODECS[c]["backend"] != "ffmpeg"
+    ]
+    options.append(("mp4v", 50))
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for codec, segment_len in options:
+            path = output_path(
+                os.path.join(tmp, f"{codec}_{segment_len}"), codec, segment_len
+            )
+            try:
+                _, t = _timed(write_video, synopsis, path, 10, codec, segment_len)
+            except IOError as e:
+                print(f"{codec}: unavailable ({e})")
+                continue
+            size = _output_bytes(path)
+            rows.append(
+                dict(
+                    codec=codec if segment_len is None else f"{codec}/seg{segment_len}",
+                    fps=n_frames / t,
+                    mb=size / 2**20,
+                    kb_per_frame=size / 1024 / n_frames,
+                )
+            )
+
+        t0 = time.perf_counter()
+        for k in range(n_outputs):
+            write_video(iter(synopsis), os.path.join(tmp, f"seq_{k}.mp4"), 10)
+        pool_rows = [dict(encoders="sequential", time_s=time.perf_counter() - t0)]
+        for n_workers in (1, 2, 4):
+            t0 = time.perf_counter()
+            with WriterPool(n_workers) as pool:
+                for k in range(n_outputs):
+                    pool.write(iter(synopsis), os.path.join(tmp, f"pool_{k}.mp4"), 10)
+            pool_rows.append(dict(encoders=n_workers, time_s=time.perf_counter() - t0))
+
+    print(f"{n_frames} frames {W}x{H}, ffmpeg {'found' if has_ffmpeg else 'not found'}")
+    print(f"{'codec':>16} {'frames/s':>9} {'MB':>7} {'KB/frame':>9}")
+    for r in rows:
+        print(
+            f"{r['codec']:>16} {r['fps']:>9.1f} {r['mb']:>7.2f} {r['kb_per_frame']:>9.1f}"
+        )
+    print(f"{os.cpu_count()} CPUs, {n_outputs} mp4v outputs")
+    print(f"{'encoders':>12} {'time s':>8} {'speedup':>8}")
+    for r in pool_rows:
+        r["speedup"] = pool_rows[0]["time_s"] / r["time_s"]
+        print(f"{r['encoders']:>12} {r['time_s']:>8.2f} {r['speedup']:>7.2f}x")
+    return dict(codecs=rows, pool=pool_rows)
+
+
+# sharded extraction
+def bench_sharded(
+    worker_counts=(1, 2, 4), n_frames=800, shard_len=200, overlap=20, H=380, W=640
+):
+    """
+    Wall time of extract_tubes_sharded for a growing number of worker
+    processes on a synthetic video file (ColorKeyDetector + IouTracker),
+    with the tube count of the single-process extraction for reference.
+    """
+    frames, _ = make_synthetic_clip(n_frames, H, W, n_objects=16)
+    keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+    detector_factory = functools.partial(ColorKeyDetector, SYNTHETIC_CLASSES, 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "synthetic.avi")
+        write_video(frames, path, 25)
+        del frames
+        src = open_video_source(path, width=W, height=H)
+        (ref, _), t_ref = _timed(
+            extract_segmentation_tubes,
+            src,
+            keep,
+            detector=detector_factory(),
+            tracker=IouTracker(),
+        )
+        src.release()
+        rows = [dict(workers=0, time_s=t_ref, tubes=len(ref))]
+        for n in worker_counts:
+            (tubes, _), t = _timed(
+                extract_tubes_sharded,
+                path,
+                keep,
+                shard_len=shard_len,
+                overlap=overlap,
+                n_workers=n,
+                width=W,
+                height=H,
+                detector_factory=detector_factory,
+                tracker_factory=IouTracker,
+            )
+            rows.append(dict(workers=n, time_s=t, tubes=len(tubes)))
+    print(f"{os.cpu_count()} CPUs, {n_frames} frames, shards of {shard_len}")
+    print(f"{'workers':>8} {'time s':>8} {'speedup':>8} {'tubes':>6}")
+    for r in rows:
+        name = r["workers"] or "single"
+        print(
+            f"{name:>8} {r['time_s']:>8.2f} {t_ref / r['time_s']:>7.2f}x {r['tubes']:>6}"
+        )
+    return rows
+
+
+# end to end
+E2E_SWEEPS = {
+    "frames": [dict(n_frames=n) for n in (200, 400, 800)],
+    "resolution": [dict(W=w, H=h) for w, h in ((320, 190), (640, 380), (1280, 760))],
+    "objects": [dict(n_objects=n) for n in (4, 16, 32)],
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    # VmHWM restarts at exec, unlike ru_maxrss which a spawned child
+    # inherits from its parent on Linux
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_synthetic_video(path, n_frames=200, H=380, W=640, n_objects=8, seed=0):
+    """Write a make_synthetic_clip clip to `path`; returns its objects."""
+    frames, objects = make_synthetic_clip(n_frames, H, W, n_objects, seed)
+    write_video(frames, path, 25)
+    return objects
+
+
+def run_end_to_end(path, objects, n_frames, H, W, codec="mp4v", encode_workers=2):
+    """
+    One full synopsis run on a make_synthetic_video file with the
+    GroundTruthDetector, through the same path as main.py: a lazy
+    open_video_source (frames are decoded by the stages that read them,
+    so "load" is only the open), per-class plus all-classes outputs
+    rendered in one iter_multi_synopsis_frames pass and encoded by a
+    WriterPool. Reports the wall time of every stage (load, background,
+    extract, refine, schedule, compose, write), frames/sec and the peak
+    RSS of the process.
+    """
+    keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+    stages = {}
+    frames, stages["load"] = _timed(open_video_source, path, n_frames, W, H)
+    background, stages["background"] = _timed(
+        compute_background_timeline, frames, step=5, interval=1500
+    )
+    (tubes, names), stages["extract"] = _timed(
+        extract_segmentation_tubes,
+        frames,
+        keep,
+        detector=GroundTruthDetector(objects, H, W),
+        tracker=IouTracker(),
+    )
+    tubes, stages["refine"] = _timed(refine_tubes_by_bbox_disp, tubes)
+    groups = dict(groub_tubes_by_classid(tubes))
+    groups[-1] = tubes
+    t0 = time.perf_counter()
+    outputs = [(g, *schedule_tubes(g, H, W, "bbox")) for g in groups.values()]
+    stages["schedule"] = time.perf_counter() - t0
+    syn_len = outputs[-1][2]
+
+    # compose and write are interleaved: the time spent inside the
+    # renderer is compose, the rest (queueing frames to the encoder
+    # threads and waiting for them) is write
+    compose = 0.0
+    t_render = time.perf_counter()
+    pool = WriterPool(encode_workers, 32)
+    base = os.path.splitext(path)[0]
+    streams = [
+        pool.open(output_path(f"{base}_synopsis_{cid}", codec), 10, codec)
+        for cid in groups
+    ]
+    it = iter_multi_synopsis_frames(frames, outputs, background)
+    while True:
+        t0 = time.perf_counter()
+        item = next(it, None)
+        compose += time.perf_counter() - t0
+        if item is None:
+            break
+        streams[item[0]].write(item[1])
+    for stream in streams:
+        stream.close()
+    pool.close()
+    stages["compose"] = compose
+    stages["write"] = time.perf_counter() - t_render - compose
+    frames.release()
+
+    total = sum(stages.values())
+    return dict(
+        n_frames=n_frames,
+        width=W,
+        height=H,
+        n_objects=len(objects),
+        tubes=len(tubes),
+        synopsis_frames=syn_len,
+        stages_s=stages,
+        total_s=total,
+        fps=n_frames / total,
+        peak_rss_mb=peak_rss_mb(),
+    )
+
+
+def bench_end_to_end(sweeps=("frames", "resolution", "objects")):
+    """
+    Sweep run_end_to_end over frame count, resolution and object count
+    (E2E_SWEEPS), each run in a fresh process so peak RSS is its own; the
+    synthetic videos are generated beforehand, outside the measurement.
+    """
+    ctx = mp.get_context("spawn")
+    rows = []
+    print(
+        f"{'sweep':>10} {'frames':>6} {'size':>9} {'objs':>4} {'tubes':>5} "
+        + " ".join(f"{s:>8}" for s in _E2E_STAGES)
+        + f" {'fps':>7} {'rss MB':>7}"
+    )
+    for sweep in sweeps:
+        for params in E2E_SWEEPS[sweep]:
+            cfg = dict(n_frames=200, H=380, W=640, n_objects=8)
+            cfg.update(params)
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "input.avi")
+                objects = make_synthetic_video(path, **cfg)
+                with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                    r = pool.submit(
+                        run_end_to_end,
+                        path,
+                        objects,
+                        cfg["n_frames"],
+                        cfg["H"],
+                        cfg["W"],
+                    ).result()
+            r["sweep"] = sweep
+            rows.append(r)
+            print(
+                f"{sweep:>10} {r['n_frames']:>6} {r['width']:>4}x{r['height']:<4} "
+                f"{r['n_objects']:>4} {r['tubes']:>5} "
+                + " ".join(f"{r['stages_s'][s]:>8.3f}" for s in _E2E_STAGES)
+                + f" {r['fps']:>7.1f} {r['peak_rss_mb']:>7.0f}"
+            )
+    return rows
+
+
+_E2E_STAGES = (
+    "load",
+    "background",
+    "extract",
+    "refine",
+    "schedule",
+    "compose",
+    "write",
+)
+
+
+def bench_profiler(n_frames=200, H=380, W=640, n_objects=8, repeats=3, seed=0):
+    """
+    Cost of the stage profiler: best-of-`repeats` run_end_to_end time with
+    the profiler off, on (timers, counters, trace events) and on with
+    tracemalloc peaks, plus the stage report of the last profiled run.
+    """
+    modes = {
+        "off": None,
+        "on": dict(trace=True),
+        "on+memory": dict(trace=True, memory=True),
+    }
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "input.avi")
+        objects = make_synthetic_video(path, n_frames, H, W, n_objects, seed)
+        run_end_to_end(path, objects, n_frames, H, W)  # warm-up
+        for mode, kwargs in modes.items():
+            best = float("inf")
+            for _ in range(repeats):
+                if kwargs is not None:
+                    PROFILER.enable(**kwargs)
+                t0 = time.perf_counter()
+                run_end_to_end(path, objects, n_frames, H, W)
+                best = min(best, time.perf_counter() - t0)
+                PROFILER.disable()
+            rows.append(dict(mode=mode, time_s=best, events=len(PROFILER.events)))
+    print(f"{'profiler':>10} {'time s':>8} {'overhead':>9} {'events':>7}")
+    for r in rows:
+        r["overhead"] = r["time_s"] / rows[0]["time_s"] - 1
+        print(
+            f"{r['mode']:>10} {r['time_s']:>8.3f} {100 * r['overhead']:>8.1f}% "
+            f"{r['events']:>7}"
+        )
+    PROFILER.print_report()
+    rows.append(PROFILER.report())
+    return rows
+
+
+class _Crash(Exception):
+    pass
+
+
+class CrashingDetector(GroundTruthDetector):
+    """GroundTruthDetector that raises once it reaches frame crash_at."""
+
+    def __init__(self, objects, H, W, crash_at):
+        super().__init__(objects, H, W)
+        self.crash_at = crash_at
+
+    def detect(self, frames):
+        if self.t + len(frames) > self.crash_at:
+            raise _Crash(f"crashed at frame {self.t}")
+        return super().detect(frames)
+
+
+def _tube_summary(tubes):
+    return sorted((int(t.frames[0]), len(t), int(t.frames[-1])) for t in tubes)
+
+
+class _TimedCheckpoint:
+    """ExtractionCheckpoint proxy adding up the time spent in its methods."""
+
+    def __init__(self, ckpt):
+        self.ckpt = ckpt
+        self.busy_s = 0.0
+
+    def __getattr__(self, name):
+        attr = getattr(self.ckpt, name)
+        if not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.busy_s += time.perf_counter() - t0
+
+        return timed
+
+
+def bench_checkpoint(
+    n_frames=1200,
+    n_objects=16,
+    H=380,
+    W=640,
+    chunks=(100, 250, 1000),
+    repeats=8,
+    seed=9,
+):
+    """
+    Extraction with checkpoints (GroundTruthDetector + IouTracker) on
+    in-memory frames, after a warm-up run: median and interquartile
+    spread of `repeats` times (runs of every chunk_len and of no
+    checkpoint interleaved), and per chunk_len the time spent in the
+    checkpoint (all calls, and the writes) against the run without one,
+    and the bytes written; then a run
+    that crashes at 70% of the video, resumed from its last chunk and
+    compared with the uninterrupted tubes (count, detections and tubes
+    with the same start/length/end).
+    """
+    keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+    frames, objects = make_synthetic_clip(n_frames, H, W, n_objects, seed)
+
+    def extract(checkpoint=None, detector=None):
+        return extract_segmentation_tubes(
+            frames,
+            keep,
+            detector=detector or GroundTruthDetector(objects, H, W),
+            tracker=IouTracker(),
+            checkpoint=checkpoint,
+        )[0]
+
+    configs = (None,) + tuple(chunks)
+    runs = {c: [] for c in configs}
+    with tempfile.TemporaryDirectory() as tmp:
+        reference = extract()  # warm-up
+        # configurations interleaved, in a rotating order, so drift of the
+        # machine (caches, frequency, other load) hits them all alike
+        for k in range(repeats):
+            for chunk_len in configs[k % len(configs) :] + configs[: k % len(configs)]:
+                ckpt = None
+                if chunk_len is not None:
+                    ckpt = _TimedCheckpoint(
+                        ExtractionCheckpoint(
+                            os.path.join(tmp, f"c{chunk_len}_{k}"), chunk_len
+                        )
+                    )
+                gc.collect()
+                _, secs = _timed(extract, ckpt)
+                runs[chunk_len].append(
+                    (
+                        secs,
+                        ckpt.busy_s if ckpt else 0.0,
+                        ckpt.write_s if ckpt else 0.0,
+                        _output_bytes(ckpt.path) if ckpt else 0,
+                    )
+                )
+        rows = []
+        for c, r in runs.items():
+            secs, ckpt_s, write_s, n_bytes = np.array(r).T
+            rows.append(
+                dict(
+                    chunk_len=c,
+                    time_s=float(np.median(secs)),
+                    time_spread_s=float(
+                        np.percentile(secs, 75) - np.percentile(secs, 25)
+                    ),
+                    ckpt_s=float(np.median(ckpt_s)),
+                    write_s=float(np.median(write_s)),
+                    bytes=int(n_bytes[0]),
+                )
+            )
+
+        chunk_len = chunks[0]
+        path = os.path.join(tmp, "crash")
+        crash_at = int(0.7 * n_frames)
+        try:
+            extract(
+                ExtractionCheckpoint(path, chunk_len),
+                CrashingDetector(objects, H, W, crash_at),
+            )
+        except _Crash as e:
+            print(f"[INFO] {e}")
+        ckpt = ExtractionCheckpoint(path, chunk_len)
+        detector = GroundTruthDetector(objects, H, W)
+        detector.t = start = ckpt.resume_from()
+        resumed, secs = _timed(extract, ckpt, detector)
+    ref, res = _tube_summary(reference), _tube_summary(resumed)
+    resume = dict(
+        crash_at=crash_at,
+        resumed_at=start,
+        resume_s=secs,
+        tubes=(len(ref), len(res)),
+        detections=(sum(n for _, n, _ in ref), sum(n for _, n, _ in res)),
+        identical_tubes=len(set(ref) & set(res)),
+    )
+
+    base = rows[0]["time_s"]
+    # the run times differ by the checkpoint's own time (ckpt s: every
+    # checkpoint call, write s: the chunk commits) plus machine noise of
+    # about the interquartile spread
+    print(
+        f"{'chunk_len':>10} {'time s':>8} {'+/- s':>7} {'overhead':>9} "
+        f"{'ckpt s':>7} {'ckpt %':>7} {'write s':>8} {'MB':>7}"
+    )
+    for r in rows:
+        r["overhead"] = r["time_s"] / base - 1
+        r["ckpt_share"] = r["ckpt_s"] / base
+        print(
+            f"{str(r['chunk_len']):>10} {r['time_s']:>8.3f} "
+            f"{r['time_spread_s']:>7.3f} {100 * r['overhead']:>8.1f}% "
+            f"{r['ckpt_s']:>7.3f} {100 * r['ckpt_share']:>6.1f}% "
+            f"{r['write_s']:>8.3f} {r['bytes'] / 2**20:>7.2f}"
+        )
+    print(
+        f"crash at {crash_at}, resumed at {start} in {secs:.2f}s: "
+        f"tubes {resume['tubes'][0]} -> {resume['tubes'][1]}, "
+        f"detections {resume['detections'][0]} -> {resume['detections'][1]}, "
+        f"{resume['identical_tubes']} identical"
+    )
+    rows.append(resume)
+    return rows
+
+
+def _union_masks(tubes, t, H, W):
+    out = np.zeros((H, W), dtype=bool)
+    for tube in tubes:
+        for i in np.flatnonzero(tube.frames == t):
+            x1, y1, x2, y2 = tube.mask_boxes[i]
+            out[y1:y2, x1:x2] |= tube.patch(i)
+    return out
+
+
+def bench_lod(n_frames=300, H=760, W=1280, n_objects=12, scales=(1, 2, 4), seed=10):
+    """
+    Level-of-detail mode on a synthetic W x H clip: detection (ColorKey),
+    tracking and bbox scheduling on a 1/scale proxy, rendering at full
+    size with masks upsampled at render time (tube_size). Reports the
+    time of every stage and the IoU of the upsampled object masks with
+    the full-resolution ones (every 5th frame).
+    """
+    keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+    frames, _ = make_synthetic_clip(n_frames, H, W, n_objects, seed)
+    background = compute_background_median(frames, step=10)
+    rows, full = [], None
+    for scale in scales:
+        w, h = W // scale, H // scale
+        stages = {}
+        proxy, stages["resize"] = _timed(resize_frames, frames, w, h)
+        (tubes, _), stages["extract"] = _timed(
+            extract_segmentation_tubes,
+            proxy,
+            keep,
+            detector=ColorKeyDetector(SYNTHETIC_CLASSES),
+            tracker=IouTracker(),
+        )
+        (shifts, L), stages["schedule"] = _timed(schedule_tubes, tubes, h, w, "bbox")
+        t0 = time.perf_counter()
+        n = 0
+        for _ in iter_multi_synopsis_frames(
+            frames, [(tubes, shifts, L)], background, tube_size=(w, h)
+        ):
+            n += 1
+        stages["render"] = time.perf_counter() - t0
+        scaled = [tube.scaled(W / w, H / h, W, H) for tube in tubes]
+        if full is None:
+            full = scaled
+        ious = []
+        for t in range(0, n_frames, 5):
+            a, b = _union_masks(full, t, H, W), _union_masks(scaled, t, H, W)
+            if a.any() or b.any():
+                ious.append((a & b).sum() / (a | b).sum())
+        rows.append(
+            dict(
+                scale=scale,
+                proxy=f"{w}x{h}",
+                tubes=len(tubes),
+                synopsis_len=L,
+                frames=n,
+                mask_iou=float(np.mean(ious)),
+                total_s=sum(stages.values()),
+                **{f"{k}_s": v for k, v in stages.items()},
+            )
+        )
+    print(f"render size {W}x{H}, {n_frames} frames, {n_objects} objects")
+    print(
+        f"{'proxy':>10} {'tubes':>6} {'syn len':>8} {'extract':>8} "
+        f"{'schedule':>9} {'render':>7} {'total s':>8} {'mask IoU':>9}"
+    )
+    for r in rows:
+        print(
+            f"{r['proxy']:>10} {r['tubes']:>6} {r['synopsis_len']:>8} "
+            f"{r['extract_s']:>8.2f} {r['schedule_s']:>9.2f} {r['render_s']:>7.2f} "
+            f"{r['total_s']:>8.2f} {r['mask_iou']:>9.3f}"
+        )
+    return rows
+
+
+def bench_tube_store(
+    tube_counts=(1000, 10000), n_frames=2_160_000, H=380, W=640, seed=11
+):
+    """
+    TubeStore queries over tubes spread across a day of 25 fps video:
+    open time (index build), then per query its time and matches against
+    loading every tube (checkpoint.load_tubes) and filtering in Python,
+    and the bbox scheduling time of the combined query's result.
+    """
+    names = {0: "person", 1: "bicycle", 2: "car"}
+    queries = {
+        "1 hour": dict(time_range=(0, n_frames // 24)),
+        "cars": dict(classes=["car"]),
+        "left lane": dict(region=(0, 0, W // 3, H)),
+        "cars, left, 1h": dict(
+            classes=["car"], time_range=(0, n_frames // 24), region=(0, 0, W // 3, H)
+        ),
+    }
+
+    def brute(tubes, classes=None, time_range=None, region=None):
+        out = []
+        for t in tubes:
+            if classes and names[t.cls_id] not in classes:
+                continue
+            if time_range and not (
+                t.frames[0] <= time_range[1] and t.frames[-1] >= time_range[0]
+            ):
+                continue
+            if region:
+                keep = np.ones(len(t), dtype=bool)
+                if time_range:
+                    keep &= (t.frames >= time_range[0]) & (t.frames <= time_range[1])
+                cx = (t.bboxes[:, 0] + t.bboxes[:, 2]) / 2
+                cy = (t.bboxes[:, 1] + t.bboxes[:, 3]) / 2
+                keep &= (cx >= region[0]) & (cx < region[2])
+                keep &= (cy >= region[1]) & (cy < region[3])
+                if not keep.any():
+                    continue
+            out.append(t)
+        return out
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n in tube_counts:
+        tubes = make_synthetic_tubes(n, H, W, seed=seed)
+        for t in tubes:
+            t.frames += int(rng.integers(0, n_frames))
+        with tempfile.TemporaryDirectory() as tmp:
+            _, create_s = _timed(
+                TubeStore.create, os.path.join(tmp, "store"), tubes, names, (W, H), 25
+            )
+            save_tubes(os.path.join(tmp, "all.npz"), tubes)
+            store, open_s = _timed(TubeStore, os.path.join(tmp, "store"))
+            for label, q in queries.items():
+                found, query_s = _timed(store.query, **q)
+                ref, brute_s = _timed(
+                    lambda: brute(load_tubes(os.path.join(tmp, "all.npz")), **q)
+                )
+                row = dict(
+                    tubes=n,
+                    query=label,
+                    matched=len(found),
+                    brute_matched=len(ref),
+                    query_s=query_s,
+                    brute_s=brute_s,
+                    open_s=open_s,
+                    create_s=create_s,
+                )
+                if label == "cars, left, 1h":
+                    _, row["schedule_s"] = _timed(schedule_tubes, found, H, W, "bbox")
+                rows.append(row)
+    print(
+        f"{'tubes':>6} {'query':>15} {'matched':>8} {'query ms':>9} {'load+filter ms':>15}"
+    )
+    for r in rows:
+        print(
+            f"{r['tubes']:>6} {r['query']:>15} {r['matched']:>8} "
+            f"{1000 * r['query_s']:>9.1f} {1000 * r['brute_s']:>15.1f}"
+        )
+    for r in rows:
+        if "schedule_s" in r:
+            print(
+                f"{r['tubes']} tubes: create {r['create_s']:.2f}s, open "
+                f"{r['open_s']:.3f}s, schedule of the combined query "
+                f"{r['schedule_s']:.2f}s"
+            )
+    return rows
+
+
+class SlowDetector(Detector):
+    """
+    Wraps a stub detector with GPU-like latency: every forward pass
+    sleeps `fixed_s` plus `per_frame_s` per frame (releasing the GIL, as
+    a GPU call does), so batching across jobs pays off as it would.
+    """
+
+    def __init__(self, detector, fixed_s=0.02, per_frame_s=0.002):
+        self.detector = detector
+        self.names = detector.names
+        self.fixed_s = fixed_s
+        self.per_frame_s = per_frame_s
+
+    def detect(self, frames):
+        time.sleep(self.fixed_s + self.per_frame_s * len(frames))
+        return self.detector.detect(frames)
+
+
+def bench_batch(n_videos=8, n_frames=150, H=190, W=320, parallel=(1, 2, 4), seed=12):
+    """
+    BatchRunner on a job directory of synthetic videos, with a
+    ColorKeyDetector behind GPU-like latency (SlowDetector) shared by
+    every job: jobs/hour, per-job latency and frames per shared forward
+    pass for each number of concurrent jobs.
+    """
+    keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        videos = []
+        for k in range(n_videos):
+            path = os.path.join(tmp, f"cam{k:02d}.avi")
+            make_synthetic_video(path, n_frames, H, W, 6, seed + k)
+            videos.append(path)
+        for n_jobs in parallel:
+            root = os.path.join(tmp, f"jobs{n_jobs}")
+            jobs = JobQueue(root)
+            for path in videos:
+                shutil.copy(path, os.path.join(root, "inbox"))
+            runner = BatchRunner(
+                SlowDetector(ColorKeyDetector(SYNTHETIC_CLASSES, tol=40)),
+                tracker_factory=IouTracker,
+                out_dir=os.path.join(root, "out"),
+                n_jobs=n_jobs,
+                size=(W, H),
+                keep_classes=keep,
+            )
+            report = runner.run(jobs)
+            runner.close()
+            rows.append(dict(n_jobs=n_jobs, **report))
+    print(
+        f"{'jobs':>5} {'jobs/hour':>10} {'wall s':>7} {'lat mean':>9} "
+        f"{'lat p95':>8} {'passes':>7} {'frames/pass':>12} {'failed':>7}"
+    )
+    for r in rows:
+        d = r["detector"]
+        print(
+            f"{r['n_jobs']:>5} {r['jobs_per_hour']:>10.0f} {r['wall_s']:>7.1f} "
+            f"{r['latency_mean_s']:>9.2f} {r['latency_p95_s']:>8.2f} "
+            f"{d['forward_passes']:>7} {d['mean_batch']:>12.1f} {r['failed']:>7}"
+        )
+    return rows
+
+
+def bench_live(
+    n_frames=8000,
+    n_objects=200,
+    H=190,
+    W=320,
+    window=4000,
+    update_every=500,
+    segment_len=50,
+    seed=13,
+):
+    """
+    Rolling synopsis of the last `window` frames of a synthetic camera
+    (GroundTruthDetector + IouTracker), updated every update_every source
+    frames: LiveSynopsis (place the ended tracks, expire, re-render the
+    touched segments) against rescheduling and re-rendering every tube in
+    the window from scratch. Also checks that the incremental occupancy
+    equals the one rebuilt from the placed tubes.
+    """
+    keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+    frames, objects = make_synthetic_clip(n_frames, H, W, n_objects, seed)
+    background = compute_background_median(frames, step=10)
+    assembler = TubeAssembler(
+        IouTracker(), {cid: n for cid, (n, _) in SYNTHETIC_CLASSES.items()}, keep
+    )
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        live = LiveSynopsis(H, W, os.path.join(tmp, "live"), window, segment_len)
+        for t, f, dets in iter_detections(
+            frames, GroundTruthDetector(objects, H, W), 8
+        ):
+            assembler.add(t, f, dets)
+            if (t + 1) % update_every:
+                continue
+            t0 = time.perf_counter()
+            stats = update_live_synopsis(live, assembler, t + 1, frames, background)
+            live_s = time.perf_counter() - t0
+
+            # baseline: every tube of the window, from scratch
+            tubes = [tube for tube, _, _ in live.placed.values()]
+            t0 = time.perf_counter()
+            shifts, L = schedule_tubes(tubes, H, W, "bbox")
+            path = output_path(os.path.join(tmp, "full"), "mp4v")
+            write_video(
+                iter_synopsis_frames(frames, tubes, shifts, L, background),
+                path,
+            )
+            full_s = time.perf_counter() - t0
+            rows.append(
+                dict(t=t + 1, live_s=live_s, full_s=full_s, full_len=L, **stats)
+            )
+
+        occ = OccupancyVolume(H, W)
+        for tube, s, _ in live.placed.values():
+            occ.add(s, occ.footprint(tube), len(tube))
+        n = len(live)
+        consistent = bool(
+            np.array_equal(occ.bits[:n], live.occ.bits[:n])
+            and np.array_equal(occ.grid[:n], live.occ.grid[:n])
+            and not live.occ.bits[n:].any()
+        )
+    print(
+        f"{'t':>6} {'added':>6} {'expired':>8} {'length':>7} {'rendered':>9} "
+        f"{'live s':>7} {'full len':>9} {'full s':>7}"
+    )
+    for r in rows:
+        print(
+            f"{r['t']:>6} {r['added']:>6} {r['expired']:>8} {r['length']:>7} "
+            f"{r['rendered']:>9} {r['live_s']:>7.2f} {r['full_len']:>9} "
+            f"{r['full_s']:>7.2f}"
+        )
+    print(f"occupancy consistent with the placed tubes: {consistent}")
+    rows.append(dict(occupancy_consistent=consistent))
+    return rows
+
+
+def make_stationary_tubes(
+    n_tubes, length=600, H=190, W=320, noise=0.1, jitter=0.05, seed=0
+):
+    """
+    Long tubes of parked objects (ellipses), as a segmenter sees them:
+    in about half the frames a few boundary pixels flip, and now and
+    then the object jitters by a pixel.
+    """
+    rng = np.random.default_rng(seed)
+    tubes = []
+    for k in range(n_tubes):
+        ry, rx = int(rng.integers(10, 25)), int(rng.integers(15, 40))
+        cx = int(rng.integers(rx + 2, W - rx - 2))
+        cy = int(rng.integers(ry + 2, H - ry - 2))
+        yy, xx = np.mgrid[-ry : ry + 1, -rx : rx + 1]
+        shape = (xx / rx) ** 2 + (yy / ry) ** 2 <= 1
+        edge = shape & ~cv2.erode(shape.view(np.uint8), np.ones((3, 3))).view(bool)
+        ey, ex = np.nonzero(edge)
+        t0 = int(rng.integers(0, length))
+        boxes, patches = [], []
+        for j in range(length):
+            patch = shape
+            if rng.random() < 0.5:
+                patch = shape.copy()
+                flip = rng.integers(len(ey), size=max(1, int(noise * len(ey))))
+                patch[ey[flip], ex[flip]] = False
+            dx, dy = rng.integers(-1, 2, size=2) if rng.random() < jitter else (0, 0)
+            x1, y1 = cx - rx + int(dx), cy - ry + int(dy)
+            boxes.append((x1, y1, x1 + 2 * rx + 1, y1 + 2 * ry + 1))
+            patches.append(patch)
+        tubes.append(
+            Tube.from_patches(
+                k,
+                np.arange(t0, t0 + length),
+                [(cx, cy)] * length,
+                boxes,
+                [2] * length,
+                boxes,
+                patches,
+            )
+        )
+    return tubes
+
+
+def bench_mask_codec(
+    n_tubes=16, length=600, H=190, W=320, thresholds=(1.0, 0.97, 0.9), seed=14
+):
+    """
+    Keyframe mask codec (maskCodec) on long stationary tracks: mask
+    memory and encode time per IoU threshold, the worst and mean IoU of
+    the decoded masks, and the time of the stages working on the coded
+    tubes against the raw ones: bbox scheduling (footprints), energy
+    collision areas (CollisionTable over every neighbour pair and offsets
+    in steps of 25 frames) and the feathered sprites (SpriteCache).
+    """
+    tubes = make_stationary_tubes(n_tubes, length, H, W, seed=seed)
+    frames = [np.full((H, W, 3), 128, dtype=np.uint8)] * (2 * length)
+    offsets = range(-length + 1, length, 25)
+
+    def collisions(tubes):
+        table = CollisionTable(tubes)
+        return sum(
+            table.area(i, j, d)
+            for i in range(len(tubes))
+            for j in table.neighbors[i].tolist()
+            if i < j
+            for d in offsets
+        )
+
+    rows, ref = [], None
+    for th in (None,) + tuple(thresholds):
+        if th is None:
+            coded, encode_s = tubes, 0.0
+        else:
+            coded, encode_s = _timed(encode_tubes, tubes, th)
+        ious = [
+            (a & b).sum() / (a | b).sum()
+            for t, c in zip(tubes, coded)
+            for a, b in zip(t.patches(), c.patches())
+        ]
+        PROFILER.reset()
+        PROFILER.enable()
+        (_, L), schedule_s = _timed(schedule_tubes, coded, H, W, "bbox")
+        area, collide_s = _timed(collisions, coded)
+        cache, sprite_s = _timed(SpriteCache, frames, coded, feather=True)
+        reused = PROFILER.counters.get("feather_alpha_reused", 0)
+        PROFILER.disable()
+        if ref is None:
+            ref = dict(L=L, area=area, alpha=np.asarray(cache.alpha))
+        rows.append(
+            dict(
+                iou_thresh=th,
+                mask_bytes=sum(int(t._bits.nbytes) for t in coded),
+                keyframes=sum(getattr(t, "n_keyframes", len(t)) for t in coded),
+                encode_s=encode_s,
+                iou_min=float(np.min(ious)),
+                iou_mean=float(np.mean(ious)),
+                schedule_s=schedule_s,
+                synopsis_len=L,
+                collide_s=collide_s,
+                collision_area=area,
+                sprite_s=sprite_s,
+                distance_transforms=n_tubes * length - reused,
+                lossless=bool(
+                    area == ref["area"]
+                    and L == ref["L"]
+                    and np.array_equal(cache.alpha, ref["alpha"])
+                ),
+            )
+        )
+    print(f"{n_tubes} stationary tubes of {length} frames, {W}x{H}")
+    print(
+        f"{'IoU th':>6} {'mask KB':>8} {'keys':>6} {'encode':>7} {'IoU min':>8} "
+        f"{'schedule':>9} {'collide':>8} {'sprites':>8} {'dist tf':>8} {'exact':>5}"
+    )
+    for r in rows:
+        th = "raw" if r["iou_thresh"] is None else f"{r['iou_thresh']:.2f}"
+        print(
+            f"{th:>6} {r['mask_bytes'] / 1024:>8.0f} {r['keyframes']:>6} "
+            f"{r['encode_s']:>7.2f} {r['iou_min']:>8.3f} {r['schedule_s']:>9.2f} "
+            f"{r['collide_s']:>8.2f} {r['sprite_s']:>8.2f} "
+            f"{r['distance_transforms']:>8} {str(r['lossless']):>5}"
+        )
+    return rows
+
+
+# cold-start budgets (s) per synopsisCli subcommand: process launch up
+# to the subcommand's modules being imported (STAGE_MODULES)
+STARTUP_BUDGET_S = {
+    "help": 0.25,
+    "schedule": 0.6,
+    "render": 0.6,
+    "extract": 0.8,
+    "full": 0.8,
+    "live": 0.8,
+}
+HEAVY_MODULES = ("torch", "ultralytics", "tqdm")
+# subcommands that must not load any of HEAVY_MODULES at all
+LIGHT_COMMANDS = ("help", "schedule", "render")
+_STARTUP_PROBE = (
+    "import json, sys, time; t0 = time.perf_counter(); import synopsisCli; "
+    "cmd = sys.argv[1]; cmd == 'help' or synopsisCli.load_stage(cmd); "
+    "print(json.dumps([time.perf_counter() - t0, "
+    f"[m for m in {HEAVY_MODULES!r} if m in sys.modules]]))"
+)
+
+
+def probe_startup(cmd, repeats=5):
+    """
+    Cold start of synopsisCli subcommand `cmd` in a fresh interpreter
+    (best of `repeats`): imports the CLI and the subcommand's modules
+    ("help" parses arguments only).
+
+    Returns:
+      dict with the wall and import times, the HEAVY_MODULES loaded and
+      `ok`: within STARTUP_BUDGET_S, and no heavy module for LIGHT_COMMANDS
+    """
+    base = os.path.dirname(os.path.abspath(__file__))
+    best = imports = heavy = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", _STARTUP_PROBE, cmd],
+            cwd=base,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        wall = time.perf_counter() - t0
+        import_s, loaded = json.loads(out.splitlines()[-1])
+        if best is None or wall < best:
+            best, imports = wall, import_s
+        heavy = sorted(set(heavy or ()) | set(loaded))
+    budget = STARTUP_BUDGET_S[cmd]
+    return dict(
+        cmd=cmd,
+        wall_s=best,
+        import_s=imports,
+        budget_s=budget,
+        heavy=heavy,
+        ok=best <= budget and not (cmd in LIGHT_COMMANDS and heavy),
+    )
+
+
+def bench_startup(repeats=5):
+    """
+    probe_startup for every subcommand of STARTUP_BUDGET_S. Exits
+    non-zero when one is over budget or a light subcommand loads a heavy
+    module; test_startup.py runs the same checks with the test suite.
+    """
+    rows = [probe_startup(cmd, repeats) for cmd in STARTUP_BUDGET_S]
+    print(f"{'command':>9} {'wall s':>7} {'import s':>9} {'budget':>7}  heavy")
+    for r in rows:
+        flag = ""
+        if not r["ok"]:
+            flag = "  HEAVY IMPORT" if r["wall_s"] <= r["budget_s"] else "  OVER BUDGET"
+        print(
+            f"{r['cmd']:>9} {r['wall_s']:>7.2f} {r['import_s']:>9.2f} "
+            f"{r['budget_s']:>7.2f}  {','.join(r['heavy']) or '-'}{flag}"
+        )
+    return rows
+
+
+BENCHMARKS = {
+    "scheduler": bench_scheduler,
+    "energy": bench_energy,
+    "inference": bench_inference,
+    "render": bench_render,
+    "encode": bench_encode,
+    "multi_render": bench_multi_render,
+    "background": bench_background,
+    "sharded": bench_sharded,
+    "motion_gate": bench_motion_gate,
+    "tube_building": bench_tube_building,
+    "merge": bench_merge,
+    "end_to_end": bench_end_to_end,
+    "profiler": bench_profiler,
+    "checkpoint": bench_checkpoint,
+    "lod": bench_lod,
+    "tube_store": bench_tube_store,
+    "batch": bench_batch,
+    "live": bench_live,
+    "mask_codec": bench_mask_codec,
+    "startup": bench_startup,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Video synopsis benchmarks")
+    parser.add_argument("names", nargs="*", default=list(BENCHMARKS))
+    parser.add_argument("--json", help="write all results to this JSON file")
+    args = parser.parse_args()
+    results = {}
+    for name in args.names:
+        print(f"== {name}")
+        results[name] = BENCHMARKS[name]()
+    over = [r["cmd"] for r in results.get("startup", ()) if not r["ok"]]
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1, default=float)
+        print(f"results written to {args.json}")
+    if over:
+        raise SystemExit(f"startup check failed: {', '.join(over)}")
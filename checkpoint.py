@@ -0,0 +1,272 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from computeBackground import BackgroundTimeline
+from detectionTable import COLUMNS, DetectionTable
+from profiler import PROFILER
+from tube import Tube
+
+
+def _write_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_npz(path, **arrays):
+    # uncompressed: a checkpoint must cost little next to the stage it saves
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def _concat(arrays, dtype, width=None):
+    if arrays:
+        return np.concatenate(arrays)
+    return np.zeros((0,) if width is None else (0, width), dtype=dtype)
+
+
+def save_tubes(path, tubes):
+    """
+    Write tube.Tube records to one .npz: the per-detection columns of all
+    tubes concatenated, with the packed masks as a single byte buffer
+    (keyframe-coded tubes are stored expanded).
+    """
+    tubes = [t.expanded() for t in tubes]
+    _save_npz(
+        path,
+        track_ids=np.array([t.track_id for t in tubes], dtype=np.int64),
+        lengths=np.array([len(t) for t in tubes], dtype=np.int64),
+        frames=_concat([t.frames for t in tubes], np.int32),
+        centroids=_concat([t.centroids for t in tubes], np.int32, 2),
+        bboxes=_concat([t.bboxes for t in tubes], np.int32, 4),
+        cls_ids=_concat([t.cls_ids for t in tubes], np.int32),
+        mask_boxes=_concat([t.mask_boxes for t in tubes], np.int32, 4),
+        bit_sizes=_concat([np.diff(t._offsets) for t in tubes], np.int64),
+        bits=_concat([np.asarray(t._bits) for t in tubes], np.uint8),
+    )
+
+
+def load_tubes(path):
+    """Inverse of save_tubes."""
+    with np.load(path) as z:
+        d = {k: z[k] for k in z.files}
+    starts = np.zeros(len(d["lengths"]) + 1, dtype=np.int64)
+    starts[1:] = np.cumsum(d["lengths"])
+    offsets = np.zeros(len(d["bit_sizes"]) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(d["bit_sizes"])
+    tubes = []
+    for k, track_id in enumerate(d["track_ids"].tolist()):
+        a, b = starts[k], starts[k + 1]
+        tubes.append(
+            Tube(
+                track_id,
+                d["frames"][a:b],
+                d["centroids"][a:b],
+                d["bboxes"][a:b],
+                d["cls_ids"][a:b],
+                d["mask_boxes"][a:b],
+                d["bits"][offsets[a] : offsets[b]],
+                offsets[a : b + 1] - offsets[a],
+            )
+        )
+    return tubes
+
+
+def save_background(path, timeline):
+    """Write the snapshots of a computeBackground.BackgroundTimeline."""
+    _save_npz(
+        path,
+        interval=np.int64(timeline.interval),
+        times=np.array(timeline.times, dtype=np.int64),
+        snapshots=np.stack(timeline.snapshots),
+    )
+
+
+def load_background(path):
+    """BackgroundTimeline holding the snapshots written by save_background."""
+    with np.load(path) as z:
+        timeline = BackgroundTimeline(int(z["interval"]))
+        timeline.times = z["times"].tolist()
+        timeline.snapshots = list(z["snapshots"])
+    timeline.model.bg = timeline.snapshots[-1].copy()
+    return timeline
+
+
+class ExtractionCheckpoint:
+    """
+    Tracked detections of an extraction, persisted every `chunk_len`
+    frames as DetectionTable chunks (.npz) listed in manifest.json.
+
+    A run that dies resumes `overlap` frames before the last committed
+    chunk with a fresh tracker, as a new segment; the segments are joined
+    afterwards like time shards (stitchTubes.stitch_shards), tracks being
+    matched over the overlap window. chunk_len must be at least twice the
+    overlap so that only neighbouring segments overlap.
+    """
+
+    def __init__(self, path, chunk_len=1000, overlap=50):
+        if chunk_len < 2 * overlap:
+            raise ValueError("chunk_len must be at least 2 * overlap")
+        self.path = path
+        self.chunk_len = chunk_len
+        self.overlap = overlap
+        os.makedirs(path, exist_ok=True)
+        self.manifest = _read_json(self._manifest_path()) or dict(
+            complete=False, names=None, n_frames=None, segments=[]
+        )
+        self._seg = None
+        self._rows, self._bits = [], []
+        self.write_s = 0.0
+
+    def _manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+
+    @property
+    def complete(self):
+        return self.manifest["complete"]
+
+    @property
+    def names(self):
+        names = self.manifest["names"] or {}
+        return {int(k): v for k, v in names.items()}
+
+    def resume_from(self):
+        """Source frame the next segment starts tracking at."""
+        segments = self.manifest["segments"]
+        if not segments:
+            return 0
+        last = segments[-1]
+        return max(last["done"] - self.overlap, last["start"])
+
+    def begin(self, start, names):
+        self.manifest["names"] = {str(k): v for k, v in names.items()}
+        self._seg = dict(start=int(start), done=int(start), chunks=[])
+        self._rows, self._bits = [], []
+        if start:
+            print(f"[CKPT] resuming extraction at frame {start}")
+
+    def add(self, rows, bits):
+        """Record one detectionTable.frame_rows block of the current segment."""
+        if len(rows):
+            self._rows.append(rows)
+            self._bits.extend(bits)
+
+    def step(self, t_next):
+        """Commit a chunk once chunk_len frames before t_next are pending."""
+        if t_next - self._seg["done"] >= self.chunk_len:
+            self.commit(t_next)
+
+    def commit(self, t_next):
+        t0 = time.perf_counter()
+        with PROFILER.span("checkpoint"):
+            rows = _concat(self._rows, np.int32, len(COLUMNS))
+            sizes = np.array([len(b) for b in self._bits], dtype=np.int64)
+            offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(sizes)
+            k = len(self.manifest["segments"])
+            if self._seg["chunks"]:
+                k -= 1  # current segment is already listed
+            name = f"seg{k:03d}_{t_next:09d}.npz"
+            _save_npz(
+                os.path.join(self.path, name),
+                rows=rows,
+                offsets=offsets,
+                bits=_concat(self._bits, np.uint8),
+            )
+            if not self._seg["chunks"]:
+                self.manifest["segments"].append(self._seg)
+            self._seg["chunks"].append(name)
+            self._seg["done"] = int(t_next)
+            _write_json(self._manifest_path(), self.manifest)
+        self._rows, self._bits = [], []
+        self.write_s += time.perf_counter() - t0
+
+    def finish(self, n_frames):
+        self.commit(n_frames)
+        self.manifest["complete"] = True
+        self.manifest["n_frames"] = int(n_frames)
+        _write_json(self._manifest_path(), self.manifest)
+
+    def segments(self):
+        """List of (start, done, DetectionTable), one per tracker session."""
+        out = []
+        for seg in self.manifest["segments"]:
+            table = DetectionTable()
+            for name in seg["chunks"]:
+                with np.load(os.path.join(self.path, name)) as z:
+                    rows, offsets, bits = z["rows"], z["offsets"], z["bits"]
+                table.append(
+                    rows, [bits[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+                )
+            out.append((seg["start"], seg["done"], table))
+        return out
+
+
+class RunCheckpoint:
+    """
+    Checkpoints of one run under root/<key>, the key hashing the run's
+    inputs and parameters (`fields`): stage outputs (tubes, background)
+    as .npz, small results (names, shifts, render progress) as JSON
+    manifests, and the chunked extraction state. A restarted run with the
+    same fields skips the stages already saved.
+    """
+
+    def __init__(self, root, fields):
+        blob = json.dumps(fields, sort_keys=True, default=str).encode()
+        self.key = hashlib.blake2b(blob, digest_size=16).hexdigest()
+        self.path = os.path.join(root, self.key)
+        os.makedirs(self.path, exist_ok=True)
+        if not os.path.exists(self.file("fields.json")):
+            _write_json(self.file("fields.json"), fields)
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def has(self, name):
+        return os.path.exists(self.file(name))
+
+    def save_tubes(self, name, tubes):
+        with PROFILER.span("checkpoint"):
+            save_tubes(self.file(name + ".npz"), tubes)
+        print(f"[CKPT] saved {len(tubes)} tubes ({name})")
+
+    def load_tubes(self, name):
+        tubes = load_tubes(self.file(name + ".npz"))
+        print(f"[CKPT] loaded {len(tubes)} tubes ({name})")
+        return tubes
+
+    def save_background(self, name, timeline):
+        with PROFILER.span("checkpoint"):
+            save_background(self.file(name + ".npz"), timeline)
+
+    def load_background(self, name):
+        print(f"[CKPT] loaded background ({name})")
+        return load_background(self.file(name + ".npz"))
+
+    def save_manifest(self, name, obj):
+        _write_json(self.file(name + ".json"), obj)
+
+    def load_manifest(self, name):
+        return _read_json(self.file(name + ".json"))
+
+    def extraction(self, chunk_len=1000, overlap=50):
+        return ExtractionCheckpoint(self.file("extract"), chunk_len, overlap)
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -1,14 +1,253 @@
+from collections import deque
+
 import numpy as np
 import cv2
 
+from profiler import PROFILER
+
 
 # median
-def compute_background_median(frames):
-    arr = np.stack(frames, axis=3)  # shape: (H, W, 3, T)
+def compute_background_median(frames, step=1, max_samples=None):
+    """
+    Per-pixel temporal median of every `step`-th frame.
+
+    `frames` may be a list or a loadVideo.VideoFrameSource; only the
+    sampled frames are decoded. `max_samples` caps how many frames are
+    stacked (spread evenly over the clip) so memory stays bounded for
+    long videos.
+    """
+    idx = np.arange(0, len(frames), step)
+    if max_samples is not None and len(idx) > max_samples:
+        idx = np.linspace(0, len(frames) - 1, max_samples).astype(int)
+    arr = np.stack([frames[i] for i in idx], axis=3)  # shape: (H, W, 3, T)
     background = np.median(arr, axis=3).astype(np.uint8)
     return background  # shape: (H, W, 3)
 
 
+class OnlineMedianBackground:
+    """
+    Streaming per-pixel approximate median: every update moves each
+    background pixel `step` towards the new frame (saturating uint8
+    arithmetic). Memory is one frame, independent of how many frames are
+    seen.
+    """
+
+    def __init__(self, step=1):
+        self.step = step
+        self.bg = None
+        self.count = 0
+
+    def update(self, frame):
+        if self.bg is None:
+            self.bg = np.array(frame, dtype=np.uint8)
+        else:
+            # (H, W*C) single-channel views: cv2 masks are per pixel
+            bg = self.bg.reshape(self.bg.shape[0], -1)
+            f = np.ascontiguousarray(frame).reshape(bg.shape)
+            up = cv2.compare(f, bg, cv2.CMP_GT)
+            down = cv2.compare(f, bg, cv2.CMP_LT)
+            cv2.add(bg, self.step, dst=bg, mask=up)
+            cv2.subtract(bg, self.step, dst=bg, mask=down)
+        self.count += 1
+
+    def background(self):
+        return None if self.bg is None else self.bg.copy()
+
+
+class BackgroundTimeline:
+    """
+    Time-varying background: an OnlineMedianBackground fed in source-frame
+    order, snapshotted every `interval` source frames, so lighting drift
+    over long videos is followed.
+
+    Args:
+      interval : source frames between two snapshots
+      step     : per-update step of the approximate median
+    """
+
+    def __init__(self, interval=1500, step=1):
+        self.interval = interval
+        self.model = OnlineMedianBackground(step)
+        self.times = []
+        self.snapshots = []
+        self._next = 0
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def update(self, t, frame):
+        with PROFILER.span("background"):
+            self.model.update(frame)
+        PROFILER.count("background_frames")
+        if t >= self._next:
+            self.snapshot(t)
+
+    def snapshot(self, t):
+        self.times.append(int(t))
+        self.snapshots.append(self.model.background())
+        self._next = t + self.interval
+
+    def finish(self, t):
+        """Snapshot the final state (source frame t) if it is not stored yet."""
+        if self.model.bg is not None and (not self.times or self.times[-1] != t):
+            self.snapshot(t)
+        return self
+
+    def at(self, t):
+        """Background snapshot nearest to source frame t."""
+        k = int(np.searchsorted(self.times, t))
+        if k == len(self.times) or (
+            k > 0 and t - self.times[k - 1] <= self.times[k] - t
+        ):
+            k -= 1
+        return self.snapshots[max(k, 0)]
+
+    def background(self):
+        """Latest snapshot, as a static background."""
+        return self.snapshots[-1] if self.snapshots else self.model.background()
+
+
+def compute_background_timeline(frames, step=5, interval=1500, median_step=1):
+    """
+    One pass over every `step`-th frame of `frames` with an online median.
+
+    Returns:
+      BackgroundTimeline with a snapshot every `interval` source frames
+    """
+    timeline = BackgroundTimeline(interval, median_step)
+    for t in range(0, len(frames), step):
+        timeline.update(t, frames[t])
+    return timeline.finish(len(frames) - 1)
+
+
+def resize_background(background, size):
+    """
+    `background` (an (H, W, 3) image or a BackgroundTimeline) with every
+    image resized to size = (W, H); returned as is when it is None or
+    already has that size.
+    """
+    W, H = size
+    if background is None or background_size(background) == (W, H):
+        return background
+
+    def resize(im):
+        return cv2.resize(im, (W, H), interpolation=cv2.INTER_AREA)
+
+    if not hasattr(background, "snapshots"):
+        return resize(background)
+    timeline = BackgroundTimeline(background.interval)
+    timeline.times = list(background.times)
+    timeline.snapshots = [resize(im) for im in background.snapshots]
+    timeline.model.bg = timeline.snapshots[-1].copy()
+    return timeline
+
+
+def background_size(background):
+    """(W, H) of an image or a BackgroundTimeline."""
+    im = background.background() if hasattr(background, "snapshots") else background
+    return im.shape[1], im.shape[0]
+
+
+class MotionGate:
+    """
+    Cheap motion pre-filter for the detector: MOG2 on a downscaled frame
+    flags frames whose foreground covers at least `min_area` of the
+    image; a frame is sent to the detector if any frame within `margin`
+    frames of it moves, so objects entering or leaving are not cut off.
+
+    Args:
+      scale         : downscale factor applied before MOG2
+      min_area      : foreground fraction that counts as motion
+      margin        : frames kept active before and after motion
+      history       : MOG2 history
+      var_threshold : MOG2 varThreshold
+    """
+
+    def __init__(
+        self, scale=0.25, min_area=0.002, margin=8, history=500, var_threshold=16
+    ):
+        self.scale = scale
+        self.min_area = min_area
+        self.margin = margin
+        self.history = history
+        self.var_threshold = var_threshold
+        self._sub = cv2.createBackgroundSubtractorMOG2(
+            history=history, varThreshold=var_threshold, detectShadows=False
+        )
+        self.n_frames = 0
+        self.n_skipped = 0
+        self.n_warmup = 0
+
+    def config(self):
+        return dict(
+            scale=self.scale,
+            min_area=self.min_area,
+            margin=self.margin,
+            history=self.history,
+            var_threshold=self.var_threshold,
+            warmup=self.n_warmup,
+        )
+
+    def warm_up(self, frames):
+        """
+        Feed the frames just before the first filtered one to the
+        background model only, so a gate starting mid-video (a time shard)
+        does not learn the objects already moving into its background.
+        """
+        for f in frames:
+            self._motion(f)
+            self.n_warmup += 1
+
+    def motion(self, frame):
+        """Foreground fraction of one frame (updates the background model)."""
+        with PROFILER.span("motion_gate"):
+            return self._motion(frame)
+
+    def _motion(self, frame):
+        small = cv2.resize(
+            frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA
+        )
+        fg = cv2.medianBlur(self._sub.apply(small), 3)
+        return cv2.countNonZero(fg) / fg.size
+
+    def filter(self, frames):
+        """
+        Yield (t, frame, active) for every frame, in order, `margin` frames
+        behind the input (the look-ahead needed for the leading margin).
+        """
+        pending = deque()
+        moving = deque()  # times of moving frames still within reach
+        for t, f in enumerate(frames):
+            if self.motion(f) >= self.min_area:
+                moving.append(t)
+            pending.append((t, f))
+            while pending and pending[0][0] <= t - self.margin:
+                yield self._emit(pending.popleft(), moving)
+        while pending:
+            yield self._emit(pending.popleft(), moving)
+
+    def _emit(self, item, moving):
+        t, f = item
+        while moving and moving[0] < t - self.margin:
+            moving.popleft()
+        active = bool(moving) and moving[0] <= t + self.margin
+        self.n_frames += 1
+        self.n_skipped += not active
+        if not active:
+            PROFILER.count("frames_skipped_by_gate")
+        return t, f, active
+
+    @property
+    def skip_fraction(self):
+        return self.n_skipped / self.n_frames if self.n_frames else 0.0
+
+    def report(self):
+        print(
+            f"[INFO] motion gate skipped {self.n_skipped}/{self.n_frames} frames "
+            f"({100 * self.skip_fraction:.1f}%)"
+        )
+
+
 def extract_background_mog2(
     video_path,
     history=500,
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from detectionTable import COLUMNS, DetectionTable
+
+_FORMAT = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """blake2b hex digest of a file's content."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_config(frames):
+    """
+    Cache-key fields of a loadVideo.VideoFrameSource (file, frame range and
+    decode size), or None for in-memory frame lists, which are not cached.
+    """
+    path = getattr(frames, "path", None)
+    if path is None or not os.path.isfile(path):
+        return None
+    H, W = frames.shape[1:3]
+    return dict(
+        file=os.path.abspath(path),
+        start=int(frames.start),
+        n_frames=len(frames),
+        width=W,
+        height=H,
+    )
+
+
+class CachedDetections:
+    """
+    Tracked detections of one cached run, memory-mapped from disk.
+
+      rows    : (N, 13) int32, see detectionTable.COLUMNS, ordered by frame
+      offsets : (N + 1,) int64 start of each packed mask in `bits`
+      bits    : uint8 np.packbits mask patches cropped to (mx1, my1, mx2, my2)
+      names   : model class id -> name
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.names = {int(k): v for k, v in self.meta["names"].items()}
+        self.n_frames = self.meta["n_frames"]
+        self.rows = np.load(os.path.join(path, "dets.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        bits_path = os.path.join(path, "masks.bin")
+        if os.path.getsize(bits_path):
+            self.bits = np.memmap(bits_path, dtype=np.uint8, mode="r")
+        else:
+            self.bits = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def table(self):
+        """The cached detections as a detectionTable.DetectionTable."""
+        return DetectionTable(self.rows, self.offsets, self.bits)
+
+
+class CacheWriter:
+    """
+    Streams tracked frames of a miss into a temporary entry; masks go
+    straight to disk, `commit` publishes the entry atomically.
+    """
+
+    def __init__(self, cache, key, names, fields):
+        self.cache = cache
+        self.key = key
+        self.names = dict(names)
+        self.fields = fields
+        self.tmp = os.path.join(cache.root, f".tmp-{key}-{os.getpid()}")
+        os.makedirs(self.tmp, exist_ok=True)
+        self._bits = open(os.path.join(self.tmp, "masks.bin"), "wb")
+        self._rows = []
+        self._sizes = []
+
+    def add(self, rows, bits):
+        """Record one detectionTable.frame_rows block."""
+        self._rows.append(rows)
+        for b in bits:
+            self._bits.write(b.tobytes())
+            self._sizes.append(len(b))
+
+    def commit(self, n_frames):
+        self._bits.close()
+        rows = np.concatenate(
+            self._rows or [np.zeros((0, len(COLUMNS)), dtype=np.int32)]
+        )
+        offsets = np.zeros(len(self._sizes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(self._sizes)
+        np.save(os.path.join(self.tmp, "dets.npy"), rows)
+        np.save(os.path.join(self.tmp, "offsets.npy"), offsets)
+        meta = dict(
+            format=_FORMAT,
+            key=self.key,
+            fields=self.fields,
+            names={str(k): v for k, v in self.names.items()},
+            n_frames=n_frames,
+            n_detections=len(rows),
+            created=time.time(),
+        )
+        with open(os.path.join(self.tmp, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=1)
+        final = self.cache.entry_path(self.key)
+        if os.path.exists(final):
+            shutil.rmtree(final)
+        os.replace(self.tmp, final)
+        print(
+            f"[CACHE] stored {self.key[:12]} ({len(rows)} detections, "
+            f"{_dir_size(final) / 2**20:.1f} MB)"
+        )
+        self.cache.evict(keep=self.key)
+
+    def abort(self):
+        self._bits.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+def _dir_size(path):
+    return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+
+
+class DetectionCache:
+    """
+    On-disk cache of tracked per-frame detections, one directory per run
+    keyed by the input file hash, frame range, model and tracker config.
+    Entries are evicted least-recently-used first once the cache grows past
+    `max_bytes`.
+
+    Args:
+      root      : cache directory
+      max_bytes : disk budget for all entries
+    """
+
+    def __init__(self, root="detection_cache", max_bytes=4 * 2**30):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.root, key)
+
+    def _file_digest(self, path):
+        # content hashes are remembered per (path, size, mtime)
+        index_path = os.path.join(self.root, "digests.json")
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        st = os.stat(path)
+        stamp = f"{st.st_size}:{st.st_mtime_ns}"
+        entry = index.get(path)
+        if entry is not None and entry["stamp"] == stamp:
+            return entry["digest"]
+        digest = file_digest(path)
+        index[path] = dict(stamp=stamp, digest=digest)
+        with open(index_path, "w") as f:
+            json.dump(index, f)
+        return digest
+
+    def key(self, source_cfg, detector_cfg, tracker_cfg):
+        """
+        Returns:
+          (key, fields) : hex key and the fields it was derived from
+        """
+        source_cfg = dict(source_cfg)
+        source_cfg["file"] = self._file_digest(source_cfg["file"])
+        fields = dict(
+            format=_FORMAT,
+            source=source_cfg,
+            detector=detector_cfg,
+            tracker=tracker_cfg,
+        )
+        blob = json.dumps(fields, sort_keys=True, default=str).encode()
+        return hashlib.blake2b(blob, digest_size=16).hexdigest(), fields
+
+    def load(self, key):
+        """CachedDetections for `key`, or None on a miss."""
+        path = self.entry_path(key)
+        if not os.path.isfile(os.path.join(path, "meta.json")):
+            print(f"[CACHE] miss {key[:12]}")
+            return None
+        try:
+            cached = CachedDetections(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[CACHE] miss {key[:12]} (unreadable entry: {e})")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        os.utime(os.path.join(path, "meta.json"))  # LRU stamp
+        print(
+            f"[CACHE] hit {key[:12]} ({len(cached)} detections, "
+            f"{cached.n_frames} frames)"
+        )
+        return cached
+
+    def writer(self, key, names, fields):
+        return CacheWriter(self, key, names, fields)
+
+    def entries(self):
+        """List of (last_used, bytes, key), oldest first."""
+        out = []
+        for e in os.scandir(self.root):
+            meta = os.path.join(e.path, "meta.json")
+            if e.is_dir() and os.path.isfile(meta):
+                out.append((os.path.getmtime(meta), _dir_size(e.path), e.name))
+        return sorted(out)
+
+    def evict(self, keep=None):
+        """Drop least-recently-used entries until the cache fits max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            total -= size
+            print(f"[CACHE] evicted {key[:12]} ({size / 2**20:.1f} MB)")
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
@@ -0,0 +1,174 @@
+import cv2
+import numpy as np
+
+from tube import Tube, take_ragged
+
+# per-detection row layout (int32), shared with detectionCache
+COLUMNS = (
+    "frame",
+    "track_id",
+    "cls_id",
+    "bx1",
+    "by1",
+    "bx2",
+    "by2",
+    "mx1",
+    "my1",
+    "mx2",
+    "my2",
+    "cx",
+    "cy",
+)
+FRAME, TRACK, CLS = 0, 1, 2
+BBOX = slice(3, 7)
+MASK_BOX = slice(7, 11)
+CENTROID = slice(11, 13)
+
+
+def frame_rows(t, track_ids, cls_ids, boxes, masks, search_boxes=None):
+    """
+    Columnar record of the tracked detections of frame t.
+
+    Each mask is thresholded (> 0.5), cropped to the bounding rect of its
+    foreground and packed; its centroid comes from the patch moments.
+    Detections with an empty mask are dropped. With `search_boxes` (the
+    detector's xyxy boxes, see detector.Detections) only that region,
+    padded by 2 px, is scanned.
+
+    Returns:
+      rows : (n, 13) int32, see COLUMNS
+      bits : list of n np.packbits mask patches
+    """
+    n = len(track_ids)
+    rows = np.zeros((n, len(COLUMNS)), dtype=np.int32)
+    bits = []
+    if n == 0:
+        return rows, bits
+    masks = np.asarray(masks)
+    H, W = masks.shape[1:3]
+    if search_boxes is None:
+        search = np.tile([0, 0, W, H], (n, 1))
+    else:
+        search = np.asarray(search_boxes, dtype=np.float64).reshape(-1, 4)
+        search = np.column_stack(
+            [
+                np.clip(np.floor(search[:, :2]) - 2, 0, None),
+                np.minimum(np.ceil(search[:, 2:]) + 2, [W, H]),
+            ]
+        ).astype(int)
+    keep = np.zeros(n, dtype=bool)
+    for k in range(n):
+        sx1, sy1, sx2, sy2 = search[k]
+        m = masks[k, sy1:sy2, sx1:sx2]
+        fg = (m if m.dtype == bool else m > 0.5).view(np.uint8)
+        x, y, w, h = cv2.boundingRect(fg)
+        if w == 0 or h == 0:
+            continue
+        patch = fg[y : y + h, x : x + w]
+        x, y = x + sx1, y + sy1
+        m = cv2.moments(patch, binaryImage=True)
+        rows[k, MASK_BOX] = (x, y, x + w, y + h)
+        rows[k, CENTROID] = (int(m["m10"] / m["m00"]) + x, int(m["m01"] / m["m00"]) + y)
+        bits.append(np.packbits(patch.view(bool), axis=None))
+        keep[k] = True
+    rows[:, FRAME] = t
+    rows[:, TRACK] = track_ids
+    rows[:, CLS] = cls_ids
+    rows[:, BBOX] = boxes
+    return rows[keep], bits
+
+
+class DetectionTable:
+    """
+    All tracked detections of a video as flat arrays: `rows` (N, 13) int32
+    in COLUMNS layout and the packed masks in one `bits` buffer indexed by
+    `offsets`. Built frame by frame with `append` or directly from arrays
+    (e.g. memory-mapped from a detectionCache entry).
+    """
+
+    def __init__(self, rows=None, offsets=None, bits=None):
+        if rows is None:
+            rows = np.zeros((0, len(COLUMNS)), dtype=np.int32)
+            offsets = np.zeros(1, dtype=np.int64)
+            bits = np.zeros(0, dtype=np.uint8)
+        self._rows, self._offsets, self._bits = rows, offsets, bits
+        self._pending_rows = []
+        self._pending_bits = []
+
+    def append(self, rows, bits):
+        """Add the (rows, bits) block of one frame (see frame_rows)."""
+        if len(rows):
+            self._pending_rows.append(rows)
+            self._pending_bits.extend(bits)
+
+    def _flush(self):
+        if not self._pending_rows:
+            return
+        sizes = np.array([len(b) for b in self._pending_bits], dtype=np.int64)
+        self._rows = np.concatenate([np.asarray(self._rows)] + self._pending_rows)
+        self._bits = np.concatenate([np.asarray(self._bits)] + self._pending_bits)
+        self._offsets = np.concatenate(
+            [np.asarray(self._offsets), self._offsets[-1] + np.cumsum(sizes)]
+        )
+        self._pending_rows, self._pending_bits = [], []
+
+    @property
+    def rows(self):
+        self._flush()
+        return self._rows
+
+    @property
+    def offsets(self):
+        self._flush()
+        return self._offsets
+
+    @property
+    def bits(self):
+        self._flush()
+        return self._bits
+
+    def __len__(self):
+        return len(self.rows)
+
+    def select(self, mask):
+        """New table with the rows where `mask` is True."""
+        idx = np.flatnonzero(mask)
+        rows, offsets, bits = self.rows, self.offsets, self.bits
+        new_offsets, new_bits = take_ragged(bits, offsets, idx)
+        return DetectionTable(np.asarray(rows)[idx], new_offsets, new_bits)
+
+    def to_tubes(self, min_len=1):
+        """
+        Group the rows by track id (sort-based) into Tube records, ordered
+        by first appearance; tracks with fewer than min_len detections are
+        dropped.
+        """
+        rows = np.asarray(self.rows)
+        if len(rows) == 0:
+            return []
+        # rows are appended in frame order: a stable sort on the track id
+        # keeps every track's detections in time order
+        order = np.argsort(rows[:, TRACK], kind="stable")
+        ids = rows[order, TRACK]
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        offsets, bits = take_ragged(self.bits, self.offsets, order)
+        srows = rows[order]
+        tubes = []
+        for a, b in sorted(zip(starts, ends), key=lambda ab: order[ab[0]]):
+            if b - a < min_len:
+                continue
+            r = srows[a:b]
+            tubes.append(
+                Tube(
+                    int(r[0, TRACK]),
+                    r[:, FRAME],
+                    r[:, CENTROID],
+                    r[:, BBOX],
+                    r[:, CLS],
+                    r[:, MASK_BOX],
+                    bits[offsets[a] : offsets[b]],
+                    offsets[a : b + 1] - offsets[a],
+                )
+            )
+        return tubes
@@ -0,0 +1,245 @@
+import os
+
+import cv2
+import numpy as np
+
+from processTubes import bbox_iou
+
+
+class Detections:
+    """
+    Detections for one frame, as plain NumPy arrays.
+
+      boxes : (N, 4) float32 xyxy
+      conf  : (N,)   float32 scores
+      cls   : (N,)   int32 class ids
+      masks : (N, H, W) float or bool masks (> 0.5 is foreground), zero
+              outside their box (ultralytics crops masks to the boxes)
+    """
+
+    __slots__ = ("boxes", "conf", "cls", "masks")
+
+    def __init__(self, boxes, conf, cls, masks):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32)
+        self.cls = np.asarray(cls, dtype=np.int32)
+        self.masks = masks
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @classmethod
+    def empty(cls, H, W):
+        return cls(np.zeros((0, 4)), [], [], np.zeros((0, H, W), dtype=bool))
+
+
+# detectors
+class Detector:
+    """
+    Segmentation model interface used by extract_segmentation_tubes.
+
+    `names` maps class id -> class name; `detect(frames)` runs one forward
+    pass over a batch of BGR frames and returns one Detections per frame.
+    """
+
+    names = {}
+
+    def config(self):
+        """JSON-able settings that determine the output, or None (no caching)."""
+        return None
+
+    def detect(self, frames):
+        raise NotImplementedError
+
+
+class YoloSegDetector(Detector):
+    """Ultralytics YOLO segmentation model, run on whole batches of frames."""
+
+    def __init__(
+        self, weights="yolo11s-seg.pt", conf=0.4, imgsz=640, half=True, device=None
+    ):
+        import torch
+        from ultralytics import YOLO
+
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"Using device : {device}")
+        self.device = device
+        self.weights = weights
+        self.conf = conf
+        self.imgsz = imgsz
+        self.half = half
+        self.model = YOLO(weights)
+        self.model.to(device)
+        self.names = self.model.names
+
+    @staticmethod
+    def make_config(weights="yolo11s-seg.pt", conf=0.4, imgsz=640):
+        return dict(model=os.path.basename(weights), conf=conf, imgsz=imgsz)
+
+    def config(self):
+        return self.make_config(self.weights, self.conf, self.imgsz)
+
+    def detect(self, frames):
+        results = self.model.predict(
+            list(frames),
+            device=self.device,
+            half=self.half,
+            conf=self.conf,
+            imgsz=self.imgsz,
+            retina_masks=True,
+            verbose=False,
+        )
+        out = []
+        for f, r in zip(frames, results):
+            if r is None or r.boxes is None or r.masks is None or len(r.boxes) == 0:
+                out.append(Detections.empty(*f.shape[:2]))
+                continue
+            out.append(
+                Detections(
+                    r.boxes.xyxy.detach().cpu().numpy(),
+                    r.boxes.conf.detach().cpu().numpy(),
+                    r.boxes.cls.detach().cpu().numpy().astype(int),
+                    r.masks.data.detach().cpu().numpy(),  # (N, H, W) floats 0..1
+                )
+            )
+        return out
+
+
+class ColorKeyDetector(Detector):
+    """
+    Weight-free stand-in for tests and benchmarks: every connected region
+    painted in one of the key colours of `classes` is a detection of that
+    class, with its exact pixel mask.
+
+    Args:
+      classes : dict class_id -> (name, (b, g, r))
+      tol     : max per-channel distance from the key colour
+    """
+
+    def __init__(self, classes, tol=0):
+        self.classes = classes
+        self.names = {cid: name for cid, (name, _) in classes.items()}
+        self.tol = tol
+
+    def config(self):
+        return dict(model="colorkey", classes=self.classes, tol=self.tol)
+
+    def detect(self, frames):
+        out = []
+        for f in frames:
+            boxes, cls, masks = [], [], []
+            for cid, (_, color) in self.classes.items():
+                lo = np.clip(np.array(color) - self.tol, 0, 255).astype(np.uint8)
+                hi = np.clip(np.array(color) + self.tol, 0, 255).astype(np.uint8)
+                key = cv2.inRange(f, lo, hi)
+                n, labels, stats, _ = cv2.connectedComponentsWithStats(key, 8)
+                for k in range(1, n):
+                    x, y, w, h = stats[k, :4]
+                    boxes.append((x, y, x + w, y + h))
+                    cls.append(cid)
+                    masks.append(labels == k)
+            if boxes:
+                out.append(Detections(boxes, np.ones(len(boxes)), cls, np.stack(masks)))
+            else:
+                out.append(Detections.empty(*f.shape[:2]))
+        return out
+
+
+# trackers
+class Tracker:
+    """
+    Multi-object tracker interface. `update(dets, frame)` must be called
+    once per frame, in order, and returns (ids, keep, boxes): the track id
+    and tracked xyxy box of every detection that was assigned to a track,
+    and its index in `dets`.
+    """
+
+    def config(self):
+        """JSON-able settings that determine the output, or None (no caching)."""
+        return None
+
+    def update(self, dets, frame):
+        raise NotImplementedError
+
+
+class UltralyticsTracker(Tracker):
+    """BoT-SORT / ByteTrack from ultralytics, fed with precomputed detections."""
+
+    def __init__(self, tracker_cfg="botsort.yaml", frame_rate=30):
+        from ultralytics.engine.results import Boxes
+        from ultralytics.trackers.bot_sort import BOTSORT
+        from ultralytics.trackers.byte_tracker import BYTETracker
+        from ultralytics.utils import IterableSimpleNamespace, yaml_load
+        from ultralytics.utils.checks import check_yaml
+
+        self.cfg = tracker_cfg
+        self.frame_rate = frame_rate
+        args = IterableSimpleNamespace(**yaml_load(check_yaml(tracker_cfg)))
+        trackers = {"bytetrack": BYTETracker, "botsort": BOTSORT}
+        self._tracker = trackers[args.tracker_type](args=args, frame_rate=frame_rate)
+        self._boxes = Boxes
+
+    @staticmethod
+    def make_config(tracker_cfg="botsort.yaml", frame_rate=30):
+        cfg = dict(tracker=os.path.basename(tracker_cfg), frame_rate=frame_rate)
+        if os.path.isfile(tracker_cfg):  # local yaml: key on its content
+            with open(tracker_cfg) as f:
+                cfg["yaml"] = f.read()
+        return cfg
+
+    def config(self):
+        return self.make_config(self.cfg, self.frame_rate)
+
+    def update(self, dets, frame):
+        data = np.column_stack([dets.boxes, dets.conf, dets.cls]).astype(np.float32)
+        tracks = self._tracker.update(self._boxes(data, frame.shape[:2]), frame)
+        if len(tracks) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros((0, 4))
+        tracks = np.asarray(tracks)
+        return tracks[:, 4].astype(int), tracks[:, -1].astype(int), tracks[:, :4]
+
+
+class IouTracker(Tracker):
+    """
+    Greedy IoU tracker: each detection joins the live track of the same
+    class with the highest box IoU above `iou_thresh`; tracks unmatched for
+    more than `max_age` frames are dropped.
+    """
+
+    def __init__(self, iou_thresh=0.3, max_age=5):
+        self.iou_thresh = iou_thresh
+        self.max_age = max_age
+        self.next_id = 1
+        self.tracks = {}  # id -> (box, cls, age)
+
+    def config(self):
+        return dict(tracker="iou", iou_thresh=self.iou_thresh, max_age=self.max_age)
+
+    def update(self, dets, frame):
+        ids = np.zeros(len(dets), dtype=int)
+        free = dict(self.tracks)
+        order = np.argsort(-dets.conf, kind="stable")
+        for k in order:
+            box, c = dets.boxes[k], int(dets.cls[k])
+            best, best_iou = None, self.iou_thresh
+            for tid, (tbox, tc, _) in free.items():
+                if tc != c:
+                    continue
+                iou = bbox_iou(box, tbox)
+                if iou >= best_iou:
+                    best, best_iou = tid, iou
+            if best is None:
+                best = self.next_id
+                self.next_id += 1
+            else:
+                del free[best]
+            ids[k] = best
+            self.tracks[best] = (box, c, 0)
+        for tid, (tbox, tc, age) in free.items():
+            if age + 1 > self.max_age:
+                del self.tracks[tid]
+            else:
+                self.tracks[tid] = (tbox, tc, age + 1)
+        keep = np.arange(len(dets))
+        return ids, keep, dets.boxes
@@ -1,98 +1,306 @@
-from collections import defaultdict
-
 import numpy as np
-import torch
-from tqdm import tqdm
-from ultralytics import YOLO
+
+from detectionCache import source_config
+from detector import Detections, UltralyticsTracker, YoloSegDetector
+from detectionTable import CLS, FRAME, TRACK, DetectionTable, frame_rows
+from profiler import PROFILER
+from stitchTubes import stitch_shards
+
+
+def iter_batches(frames, batch_size, start=0):
+    """
+    Yield (first_index, list_of_frames) chunks of `frames` in order, the
+    first frame having index `start`.
+    """
+    batch, first = [], start
+    for t, f in enumerate(frames, start):
+        if not batch:
+            first = t
+        batch.append(f)
+        if len(batch) == batch_size:
+            yield first, batch
+            batch = []
+    if batch:
+        yield first, batch
+
+
+def detect_batch(detector, batch):
+    """detector.detect(batch), timed as the profiler's "detect" stage."""
+    with PROFILER.span("detect"):
+        dets = detector.detect(batch)
+    PROFILER.count("detector_frames", len(batch))
+    return dets
+
+
+def iter_detections(frames, detector, batch_size, motion_gate=None, start=0):
+    """
+    Yield (t, frame, Detections) for every frame from `start` on, in
+    order, running the detector on batches of batch_size frames. With a
+    computeBackground.MotionGate, frames it marks inactive get empty
+    Detections without reaching the detector, so the tracker still sees
+    every frame.
+    """
+    if start:
+        frames = map(frames.__getitem__, range(start, len(frames)))
+    if motion_gate is None:
+        for t0, batch in iter_batches(frames, batch_size, start):
+            yield from zip(
+                range(t0, t0 + len(batch)), batch, detect_batch(detector, batch)
+            )
+        return
+
+    pending = []
+    for t, f, active in motion_gate.filter(frames):
+        t += start
+        if active:
+            pending.append((t, f))
+            if len(pending) < batch_size:
+                continue
+        if pending:
+            batch = [pf for _, pf in pending]
+            for (pt, pf), dets in zip(pending, detect_batch(detector, batch)):
+                yield pt, pf, dets
+            pending = []
+        if not active:
+            yield t, f, Detections.empty(*f.shape[:2])
+    if pending:
+        batch = [pf for _, pf in pending]
+        for (pt, pf), dets in zip(pending, detect_batch(detector, batch)):
+            yield pt, pf, dets
+
+
+class TubeAssembler:
+    """
+    Incremental tracking -> tube folding: feed it every frame's detections
+    in order with `add`, then call `finish` to get the Tube records.
+
+    `add` is `track` (run the tracker, crop and pack the tracked masks into
+    a columnar block, see detectionTable.frame_rows) followed by
+    `add_tracked` (keep_classes filter, append to the DetectionTable), so
+    tracked frames can also be recorded and replayed, e.g. from a
+    detectionCache.
+    """
+
+    def __init__(self, tracker, names, keep_classes):
+        self.tracker = tracker
+        self.names = names
+        self.keep_classes = keep_classes
+        self.keep_ids = self.class_ids(keep_classes)
+        self.table = DetectionTable()
+
+    def class_ids(self, classes):
+        return np.array(
+            [cid for cid, name in self.names.items() if name in classes],
+            dtype=np.int32,
+        )
+
+    def track(self, t, frame, dets, classes=None):
+        """
+        Run the tracker on frame t.
+
+        Returns:
+          (rows, bits) block of detectionTable.frame_rows; only classes in
+          `classes` are cropped (None = all)
+        """
+        with PROFILER.span("track"):
+            ids, keep, boxes = self.tracker.update(dets, frame)
+        PROFILER.count("detections", len(dets))
+        ids = np.asarray(ids)
+        keep = np.asarray(keep)
+        cls = dets.cls[keep]
+        boxes = np.asarray(boxes).astype(int).reshape(-1, 4)
+        if classes is not None:
+            sel = np.isin(cls, self.class_ids(classes))
+            ids, keep, cls, boxes = ids[sel], keep[sel], cls[sel], boxes[sel]
+        # print("extract tube", mask.shape)
+        with PROFILER.span("crop_masks"):
+            return frame_rows(
+                t, ids, cls, boxes, dets.masks[keep], search_boxes=dets.boxes[keep]
+            )
+
+    def add_tracked(self, rows, bits):
+        """Append the keep_classes part of a block; returns that part."""
+        sel = np.isin(rows[:, CLS], self.keep_ids)
+        if not sel.all():
+            rows = rows[sel]
+            bits = [b for b, s in zip(bits, sel) if s]
+        self.table.append(rows, bits)
+        return rows, bits
+
+    def add(self, t, frame, dets):
+        self.add_tracked(*self.track(t, frame, dets, self.keep_classes))
+
+    def pop_finished(self, t, max_gap=30):
+        """
+        Tubes of the tracks not seen for more than max_gap frames before
+        frame t (ended tracks), removed from the table; the table then only
+        holds live tracks, so this costs O(live detections).
+        """
+        rows = np.asarray(self.table.rows)
+        if len(rows) == 0:
+            return []
+        ids, inv = np.unique(rows[:, TRACK], return_inverse=True)
+        last = np.full(len(ids), -1, dtype=np.int64)
+        np.maximum.at(last, inv, rows[:, FRAME])
+        ended = (last < t - max_gap)[inv]
+        if not ended.any():
+            return []
+        tubes = self.table.select(ended).to_tubes()
+        self.table = self.table.select(~ended)
+        return tubes
+
+    def load_table(self, table):
+        """Take every tracked detection from a prebuilt DetectionTable."""
+        self.table = table.select(np.isin(table.rows[:, CLS], self.keep_ids))
+
+    def finish(self, min_len, tubes=None):
+        """Tubes of the table (or `tubes`) with at least min_len detections."""
+        if tubes is None:
+            tubes = self.table.to_tubes()
+        # filter out short tubes
+        out, dropped = [], 0
+        for tube in tubes:
+            if len(tube) >= min_len:
+                out.append(tube)
+            else:
+                dropped += 1
+                print(f" tube lenth is small than {min_len}")
+        PROFILER.count("tubes_kept_min_len", len(out))
+        PROFILER.count("tubes_dropped_min_len", dropped)
+        print(f"[INFO] Extracted {len(out)} tubes (min_len={min_len})")
+        return out
+
+
+def checkpoint_tubes(checkpoint, keep_classes, min_len):
+    """
+    Tubes of a checkpoint.ExtractionCheckpoint: the tracker sessions of a
+    resumed extraction are stitched over their overlap windows.
+    """
+    segments = checkpoint.segments()
+    assembler = TubeAssembler(None, checkpoint.names, keep_classes)
+    if len(segments) == 1:
+        assembler.table = segments[0][2]
+        return assembler.finish(min_len)
+    tubes = stitch_shards(
+        [table.to_tubes() for _, _, table in segments],
+        [(start, done) for start, done, _ in segments],
+    )
+    print(f"[CKPT] stitched {len(segments)} extraction segments")
+    return assembler.finish(min_len, tubes)
 
 
 # 3) Extract segmentation-based tubes using YOLOv8-seg + default tracker
+@PROFILER.profiled("extract")
 def extract_segmentation_tubes(
-    frames: list, keep_classes=["person"], min_len=5, conf=0.4
+    frames,
+    keep_classes=["person"],
+    min_len=5,
+    conf=0.4,
+    batch_size=8,
+    detector=None,
+    tracker=None,
+    cache=None,
+    motion_gate=None,
+    checkpoint=None,
 ):
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    # print(device)
-    print(f"Using device : {device}")
-    model = YOLO("yolo11s-seg.pt")
-    model.to(device)
-    # print(model.device)
+    """
+    Args:
+      frames       : list of BGR frames or a loadVideo.VideoFrameSource;
+                     frames are visited once, in order
+      keep_classes : class names to build tubes for
+      min_len      : tubes with fewer detections are dropped
+      conf         : detector confidence threshold
+      batch_size   : frames per detector forward pass
+      detector     : detector.Detector (default: YoloSegDetector)
+      tracker      : detector.Tracker (default: BoT-SORT)
+      cache        : detectionCache.DetectionCache; tracked detections of
+                     all classes are stored on the first run and replayed
+                     afterwards without loading the model
+      motion_gate  : computeBackground.MotionGate; frames without motion
+                     skip the detector (the tracker gets no detections)
+      checkpoint   : checkpoint.ExtractionCheckpoint; tracked detections
+                     are committed every chunk_len frames and a rerun
+                     resumes after the last committed chunk (the cache is
+                     then only written by uninterrupted runs)
+
+    Returns:
+      tubes, names : list of tube.Tube records and the model's id -> name map
+    """
     H, W, _ = frames[0].shape
-    tubes = defaultdict(
-        lambda: {
-            "frames": [],
-            "masks": [],
-            "centroids": [],
-            "bboxes": [],
-            "cls_ids": [],
-        }
-    )
-    results = []
-    for f in tqdm(frames, desc="inference"):
-        res = model.track(
-            [
-                f,
-            ],
-            device=device,
-            stream=True,
-            persist=True,
-            half=True,
-            conf=conf,
-            verbose=False,
-            tracker="botsort.yaml",
-            imgsz=max(W, H),
-            retina_masks=True,
+    key = fields = None
+    if cache is not None:
+        source_cfg = source_config(frames)
+        det_cfg = (
+            YoloSegDetector.make_config(conf=conf, imgsz=max(W, H))
+            if detector is None
+            else detector.config()
         )
-        new_res = []
-        for r in res:
-            if r is None or r.boxes is None or r.masks is None or r.boxes.id is None:
-                continue
-            ids = r.boxes.id.detach().cpu().numpy()
-            cls = r.boxes.cls.detach().cpu().numpy().astype(int)
-            masks = r.masks.data.detach().cpu().numpy()  # (N, H, W) floats 0..1
-            boxes = r.boxes.xyxy.detach().cpu().numpy().astype(int)
-            new_res.append(dict(ids=ids, cls=cls, masks=masks, boxes=boxes))
-        results.extend(new_res)
-    names = model.names
+        trk_cfg = (
+            UltralyticsTracker.make_config("botsort.yaml")
+            if tracker is None
+            else tracker.config()
+        )
+        if det_cfg is not None and motion_gate is not None:
+            det_cfg = dict(det_cfg, motion_gate=motion_gate.config())
+        if None in (source_cfg, det_cfg, trk_cfg):
+            print("[CACHE] skipped: frames, detector or tracker not cacheable")
+        else:
+            key, fields = cache.key(source_cfg, det_cfg, trk_cfg)
+            cached = cache.load(key)
+            if cached is not None:
+                assembler = TubeAssembler(None, cached.names, keep_classes)
+                assembler.load_table(cached.table())
+                return assembler.finish(min_len), dict(cached.names)
+
+    start = 0
+    if checkpoint is not None:
+        if checkpoint.complete:
+            return checkpoint_tubes(checkpoint, keep_classes, min_len), checkpoint.names
+        start = checkpoint.resume_from()
+
+    if detector is None:
+        detector = YoloSegDetector(conf=conf, imgsz=max(W, H))
+    if tracker is None:
+        tracker = UltralyticsTracker("botsort.yaml")
+    names = detector.names
     # print(names)
-    for t, r in tqdm(enumerate(results), desc="Tracking"):
-        # if r is None or r.masks is None:
-        #     continue
-        # if r is None or r.boxes is None or r.masks is None or r.boxes.id is None:
-        #     continue
-        # ids = r.boxes.id.cpu().numpy()
-        # cls = r.boxes.cls.cpu().numpy().astype(int)
-        # masks = r.masks.data.cpu().numpy()  # (N, H, W) floats 0..1
-        # boxes = r.boxes.xyxy.cpu().numpy().astype(int)
-        ids = r["ids"]
-        cls = r["cls"]
-        masks = r["masks"]
-        boxes = r["boxes"]
-
-        for obj_id, cls_id, mask, box in zip(ids, cls, masks, boxes):
-            # print("extract tube", mask.shape)
-            label = names[int(cls_id)]
-            if label not in keep_classes:
-                continue
-            # mask = cv2.resize(mask, (W, H), interpolation=cv2.INTER_NEAREST)
-            bin_mask = mask > 0.5
+    # detection runs on whole batches; the tracker then consumes the
+    # per-frame results in order and they are folded into the tubes at once
+    # so that no (N, H, W) float masks are held for the whole video
+    assembler = TubeAssembler(tracker, names, keep_classes)
+    # a cache entry is one uninterrupted pass over the video
+    writer = cache.writer(key, names, fields) if key is not None and not start else None
+    # a cache entry holds every class so that keep_classes can change later
+    classes = None if writer is not None else keep_classes
+    if checkpoint is not None:
+        checkpoint.begin(start, names)
+    from tqdm import tqdm
 
-            # compute centroid of the binary mask
-            ys, xs = np.where(bin_mask)
-            if len(xs) == 0:
-                continue
-            cx, cy = int(xs.mean()), int(ys.mean())
-
-            tubes[obj_id]["frames"].append(t)
-            tubes[obj_id]["masks"].append(bin_mask)
-            tubes[obj_id]["centroids"].append((cx, cy))
-            tubes[obj_id]["bboxes"].append(tuple(box))
-            tubes[obj_id]["cls_ids"].append(int(cls_id))
-    # filter out short tubes
-    out = []
-    for tube in tubes.values():
-        if len(tube["frames"]) >= min_len:
-            out.append(tube)
-        else:
-            print(f" tube lenth is small than {min_len}")
-    print(f"[INFO] Extracted {len(out)} tubes (min_len={min_len})")
-    return out, names
+    pbar = tqdm(total=len(frames), initial=start, desc="inference")
+    try:
+        for t, f, dets in iter_detections(
+            frames, detector, batch_size, motion_gate, start
+        ):
+            rows, bits = assembler.track(t, f, dets, classes)
+            if writer is not None:
+                writer.add(rows, bits)
+            kept = assembler.add_tracked(rows, bits)
+            if checkpoint is not None:
+                checkpoint.add(*kept)
+                checkpoint.step(t + 1)
+            pbar.update(1)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    pbar.close()
+    if motion_gate is not None:
+        motion_gate.report()
+    if writer is not None:
+        writer.commit(len(frames))
+    if checkpoint is not None:
+        checkpoint.finish(len(frames))
+        print(f"[CKPT] extraction checkpoints took {checkpoint.write_s:.2f}s")
+        if start:
+            return checkpoint_tubes(checkpoint, keep_classes, min_len), names
+    return assembler.finish(min_len), names
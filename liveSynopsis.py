@@ -0,0 +1,241 @@
+import heapq
+import json
+import os
+import shutil
+
+from checkpoint import load_tubes, save_tubes
+from processTubes import refine_tubes_by_bbox_disp
+from profiler import PROFILER
+from scheduleTubes import OccupancyVolume
+from videoOutput import open_writer, output_path
+from writeVideo import iter_multi_synopsis_frames
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class LiveSynopsis:
+    """
+    Rolling synopsis of the last `window` source frames of a camera,
+    updated as tracks end instead of rebuilt from scratch.
+
+    State kept between updates:
+      occupancy : scheduleTubes.OccupancyVolume of every placed tube
+      placed    : key -> (tube, shift, footprint); a tube keeps its shift
+                  until it expires
+      members   : synopsis segment -> keys of the tubes shown in it
+
+    `add` places finished tubes first-fit (longest first, as
+    schedule_tubes_bbox) into the free space of the current occupancy,
+    `expire` takes out the tubes that ended before the window (their
+    masks are cleared from the occupancy, see OccupancyVolume.remove),
+    and `render` re-encodes only the segments of segment_len synopsis
+    frames those changes touched. The cost of an update follows the
+    tubes added or expired, not the history.
+
+    Segments are written to out_dir as seg_<k>_v<version> files listed
+    in a live m3u8 playlist, rewritten atomically; a re-rendered segment
+    gets a new version, so a player holding the previous playlist still
+    finds consistent files until the next update.
+    """
+
+    def __init__(
+        self,
+        H,
+        W,
+        out_dir,
+        window,
+        segment_len=250,
+        fps=10,
+        codec="mp4v",
+        cell=8,
+        alpha_border=20,
+        feather=False,
+    ):
+        self.H, self.W = H, W
+        self.out_dir = out_dir
+        self.window = window
+        self.segment_len = segment_len
+        self.fps, self.codec = fps, codec
+        self.alpha_border, self.feather = alpha_border, feather
+        self.occ = OccupancyVolume(H, W, cell)
+        self.placed = {}
+        self.members = {}
+        self.dirty = set()
+        self.versions = {}  # segment -> version on disk
+        self._expiry = []  # heap of (last source frame, key)
+        self._next_key = 0
+        os.makedirs(out_dir, exist_ok=True)
+
+    def __len__(self):
+        """Current synopsis length in frames."""
+        return len(self.occ)
+
+    def _segments(self, s, L):
+        return range(s // self.segment_len, (s + L - 1) // self.segment_len + 1)
+
+    def _place(self, tube, s, fp):
+        key = self._next_key
+        self._next_key += 1
+        self.occ.add(s, fp, len(tube))
+        self.placed[key] = (tube, s, fp)
+        heapq.heappush(self._expiry, (int(tube.frames[-1]), key))
+        for k in self._segments(s, len(tube)):
+            self.members.setdefault(k, set()).add(key)
+            self.dirty.add(k)
+
+    @PROFILER.profiled("live_add")
+    def add(self, tubes):
+        """Place finished tubes without moving the placed ones; returns shifts."""
+        shifts = []
+        for tube in sorted(tubes, key=len, reverse=True):
+            L = len(tube)
+            fp = self.occ.footprint(tube)
+            n_starts = max(0, len(self.occ) - L) + 1
+            self.occ._reserve(n_starts + L)
+            s = self.occ.first_fit(fp, n_starts)
+            if s is None:
+                s = len(self.occ)
+            self._place(tube, s, fp)
+            shifts.append(s)
+        PROFILER.count("live_tubes_added", len(tubes))
+        return shifts
+
+    @PROFILER.profiled("live_expire")
+    def expire(self, t_now):
+        """Remove the tubes that ended before t_now - window; returns how many."""
+        n = 0
+        while self._expiry and self._expiry[0][0] < t_now - self.window:
+            _, key = heapq.heappop(self._expiry)
+            tube, s, fp = self.placed.pop(key)
+            self.occ.remove(s, fp)
+            for k in self._segments(s, len(tube)):
+                self.members[k].discard(key)
+                self.dirty.add(k)
+            n += 1
+        if n:
+            # trailing frames left empty shorten the synopsis
+            end = max((s + len(t) for t, s, _ in self.placed.values()), default=0)
+            if end < len(self.occ):
+                first = end // self.segment_len  # now shorter or gone
+                self.dirty.update(k for k in self.versions if k >= first)
+                self.occ.length = end
+        PROFILER.count("live_tubes_expired", n)
+        return n
+
+    def _segment_path(self, k, version):
+        return output_path(
+            os.path.join(self.out_dir, f"seg_{k:05d}_v{version}"), self.codec
+        )
+
+    @PROFILER.profiled("live_render")
+    def render(self, frames, background):
+        """
+        Re-encode the dirty segments from the source `frames` (indexable
+        by source frame) and rewrite the playlist; returns the number of
+        synopsis frames rendered.
+        """
+        n_frames = 0
+        stale = []
+        n_segments = -(-len(self) // self.segment_len)
+        for k in sorted(self.dirty):
+            old = self.versions.get(k)
+            if old is not None:
+                stale.append(self._segment_path(k, old))
+            if k >= n_segments:
+                self.versions.pop(k, None)
+                self.members.pop(k, None)
+                continue
+            a = k * self.segment_len
+            b = min(a + self.segment_len, len(self))
+            # only the detections landing in [a, b) are cut and composited
+            tubes, shifts = [], []
+            for key in sorted(self.members.get(k, ())):
+                tube, s, _ = self.placed[key]
+                lo, hi = max(a - s, 0), min(b - s, len(tube))
+                tubes.append(tube if hi - lo == len(tube) else tube.take(range(lo, hi)))
+                shifts.append(s + lo - a)
+            version = 0 if old is None else old + 1
+            path = self._segment_path(k, version)
+            writer = open_writer(path, self.W, self.H, self.fps, self.codec)
+            for _, frame in iter_multi_synopsis_frames(
+                frames,
+                [(tubes, shifts, b - a)],
+                background,
+                self.alpha_border,
+                self.feather,
+            ):
+                writer.write(frame)
+            writer.close()
+            self.versions[k] = version
+            n_frames += b - a
+        self.dirty.clear()
+        self._write_playlist()
+        for path in stale:
+            _remove(path)
+        PROFILER.count("live_frames_rendered", n_frames)
+        return n_frames
+
+    def _write_playlist(self):
+        target = -(-self.segment_len // self.fps)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{target}"]
+        for k in sorted(self.versions):
+            n = min(self.segment_len, len(self) - k * self.segment_len)
+            name = os.path.basename(self._segment_path(k, self.versions[k]))
+            lines += [f"#EXTINF:{n / self.fps:.3f},", name]
+        tmp = os.path.join(self.out_dir, ".index.m3u8.tmp")
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, os.path.join(self.out_dir, "index.m3u8"))
+
+    def save(self, path):
+        """Persist the placed tubes, their shifts and the segment versions."""
+        os.makedirs(path, exist_ok=True)
+        keys = sorted(self.placed)
+        save_tubes(os.path.join(path, "tubes.npz"), [self.placed[k][0] for k in keys])
+        state = dict(
+            shifts=[int(self.placed[k][1]) for k in keys],
+            versions={str(k): v for k, v in self.versions.items()},
+            dirty=sorted(self.dirty),
+        )
+        tmp = os.path.join(path, "state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, os.path.join(path, "state.json"))
+
+    def restore(self, path):
+        """
+        Load the state written by `save` into this (empty) synopsis; the
+        occupancy is rebuilt from the tubes at their saved shifts.
+        """
+        with open(os.path.join(path, "state.json")) as f:
+            state = json.load(f)
+        tubes = load_tubes(os.path.join(path, "tubes.npz"))
+        for tube, s in zip(tubes, state["shifts"]):
+            self._place(tube, s, self.occ.footprint(tube))
+        self.versions = {int(k): v for k, v in state["versions"].items()}
+        self.dirty = set(state["dirty"])
+
+
+def update_live_synopsis(
+    live, assembler, t_now, frames, background, min_len=5, max_gap=30
+):
+    """
+    One live update at source frame t_now: the tracks of `assembler`
+    (extractTube.TubeAssembler) that have ended are refined and placed,
+    expired tubes leave the window, and the touched segments are
+    re-rendered.
+
+    Returns:
+      dict with the tubes added, expired and synopsis frames rendered
+    """
+    tubes = [t for t in assembler.pop_finished(t_now, max_gap) if len(t) >= min_len]
+    tubes = refine_tubes_by_bbox_disp(tubes) if tubes else []
+    live.add(tubes)
+    expired = live.expire(t_now)
+    rendered = live.render(frames, background)
+    return dict(added=len(tubes), expired=expired, rendered=rendered, length=len(live))
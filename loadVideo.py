@@ -1,10 +1,15 @@
 # 1) Load up to N frames from the input video
+from collections import OrderedDict
+
 import cv2
 import numpy as np
-from tqdm import tqdm
+
+from profiler import PROFILER
 
 
 def load_video_color(path, max_frames=200, width=640, height=380):
+    from tqdm import tqdm
+
     cap = cv2.VideoCapture(path)
     frames = []
     for _ in tqdm(range(max_frames), desc="loading video"):
@@ -18,7 +23,142 @@ def load_video_color(path, max_frames=200, width=640, height=380):
     return frames
 
 
+class VideoFrameSource:
+    """
+    Lazy, random-access view over the frames of a video file.
+
+    Behaves like the list returned by `load_video_color` (len, indexing,
+    iteration, `[0].shape`) but decodes on demand: a miss decodes a chunk
+    of `chunk_size` consecutive frames starting at the requested index,
+    and decoded frames live in a bounded LRU of `cache_size` entries, so
+    peak memory does not depend on the length of the video.
+
+    Args:
+      path        : path to the input video
+      max_frames  : upper bound on the number of frames exposed (None = all)
+      width/height: frames are resized to (width, height) with INTER_AREA
+      start       : index of the first source frame exposed as frame 0
+      cache_size  : max number of decoded frames kept in memory
+      chunk_size  : number of frames decoded per cache miss
+    """
+
+    def __init__(
+        self,
+        path,
+        max_frames=None,
+        width=640,
+        height=380,
+        start=0,
+        cache_size=64,
+        chunk_size=16,
+    ):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.start = start
+        self.cache_size = max(cache_size, chunk_size)
+        self.chunk_size = chunk_size
+        self._cache = OrderedDict()
+        self._cap = cv2.VideoCapture(path)
+        if not self._cap.isOpened():
+            raise IOError(f"Cannot open video: {path}")
+        self._pos = 0  # next source frame the capture will return
+        total = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total <= 0:
+            total = self._count_frames()
+        total = max(0, total - start)
+        self._len = total if max_frames is None else min(total, max_frames)
+
+    def _count_frames(self):
+        # container does not report a frame count: grab through once
+        n = 0
+        while self._cap.grab():
+            n += 1
+        self._seek(0)
+        return n
+
+    def _seek(self, src_idx):
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, src_idx)
+        self._pos = src_idx
+
+    def _decode_chunk(self, idx):
+        src_idx = self.start + idx
+        if src_idx != self._pos:
+            self._seek(src_idx)
+            PROFILER.count("decoder_seeks")
+        end = min(idx + self.chunk_size, self._len)
+        with PROFILER.span("decode"):
+            self._read_chunk(idx, end)
+        PROFILER.count("frames_decoded", end - idx)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _read_chunk(self, idx, end):
+        for i in range(idx, end):
+            ret, f = self._cap.read()
+            if not ret:
+                # container over-reported its length
+                self._len = i
+                break
+            self._pos += 1
+            if f.shape[1] != self.width or f.shape[0] != self.height:
+                f = cv2.resize(
+                    f, (self.width, self.height), interpolation=cv2.INTER_AREA
+                )
+            self._cache[i] = f
+            self._cache.move_to_end(i)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._len))]
+        idx = int(idx)
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError(f"frame index {idx} out of range")
+        f = self._cache.get(idx)
+        if f is None:
+            self._decode_chunk(idx)
+            f = self._cache.get(idx)
+            if f is None:
+                raise IndexError(f"frame index {idx} could not be decoded")
+        else:
+            self._cache.move_to_end(idx)
+        return f
+
+    def __iter__(self):
+        for i in range(len(self)):
+            try:
+                yield self[i]
+            except IndexError:
+                return
+
+    @property
+    def shape(self):
+        """(N, H, W, 3) shape the equivalent frame list would have."""
+        return (self._len, self.height, self.width, 3)
+
+    @property
+    def fps(self):
+        """Frame rate reported by the container (0 if unknown)."""
+        return self._cap.get(cv2.CAP_PROP_FPS)
+
+    def release(self):
+        self._cap.release()
+        self._cache.clear()
+
+
+def open_video_source(path, max_frames=None, width=640, height=380, **kwargs):
+    """Streaming counterpart of `load_video_color`; see VideoFrameSource."""
+    return VideoFrameSource(path, max_frames, width, height, **kwargs)
+
+
 def load_background(path, max_frames=10000, width=640, height=380):
+    from tqdm import tqdm
+
     cap = cv2.VideoCapture(path)
     frames = []
     for _ in tqdm(np.arange(0, max_frames, 500), desc="loading video"):
@@ -1,80 +1,347 @@
-from processTubesY import *
-from scheduleTubesY import *
-from write import *
+import os
+
+from checkpoint import RunCheckpoint
+from computeBackground import (
+    MotionGate,
+    compute_background_timeline,
+    resize_background,
+)
+from detectionCache import DetectionCache, source_config
+from extractTube import extract_segmentation_tubes
+from loadVideo import open_video_source
+from maskCodec import encode_tubes
+from pipeline import run_synopsis_pipeline
+from processTubes import refine_tubes_by_bbox_disp
+from profiler import PROFILER
+from scheduleTubes import groub_tubes_by_classid, schedule_tubes
+from shardedExtract import extract_tubes_sharded
+from tubeStore import TubeStore
+from videoOutput import WriterPool, output_path, segmented_frames_done
+from writeVideo import iter_multi_synopsis_frames
+
+
+def store_and_query(
+    store_path, tubes, names, size, fps=None, background=None, query=None
+):
+    """
+    Keep freshly extracted tubes in a new tube store; with a query, the
+    synopsis is built from the stored tubes matching it, as on later runs
+    that open the store instead of extracting.
+
+    Returns:
+      tubes : all of `tubes`, or those matching `query`
+    """
+    store = TubeStore.create(store_path, tubes, names, size, fps, background)
+    return tubes if query is None else store.query(**query)
 
-from computeBackground import *
-from loadVideo import *
 
-# import from every module
 # 7) Main
 if __name__ == "__main__":
     video_path = "input_video/video_1_20250324_174822.avi"
 
     # parameters
-    max_frames = 1000
+    max_frames = None  # whole video
     keep_classes = ["car"]
 
     min_len = 5
     conf = 0
+    batch_size = 8  # frames per detector forward pass
     fps_out = 10
 
-    frames = load_video_color(video_path, max_frames)
+    # scheduling engine: "greedy", "bbox" (same result, faster) or "energy"
+    scheduler = "bbox"
+    # energy engine only: synopsis length budget (frames) and weights
+    target_len = None
+    energy_params = dict(w_collision=1.0, w_length=10.0, w_chrono=0.0, seed=0)
+
+    # tracked detections are cached on disk, keyed by video + model config,
+    # so re-tuning keep_classes / min_len / scheduling skips inference
+    cache_dir = "detection_cache"  # None disables the cache
+    cache_max_gb = 4
+
+    # skip the detector on frames without motion (downscaled MOG2)
+    motion_gating = False
+
+    # long recordings: extract tubes in time shards of shard_len frames,
+    # one worker process each, and stitch them (None = single process)
+    shard_len = None
+    shard_overlap = 50
+    n_workers = None  # CPU count
+
+    # run decode / detection / tracking / background concurrently, in one
+    # uninterrupted pass at proxy_size: cache_dir, checkpoint_dir,
+    # render_size, shard_len, tube_store_dir and query must then be None
+    pipeline_mode = False
+    queue_size = 32
+
+    # output: videoOutput codec ("mp4v", "mjpg", "x264" via ffmpeg, "jpg"
+    # frames, ...), encoder threads for the per-class outputs, and
+    # segment_len frames per segment to serve outputs while they render
+    codec = "mp4v"
+    encode_workers = 2
+    segment_len = None
+
+    # multi-hour runs: stage results are checkpointed under checkpoint_dir
+    # (keyed by video + parameters) and extraction commits its tracked
+    # detections every checkpoint_chunk frames, so a rerun after a crash
+    # resumes where it stopped; segmented outputs resume after their last
+    # finished segment (None disables checkpoints)
+    checkpoint_dir = "checkpoints"
+    checkpoint_chunk = 1000
+
+    # tube store: the extracted tubes and the background of a run are
+    # kept in tube_store_dir/<video name>, indexed by time, class, region
+    # and speed; with `query` set, the synopsis is built from the matching
+    # tubes alone, and a store present skips the detection pass, e.g.
+    #   query = dict(classes=["car"], time_range=(0, 9000),
+    #                region=(0, 0, 320, 380), speed=(2, None))
+    # (time_range in source frames, region in proxy_size pixels)
+    tube_store_dir = "tube_store"  # None disables the store
+    query = None
+
+    # stage timers and counters, written as a JSON report and a Chrome
+    # trace (chrome://tracing); profile_memory adds tracemalloc peaks
+    profile = False
+    profile_memory = False
+    if profile:
+        PROFILER.enable(trace=True, memory=profile_memory)
+
+    # level of detail: detection, tracking and scheduling run on
+    # proxy_size frames; with render_size (e.g. (2560, 1520), the source
+    # size) the background and the synopsis are built from frames of that
+    # size, the masks being upsampled inside their boxes at render time
+    proxy_size = (640, 380)
+    render_size = None  # None = render at proxy_size
+
+    # mask codec: masks of the kept detections are coded against keyframes
+    # (maskCodec), reusing a keyframe's mask when the IoU is at least
+    # mask_codec_iou (1.0 = lossless); cuts mask memory on long, mostly
+    # still tracks and lets scheduling and feathering work once per
+    # keyframe (None disables it)
+    mask_codec_iou = None
 
-    # sample frame to get clean background using median
-    bk_step = 5
-    background_frames = [frames[i] for i in np.arange(0, len(frames), bk_step)]
+    if pipeline_mode:
+        unsupported = dict(
+            cache_dir=cache_dir,
+            checkpoint_dir=checkpoint_dir,
+            render_size=(
+                render_size
+                if render_size is not None and tuple(render_size) != tuple(proxy_size)
+                else None
+            ),
+            shard_len=shard_len,
+            tube_store_dir=tube_store_dir,
+            query=query,
+        )
+        unsupported = [k for k, v in unsupported.items() if v is not None]
+        if unsupported:
+            raise ValueError(
+                f"pipeline_mode does not support {', '.join(unsupported)}; "
+                "set them to None"
+            )
+
+    # frames are decoded lazily; memory is bounded by the LRU cache size
+    frames = open_video_source(video_path, max_frames, *proxy_size)
     H, W, _ = frames[0].shape
-    print(f"Loaded {len(frames)} resize frames ({W}×{H})")
-    background = compute_background_median(background_frames)
-
-    all_tubes, names = extract_segmentation_tubes(
-        frames,
-        keep_classes,
-        min_len=min_len,
-        conf=conf,
-    )
-
-    # save_tubes_as_videos(frames, all_tubes, "actual_tubes")
-    sampled_tubes = refine_tubes_by_bbox_disp(all_tubes)
-
-    # print(names)
-    class_groups = groub_tubes_by_classid(sampled_tubes)
-    names[-1] = "all_classess"
-    class_groups[-1] = sampled_tubes
-
-    for cid, tubes in class_groups.items():
-        cls_name = names[int(cid)]
-        output_path = f"segmented_synopsis_cls_{cls_name}.mp4"
-        # save_tubes_as_videos(
-        #     frames,
-        #     tubes,
-        #     out_dir=f"tubes_output_{cls_name}",
-        #     fps=10,
-        # )
-        tube_lengths = [len(t["frames"]) for t in tubes]
-
-        order = sorted(range(len(tubes)), key=lambda i: -tube_lengths[i])
-        # Reorder
-        tubes_sorted = [tubes[i] for i in order]
-
-        # Schedule
-        shifts = [None] * len(tubes)
-        for new_idx, orig_idx in enumerate(order):
-            shifts[orig_idx] = shifts_sorted[new_idx]
-        # 4) Schedule
-        # shifts, syn_len = schedule_tubes_dynamic(tubes, H, W) if you want to use non sorted tubes,
-
-        print(f"Scheduled synopsis length = {syn_len} frames")
-
-        # 5) Build with blending
-        synopsis = build_synopsis_with_time(
+    print(f"Opened {len(frames)} resize frames ({W}×{H})")
+    render_frames = frames
+    if render_size is not None and tuple(render_size) != tuple(proxy_size):
+        render_frames = open_video_source(video_path, max_frames, *render_size)
+        print(f"Rendering from {render_size[0]}×{render_size[1]} frames")
+    schedule_kwargs = {}
+    if scheduler == "energy":
+        schedule_kwargs = dict(target_len=target_len, **energy_params)
+
+    cache = None
+    if cache_dir is not None:
+        cache = DetectionCache(cache_dir, max_bytes=int(cache_max_gb * 2**30))
+
+    motion_gate = MotionGate() if motion_gating else None
+
+    if pipeline_mode:
+        run_synopsis_pipeline(
             frames,
-            tubes,
-            shifts,
-            syn_len,
-            background,
+            keep_classes,
+            min_len=min_len,
+            conf=conf,
+            batch_size=batch_size,
+            queue_size=queue_size,
+            scheduler=scheduler,
+            scheduler_kwargs=schedule_kwargs,
+            fps_out=fps_out,
+            codec=codec,
+            segment_len=segment_len,
+            motion_gate=motion_gate,
+            mask_codec_iou=mask_codec_iou,
         )
-        # 6) Write out
-        write_video(synopsis, output_path, fps_out)
+    else:
+        # online median over every bk_step-th frame, snapshotted every
+        # bk_interval frames; synopsis frames use the nearest snapshot
+        bk_step = 5
+        bk_interval = 1500
+
+        if query is not None and tube_store_dir is None:
+            raise ValueError("query needs a tube store (tube_store_dir)")
+        store = None
+        if tube_store_dir is not None:
+            name = os.path.splitext(os.path.basename(video_path))[0]
+            store_path = os.path.join(tube_store_dir, name)
+            if query is not None and TubeStore.exists(store_path):
+                store = TubeStore(store_path)
+
+        run = None
+        source_cfg = source_config(frames)
+        if checkpoint_dir is not None and source_cfg is not None:
+            run = RunCheckpoint(
+                checkpoint_dir,
+                dict(
+                    source=source_cfg,
+                    keep_classes=keep_classes,
+                    min_len=min_len,
+                    conf=conf,
+                    motion_gating=motion_gating,
+                    shard_len=shard_len,
+                    shard_overlap=shard_overlap,
+                    bk_step=bk_step,
+                    bk_interval=bk_interval,
+                    render_size=render_size,
+                    scheduler=scheduler,
+                    schedule_kwargs=schedule_kwargs,
+                    mask_codec_iou=mask_codec_iou,
+                    query=query,
+                ),
+            )
+            print(f"[CKPT] run checkpoints in {run.path}")
+
+        background = store.background() if store is not None else None
+        if background is None and run is not None and run.has("background.npz"):
+            background = run.load_background("background")
+        elif background is None:
+            background = compute_background_timeline(
+                render_frames, step=bk_step, interval=bk_interval
+            )
+            if run is not None:
+                run.save_background("background", background)
+        # a store background has the size the store was created at
+        RH, RW = render_frames[0].shape[:2]
+        background = resize_background(background, (RW, RH))
+
+        if store is not None:
+            all_tubes = store.query(**query)
+            names = dict(store.names)
+        elif run is not None and run.has("tubes.npz"):
+            all_tubes = run.load_tubes("tubes")
+            names = {int(k): v for k, v in run.load_manifest("names").items()}
+        elif shard_len is None:
+            all_tubes, names = extract_segmentation_tubes(
+                frames,
+                keep_classes,
+                min_len=min_len,
+                conf=conf,
+                batch_size=batch_size,
+                cache=cache,
+                motion_gate=motion_gate,
+                checkpoint=(
+                    run.extraction(checkpoint_chunk, shard_overlap)
+                    if run is not None
+                    else None
+                ),
+            )
+        else:
+            all_tubes, names = extract_tubes_sharded(
+                video_path,
+                keep_classes,
+                min_len=min_len,
+                conf=conf,
+                batch_size=batch_size,
+                shard_len=shard_len,
+                overlap=shard_overlap,
+                n_workers=n_workers,
+                max_frames=max_frames,
+                width=proxy_size[0],
+                height=proxy_size[1],
+                cache_dir=cache_dir,
+                motion_gating=motion_gating,
+            )
+        if run is not None and not run.has("tubes.npz"):
+            run.save_manifest("names", {str(k): v for k, v in names.items()})
+            run.save_tubes("tubes", all_tubes)
+        if tube_store_dir is not None and store is None:
+            all_tubes = store_and_query(
+                store_path,
+                all_tubes,
+                names,
+                (W, H),
+                getattr(frames, "fps", None),
+                background,
+                query,
+            )
+
+        # save_tubes_as_videos(frames, all_tubes, "actual_tubes")
+        sampled_tubes = refine_tubes_by_bbox_disp(all_tubes)
+        if mask_codec_iou is not None:
+            sampled_tubes = encode_tubes(sampled_tubes, mask_codec_iou)
+
+        # print(names)
+        class_groups = groub_tubes_by_classid(sampled_tubes)
+        names[-1] = "all_classess"
+        class_groups[-1] = sampled_tubes
+
+        # 4) Schedule every output first (first-fit engines place the
+        #    longest tubes first)
+        schedules = (run.load_manifest("schedule") if run is not None else None) or {}
+        outputs, paths = [], []
+        for cid, tubes in class_groups.items():
+            cls_name = names[int(cid)]
+            # save_tubes_as_videos(
+            #     frames,
+            #     tubes,
+            #     out_dir=f"tubes_output_{cls_name}",
+            #     fps=10,
+            # )
+            if str(cid) in schedules:
+                shifts, syn_len = schedules[str(cid)]
+            else:
+                shifts, syn_len = schedule_tubes(
+                    tubes, H, W, scheduler, **schedule_kwargs
+                )
+                schedules[str(cid)] = [[int(s) for s in shifts], int(syn_len)]
+            print(f"Scheduled synopsis length = {syn_len} frames ({cls_name})")
+            outputs.append((tubes, shifts, syn_len))
+            stem = "query_synopsis" if query is not None else "segmented_synopsis"
+            paths.append(output_path(f"{stem}_cls_{cls_name}", codec, segment_len))
+
+        if run is not None:
+            run.save_manifest("schedule", schedules)
+
+        # 5) + 6) Build all outputs in one pass (every source frame is read
+        #    once) and encode them concurrently in the writer pool; segmented
+        #    outputs of an interrupted run with the same run key and output
+        #    settings continue after their last segment, others start fresh
+        resume = None
+        if run is not None and segment_len is not None:
+            resume = f"{run.key}:{codec}:{segment_len}:{fps_out}"
+        start = [segmented_frames_done(p, resume) for p in paths]
+        if any(start):
+            print(f"[CKPT] resuming render at synopsis frames {start}")
+        pool = WriterPool(encode_workers, queue_size)
+        streams = [
+            pool.open(path, fps_out, codec, segment_len, resume) for path in paths
+        ]
+        for o, frame in iter_multi_synopsis_frames(
+            render_frames, outputs, background, start=start, tube_size=(W, H)
+        ):
+            streams[o].write(frame)
+        for stream in streams:
+            stream.close()
+        pool.close()
+        for s in pool.stats:
+            print(
+                f"Saved segmented synopsis to {s['path']} "
+                f"({s['frames']} frames, {s['fps']:.0f} fps encode)"
+            )
 
-        print(f"Saved segmented synopsis to {output_path}")
+    if profile:
+        PROFILER.print_report()
+        PROFILER.write_json("synopsis_profile.json")
+        PROFILER.write_chrome_trace("synopsis_trace.json")
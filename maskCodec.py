@@ -0,0 +1,209 @@
+import numpy as np
+
+from profiler import PROFILER
+from tube import Tube
+
+
+def _fit(patch, h, w):
+    """`patch` aligned on its top-left corner, cropped or zero-padded to (h, w)."""
+    if patch.shape == (h, w):
+        return patch
+    out = np.zeros((h, w), dtype=bool)
+    ph, pw = min(h, patch.shape[0]), min(w, patch.shape[1])
+    out[:ph, :pw] = patch[:ph, :pw]
+    return out
+
+
+class KeyframeTube(Tube):
+    """
+    Tube whose masks are coded against keyframes, for long tracks of
+    objects whose shape barely changes (a parked car, a standing person).
+
+      keys : (N,) int32 keyframe of each detection (keys[i] == i for a
+             keyframe, whose bit range holds its packed patch as usual)
+
+    Any other detection is its keyframe's patch aligned on the top-left
+    corner of its own mask box (cropped or padded to its size), and
+    either reused as is (empty bit range) or corrected by an XOR delta:
+    its bit range then holds the uint32 positions of the differing bits.
+
+    `mask_ids` gives reused detections of the keyframe's size the
+    keyframe's id, so the scheduler and the renderer compute footprints,
+    collision areas and feathered alphas once per keyframe.
+    """
+
+    __slots__ = ("keys",)
+
+    def __init__(
+        self,
+        track_id,
+        frames,
+        centroids,
+        bboxes,
+        cls_ids,
+        mask_boxes,
+        bits,
+        offsets,
+        keys,
+    ):
+        super().__init__(
+            track_id, frames, centroids, bboxes, cls_ids, mask_boxes, bits, offsets
+        )
+        self.keys = np.asarray(keys, dtype=np.int32)
+
+    def __repr__(self):
+        return "Keyframe" + super().__repr__() + f"[{self.n_keyframes} keyframes]"
+
+    @property
+    def n_keyframes(self):
+        return int(np.count_nonzero(self.keys == np.arange(len(self))))
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self.keys.nbytes
+
+    def _shape(self, i):
+        x1, y1, x2, y2 = self.mask_boxes[i]
+        return int(y2 - y1), int(x2 - x1)
+
+    def _decode(self, i, key_patch):
+        h, w = self._shape(i)
+        ref = _fit(key_patch, h, w)
+        a, b = self._offsets[i], self._offsets[i + 1]
+        if a == b:
+            return ref
+        out = ref.copy()
+        out.ravel()[np.asarray(self._bits[a:b]).view(np.uint32)] ^= True
+        return out
+
+    def patch(self, i):
+        k = int(self.keys[i])
+        key_patch = Tube.patch(self, k)
+        return key_patch if k == i else self._decode(i, key_patch)
+
+    def patches(self):
+        """Decode all patches in order, each keyframe once."""
+        cache = {}
+        for i, k in enumerate(self.keys.tolist()):
+            if k == i:
+                cache = {k: Tube.patch(self, k)}  # keyframes come in order
+                yield cache[k]
+            else:
+                key_patch = cache.get(k)
+                if key_patch is None:
+                    key_patch = cache[k] = Tube.patch(self, k)
+                yield self._decode(i, key_patch)
+
+    def mask_ids(self):
+        ids = np.arange(len(self))
+        reused = (np.diff(self._offsets) == 0) & (self.keys != ids)
+        hs = self.mask_boxes[:, 3] - self.mask_boxes[:, 1]
+        ws = self.mask_boxes[:, 2] - self.mask_boxes[:, 0]
+        same = (hs == hs[self.keys]) & (ws == ws[self.keys])
+        return np.where(reused & same, self.keys, ids)
+
+    def expanded(self):
+        return Tube.from_patches(
+            self.track_id,
+            self.frames,
+            self.centroids,
+            self.bboxes,
+            self.cls_ids,
+            self.mask_boxes,
+            list(self.patches()),
+        )
+
+    def take(self, idx):
+        # keyframes may be dropped: re-encode the kept patches losslessly
+        idx = np.asarray(idx, dtype=np.int64)
+        patches = list(self.patches())
+        return encode_tube(
+            Tube.from_patches(
+                self.track_id,
+                self.frames[idx],
+                self.centroids[idx],
+                self.bboxes[idx],
+                self.cls_ids[idx],
+                self.mask_boxes[idx],
+                [patches[i] for i in idx.tolist()],
+            ),
+            iou_thresh=1.0,
+        )
+
+    def set_masks(self, updates):
+        if not updates:
+            return
+        tube = self.expanded()
+        tube.set_masks(updates)
+        coded = encode_tube(tube, iou_thresh=1.0)
+        self.mask_boxes = coded.mask_boxes
+        self._bits, self._offsets, self.keys = coded._bits, coded._offsets, coded.keys
+
+
+def encode_tube(tube, iou_thresh=1.0, max_delta=0.25):
+    """
+    Code the masks of a tube.Tube against keyframes (see KeyframeTube).
+
+    Each patch is compared with the current keyframe aligned to its box:
+    it is reused when their IoU is at least iou_thresh (1.0 = only when
+    identical, i.e. lossless), stored as an XOR delta when the differing
+    bits, at 4 bytes each, take less than max_delta of the packed patch,
+    and otherwise becomes the next keyframe. Reuse is measured against the
+    keyframe, not the previous patch, so the error does not accumulate.
+    """
+    chunks, keys = [], np.arange(len(tube), dtype=np.int32)
+    key_patch, k = None, -1
+    for i, patch in enumerate(tube.patches()):
+        if key_patch is not None:
+            ref = _fit(key_patch, *patch.shape)
+            diff = ref ^ patch
+            n_diff = int(np.count_nonzero(diff))
+            union = int(np.count_nonzero(ref | patch))
+            if n_diff == 0 or (union and (union - n_diff) / union >= iou_thresh):
+                keys[i] = k
+                chunks.append(np.zeros(0, dtype=np.uint8))
+                continue
+            if 4 * n_diff < max_delta * -(-patch.size // 8):
+                keys[i] = k
+                chunks.append(np.flatnonzero(diff).astype(np.uint32).view(np.uint8))
+                continue
+        key_patch, k = patch.copy(), i
+        chunks.append(np.packbits(patch, axis=None))
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(c) for c in chunks])
+    bits = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint8)
+    return KeyframeTube(
+        tube.track_id,
+        tube.frames,
+        tube.centroids,
+        tube.bboxes,
+        tube.cls_ids,
+        tube.mask_boxes,
+        bits,
+        offsets,
+        keys,
+    )
+
+
+@PROFILER.profiled("mask_codec")
+def encode_tubes(tubes, iou_thresh=1.0, max_delta=0.25, min_len=2):
+    """
+    encode_tube for every tube of at least min_len detections (others
+    are returned as they are); prints the mask memory before and after.
+    """
+    before = sum(int(t._bits.nbytes) for t in tubes)
+    out = [
+        encode_tube(t, iou_thresh, max_delta) if len(t) >= min_len else t for t in tubes
+    ]
+    after = sum(int(t._bits.nbytes) for t in out)
+    PROFILER.count("mask_bytes_saved", before - after)
+    print(
+        f"[INFO] mask codec: {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB "
+        f"(iou_thresh={iou_thresh})"
+    )
+    return out
+
+
+def decode_tubes(tubes):
+    """Plain tube.Tube records, one stored patch per detection."""
+    return [t.expanded() for t in tubes]
@@ -0,0 +1,342 @@
+import queue
+import threading
+import time
+
+from computeBackground import BackgroundTimeline
+from detector import Detections, UltralyticsTracker, YoloSegDetector
+from extractTube import TubeAssembler, detect_batch
+from maskCodec import encode_tubes
+from processTubes import refine_tubes_by_bbox_disp
+from profiler import PROFILER
+from videoOutput import open_writer, output_path
+from scheduleTubes import groub_tubes_by_classid, schedule_tubes
+from writeVideo import iter_multi_synopsis_frames
+
+_DONE = object()
+
+
+class StageStats:
+    """Per-stage counters: items processed, busy time and input queue depth."""
+
+    __slots__ = (
+        "name",
+        "items",
+        "busy",
+        "start",
+        "end",
+        "depth_sum",
+        "depth_n",
+        "depth_max",
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.start = self.end = None
+        self.depth_sum = self.depth_n = self.depth_max = 0
+
+    def sample_queue(self, q):
+        d = q.qsize()
+        self.depth_sum += d
+        self.depth_n += 1
+        self.depth_max = max(self.depth_max, d)
+
+    def as_dict(self):
+        wall = (self.end or time.perf_counter()) - (self.start or 0)
+        return dict(
+            stage=self.name,
+            items=self.items,
+            busy_s=self.busy,
+            wall_s=wall,
+            items_per_s=self.items / self.busy if self.busy else 0.0,
+            queue_mean=self.depth_sum / self.depth_n if self.depth_n else 0.0,
+            queue_max=self.depth_max,
+        )
+
+
+def print_stage_report(stats):
+    print(
+        f"{'stage':>12} {'items':>8} {'busy s':>8} {'wall s':>8} "
+        f"{'items/s':>9} {'q mean':>7} {'q max':>6}"
+    )
+    for s in stats:
+        d = s.as_dict()
+        print(
+            f"{d['stage']:>12} {d['items']:>8} {d['busy_s']:>8.2f} {d['wall_s']:>8.2f} "
+            f"{d['items_per_s']:>9.1f} {d['queue_mean']:>7.1f} {d['queue_max']:>6}"
+        )
+
+
+class _Stage(threading.Thread):
+    """
+    Worker thread consuming `inq` until the _DONE sentinel; `fn(item)`
+    returns the number of items it completed. `on_done()` runs after the
+    last item (e.g. to flush a partial batch). On error the stage keeps
+    draining its input, so upstream stages never block on a full queue,
+    and forwards _DONE downstream; the error is re-raised by join.
+    """
+
+    def __init__(self, name, fn, inq, outqs=(), on_done=None):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.inq = inq
+        self.outqs = outqs
+        self.on_done = on_done
+        self.stats = StageStats(name)
+        self.profile_name = f"stage:{name}"
+        self.error = None
+
+    def run(self):
+        self.stats.start = time.perf_counter()
+        saw_done = False
+        try:
+            while True:
+                self.stats.sample_queue(self.inq)
+                item = self.inq.get()
+                if item is _DONE:
+                    saw_done = True
+                    break
+                t0 = time.perf_counter()
+                with PROFILER.span(self.profile_name):
+                    self.stats.items += self.fn(item) or 0
+                self.stats.busy += time.perf_counter() - t0
+            if self.on_done is not None:
+                t0 = time.perf_counter()
+                self.stats.items += self.on_done() or 0
+                self.stats.busy += time.perf_counter() - t0
+        except BaseException as e:
+            self.error = e
+            # on_done may fail after _DONE was consumed: nothing to drain
+            while not saw_done:
+                saw_done = self.inq.get() is _DONE
+        finally:
+            for q in self.outqs:
+                q.put(_DONE)
+            self.stats.end = time.perf_counter()
+
+    def join(self, timeout=None):
+        super().join(timeout)
+        if self.error is not None:
+            raise self.error
+
+
+def run_synopsis_pipeline(
+    frames,
+    keep_classes=["person"],
+    min_len=5,
+    min_disp=5,
+    conf=0.4,
+    batch_size=8,
+    queue_size=32,
+    bk_step=5,
+    bk_interval=1500,
+    scheduler="bbox",
+    scheduler_kwargs=None,
+    fps_out=10,
+    out_pattern="segmented_synopsis_cls_{}",
+    codec="mp4v",
+    segment_len=None,
+    detector=None,
+    tracker=None,
+    motion_gate=None,
+    mask_codec_iou=None,
+):
+    """
+    Staged version of main.py with bounded queues between stages:
+
+      decode -> detect (batched) -> track + tube assembly
+             \\-> online background (every bk_step-th frame)
+
+    then refine / schedule, and a render stage streaming the synopsis
+    frames of every class, composited in one shared pass
+    (writeVideo.iter_multi_synopsis_frames), to the encoder through a
+    bounded queue. Every stage reports its
+    throughput and input queue depth.
+
+    Args:
+      frames      : list of frames or a loadVideo.VideoFrameSource
+      queue_size  : max items buffered between two stages
+      bk_interval : source frames between two background snapshots
+      motion_gate : computeBackground.MotionGate, run in the decode stage;
+                    frames without motion bypass the detector
+      mask_codec_iou : code the refined tubes' masks against keyframes
+                    (maskCodec.encode_tubes; None disables it)
+      scheduler   : engine name for scheduleTubes.schedule_tubes, with
+                    extra engine arguments in scheduler_kwargs
+      out_pattern : output path per class name, without extension
+      codec       : videoOutput codec; segment_len splits each output into
+                    segments (see videoOutput.open_writer)
+      others      : as in main.py / extract_segmentation_tubes
+
+    Returns:
+      outputs : dict class name -> written video path
+      stats   : list of StageStats, in pipeline order
+    """
+    H, W, _ = frames[0].shape
+    if detector is None:
+        detector = YoloSegDetector(conf=conf, imgsz=max(W, H))
+    if tracker is None:
+        tracker = UltralyticsTracker("botsort.yaml")
+    names = dict(detector.names)
+    assembler = TubeAssembler(tracker, names, keep_classes)
+    bg_model = BackgroundTimeline(bk_interval)
+
+    q_frames = queue.Queue(queue_size)
+    q_bg = queue.Queue(queue_size)
+    q_dets = queue.Queue(queue_size)
+
+    # 1) decode
+    decode_stats = StageStats("decode")
+    decode_error = []
+
+    def decode():
+        decode_stats.start = time.perf_counter()
+        try:
+            if motion_gate is None:
+                source = ((t, f, True) for t, f in enumerate(frames))
+            else:
+                source = motion_gate.filter(frames)
+            t0 = time.perf_counter()
+            for t, f, active in source:
+                decode_stats.busy += time.perf_counter() - t0
+                decode_stats.items += 1
+                q_frames.put((t, f, active))
+                if t % bk_step == 0:
+                    q_bg.put((t, f))
+                t0 = time.perf_counter()
+        except BaseException as e:
+            decode_error.append(e)
+        finally:
+            q_frames.put(_DONE)
+            q_bg.put(_DONE)
+            decode_stats.end = time.perf_counter()
+
+    # 2) detection, batch_size frames per forward pass
+    pending = []
+
+    def flush():
+        if not pending:
+            return 0
+        batch = [f for _, f, _ in pending]
+        for (t, f, _), dets in zip(pending, detect_batch(detector, batch)):
+            q_dets.put((t, f, dets))
+        n = len(pending)
+        pending.clear()
+        return n
+
+    def detect(item):
+        t, f, active = item
+        if active:
+            pending.append(item)
+            return flush() if len(pending) == batch_size else 0
+        # no motion: keep the order, hand the tracker an empty frame
+        n = flush()
+        q_dets.put((t, f, Detections.empty(*f.shape[:2])))
+        return n + 1
+
+    def track(item):
+        assembler.add(*item)
+        return 1
+
+    def background(item):
+        bg_model.update(*item)
+        return 1
+
+    decoder = threading.Thread(target=decode, name="decode", daemon=True)
+    detect_stage = _Stage("detect", detect, q_frames, (q_dets,), on_done=flush)
+    track_stage = _Stage("track", track, q_dets)
+    bg_stage = _Stage("background", background, q_bg)
+    workers = [detect_stage, track_stage, bg_stage]
+    decoder.start()
+    for w in workers:
+        w.start()
+    decoder.join()
+    for w in workers:
+        w.join()
+    if decode_error:
+        raise decode_error[0]
+    if motion_gate is not None:
+        motion_gate.report()
+
+    # 3) refine + schedule
+    t0 = time.perf_counter()
+    tubes = refine_tubes_by_bbox_disp(assembler.finish(min_len), min_disp=min_disp)
+    if mask_codec_iou is not None:
+        tubes = encode_tubes(tubes, mask_codec_iou)
+    background_img = bg_model.finish(len(frames) - 1)
+    class_groups = groub_tubes_by_classid(tubes)
+    names[-1] = "all_classess"
+    class_groups[-1] = tubes
+    schedules = {
+        cid: schedule_tubes(group, H, W, scheduler, **(scheduler_kwargs or {}))
+        for cid, group in class_groups.items()
+    }
+    schedule_stats = StageStats("schedule")
+    schedule_stats.items = len(tubes)
+    schedule_stats.busy = time.perf_counter() - t0
+    schedule_stats.start, schedule_stats.end = t0, time.perf_counter()
+
+    # 4) render all outputs in one pass over shared sprites, frame t of
+    #    every output in turn; the encoder consumes frames as they are
+    #    composited, so at most queue_size synopsis frames are in memory
+    q_out = queue.Queue(queue_size)
+    outputs = {}
+    writers = {}
+
+    def encode(item):
+        path, frame = item
+        if path not in writers:
+            H, W, _ = frame.shape
+            writers[path] = open_writer(path, W, H, fps_out, codec, segment_len)
+        with PROFILER.span("encode"):
+            writers[path].write(frame)
+        PROFILER.count("frames_encoded")
+        return 1
+
+    def close_writers():
+        while writers:
+            writers.popitem()[1].close()
+
+    render_outputs, paths = [], []
+    for cid, group in class_groups.items():
+        shifts, syn_len = schedules[cid]
+        if syn_len == 0:
+            continue
+        path = output_path(out_pattern.format(names[int(cid)]), codec, segment_len)
+        outputs[names[int(cid)]] = path
+        render_outputs.append((group, shifts, syn_len))
+        paths.append(path)
+
+    encode_stage = _Stage("encode", encode, q_out, on_done=close_writers)
+    encode_stage.start()
+    render_stats = StageStats("render")
+    render_stats.start = time.perf_counter()
+    try:
+        synopsis = iter_multi_synopsis_frames(frames, render_outputs, background_img)
+        while True:
+            t0 = time.perf_counter()
+            item = next(synopsis, None)
+            render_stats.busy += time.perf_counter() - t0
+            if item is None:
+                break
+            o, frame = item
+            render_stats.items += 1
+            render_stats.sample_queue(q_out)
+            q_out.put((paths[o], frame))
+    finally:
+        q_out.put(_DONE)
+        render_stats.end = time.perf_counter()
+        encode_stage.join()
+
+    stats = [
+        decode_stats,
+        detect_stage.stats,
+        track_stage.stats,
+        bg_stage.stats,
+        schedule_stats,
+        render_stats,
+        encode_stage.stats,
+    ]
+    print_stage_report(stats)
+    return outputs, stats
@@ -1,8 +1,11 @@
 import os
 
-import cv2
 import numpy as np
 
+from profiler import PROFILER
+from tube import union_patches
+from videoOutput import open_writer, output_path
+
 
 def bbox_iou(boxA, boxB):
     """
@@ -24,15 +27,128 @@ def bbox_iou(boxA, boxB):
     return inter / union if union > 0 else 0.0
 
 
+def mask_iou(patch_a, box_a, patch_b, box_b):
+    """IoU of two bbox-cropped mask patches, box = (x1,y1,x2,y2) exclusive."""
+    x1 = max(box_a[0], box_b[0])
+    y1 = max(box_a[1], box_b[1])
+    x2 = min(box_a[2], box_b[2])
+    y2 = min(box_a[3], box_b[3])
+    inter = 0
+    if x2 > x1 and y2 > y1:
+        ia = patch_a[y1 - box_a[1] : y2 - box_a[1], x1 - box_a[0] : x2 - box_a[0]]
+        ib = patch_b[y1 - box_b[1] : y2 - box_b[1], x1 - box_b[0] : x2 - box_b[0]]
+        inter = int(np.count_nonzero(ia & ib))
+    union = int(np.count_nonzero(patch_a)) + int(np.count_nonzero(patch_b)) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def bbox_iou_many(boxes_a, boxes_b):
+    """Row-wise bbox_iou of two (N, 4) xyxy box arrays."""
+    a = np.asarray(boxes_a, dtype=np.int64)
+    b = np.asarray(boxes_b, dtype=np.int64)
+    inter_w = np.maximum(0, np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]))
+    inter_h = np.maximum(0, np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]))
+    inter = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a + area_b - inter
+    out = np.zeros(len(a))
+    np.divide(inter, union, out=out, where=union > 0)
+    return out
+
+
+def _frame_index(tubes, tube_ids):
+    """(frame, tube, detection) arrays of the given tubes, sorted by frame
+    and in tube_ids order within a frame."""
+    frames = np.concatenate([tubes[k].frames for k in tube_ids])
+    tube_ix = np.concatenate([np.full(len(tubes[k]), k) for k in tube_ids])
+    det_ix = np.concatenate([np.arange(len(tubes[k])) for k in tube_ids])
+    order = np.argsort(frames, kind="stable")
+    return frames[order], tube_ix[order], det_ix[order]
+
+
+@PROFILER.profiled("merge")
+def merge_masks_by_class(tubes, pairs=((0, 3),), iou_thresh=0.1):
+    """
+    For every (target_cls, source_cls) pair, e.g. rider + vehicle: whenever
+    a source-class detection shares a frame with a target-class detection
+    and their bboxes overlap by >= iou_thresh, union the source mask into
+    the target mask and expand the target bbox to cover both.
+
+    Candidate pairs come from a frame -> detections join of the two
+    classes, and their box IoUs are computed in one vectorized pass; from
+    its first hit, each target detection then takes its remaining
+    candidates in tube order against its growing box. Tubes are modified
+    in place.
+
+    Args:
+      tubes      : list of tube.Tube records
+      pairs      : iterable of (target_cls, source_cls) class ids
+      iou_thresh : bounding-box IoU threshold to trigger merge
+
+    Returns:
+      tubes      : the same list
+    """
+    for target_cls, source_cls in pairs:
+        targets = [k for k, t in enumerate(tubes) if t.cls_id == target_cls]
+        sources = [k for k, t in enumerate(tubes) if t.cls_id == source_cls]
+        if not targets or not sources:
+            continue
+        t_frame, t_tube, t_det = _frame_index(tubes, targets)
+        s_frame, s_tube, s_det = _frame_index(tubes, sources)
+
+        # frame join: every target detection x source detections of its frame
+        lo = np.searchsorted(s_frame, t_frame, "left")
+        n = np.searchsorted(s_frame, t_frame, "right") - lo
+        a = np.repeat(np.arange(len(t_frame)), n)
+        first = np.cumsum(n) - n
+        b = np.repeat(lo - first, n) + np.arange(n.sum())
+        t_boxes = np.stack([tubes[k].bboxes[i] for k, i in zip(t_tube, t_det)])
+        s_boxes = np.stack([tubes[k].bboxes[i] for k, i in zip(s_tube, s_det)])
+        hit = bbox_iou_many(t_boxes[a], s_boxes[b]) >= iou_thresh
+        # a target box grows with every merge: from each first hit, walk
+        # the remaining candidates of that detection in tube order, re-testing
+        # them against the grown box
+        updates = {}
+        for ta in np.unique(a[hit]).tolist():
+            cand = b[first[ta] : first[ta] + n[ta]]
+            j = int(np.argmax(hit[first[ta] : first[ta] + n[ta]]))
+            P, iP = tubes[t_tube[ta]], int(t_det[ta])
+            patch, mbox = P.patch(iP), P.mask_boxes[iP]
+            box = P.bboxes[iP].copy()
+            while True:
+                B, iB = tubes[s_tube[cand[j]]], int(s_det[cand[j]])
+                # Union the source mask into the target mask
+                patch, mbox = union_patches(patch, mbox, B.patch(iB), B.mask_boxes[iB])
+                # expand the bbox to cover both
+                boxB = B.bboxes[iB]
+                box[:2] = np.minimum(box[:2], boxB[:2])
+                box[2:] = np.maximum(box[2:], boxB[2:])
+                rest = cand[j + 1 :]
+                ious = bbox_iou_many(
+                    np.broadcast_to(box, (len(rest), 4)), s_boxes[rest]
+                )
+                nxt = np.flatnonzero(ious >= iou_thresh)
+                if len(nxt) == 0:
+                    break
+                j += 1 + int(nxt[0])
+            P.bboxes[iP] = box
+            updates.setdefault(int(t_tube[ta]), {})[iP] = (patch, mbox)
+        for k, tube_updates in updates.items():
+            tubes[k].set_masks(tube_updates)
+        PROFILER.count("merge_candidate_pairs", len(a))
+        PROFILER.count("masks_merged", sum(map(len, updates.values())))
+    return tubes
+
+
 def merge_bike_into_person_masks(tubes, person_cls_id=0, bike_cls_id=3, iou_thresh=0.1):
     """
     For each person tube, whenever a bike tube shares a frame and
     their bboxes overlap by >= iou_thresh, union the bike mask
-    into the person mask for that frame.
+    into the person mask for that frame (see merge_masks_by_class).
 
     Args:
-      tubes          : list of tube dicts with keys
-                       'frames','masks','bboxes','cls_ids'
+      tubes          : list of tube.Tube records
       person_cls_id  : the class ID for person in tubes
       bike_cls_id    : the class ID for bike in tubes
       iou_thresh     : bounding-box IoU threshold to trigger merge
@@ -41,137 +157,103 @@ def merge_bike_into_person_masks(tubes, person_cls_id=0, bike_cls_id=3, iou_thre
       new_tubes      : list of tubes where person tubes have been
                        augmented with overlapping bike masks
     """
-
-    def bbox_iou(boxA, boxB):
-        xA = max(boxA[0], boxB[0])
-        yA = max(boxA[1], boxB[1])
-        xB = min(boxA[2], boxB[2])
-        yB = min(boxA[3], boxB[3])
-        interW = max(0, xB - xA)
-        interH = max(0, yB - yA)
-        inter = interW * interH
-        areaA = (boxA[2] - boxA[0]) * (boxA[3] - boxA[1])
-        areaB = (boxB[2] - boxB[0]) * (boxB[3] - boxB[1])
-        union = areaA + areaB - inter
-        return inter / union if union > 0 else 0.0
-
-    # Separate person and bike tubes
-    person_tubes = [t for t in tubes if t["cls_ids"][0] == person_cls_id]
-    bike_tubes = [t for t in tubes if t["cls_ids"][0] == bike_cls_id]
-    others = [t for t in tubes if t["cls_ids"][0] not in (person_cls_id, bike_cls_id)]
-
-    # For each person tube, augment its masks
-    for P in person_tubes:
-        # Build a quick lookup for P: frame -> index in P["frames"]
-        idxP = {fr: i for i, fr in enumerate(P["frames"])}
-        for B in bike_tubes:
-            # Build same for B
-            idxB = {fr: i for i, fr in enumerate(B["frames"])}
-            # find common frames
-            for fr in set(idxP) & set(idxB):
-                iP = idxP[fr]
-                iB = idxB[fr]
-                boxP = P["bboxes"][iP]
-                boxB = B["bboxes"][iB]
-                if bbox_iou(boxP, boxB) >= iou_thresh:
-                    # Union the bike mask into the person mask
-                    P["masks"][iP] = P["masks"][iP] | B["masks"][iB]
-                    # (Optionally) expand the bbox to cover both:
-                    x1p, y1p, x2p, y2p = boxP
-                    x1b, y1b, x2b, y2b = boxB
-                    P["bboxes"][iP] = (
-                        min(x1p, x1b),
-                        min(y1p, y1b),
-                        max(x2p, x2b),
-                        max(y2p, y2b),
-                    )
+    merge_masks_by_class(tubes, [(person_cls_id, bike_cls_id)], iou_thresh)
+    person_tubes = [t for t in tubes if t.cls_id == person_cls_id]
+    bike_tubes = [t for t in tubes if t.cls_id == bike_cls_id]
+    others = [t for t in tubes if t.cls_id not in (person_cls_id, bike_cls_id)]
     # Return combined list: modified person tubes + all others (including original bike tubes)
     return person_tubes + bike_tubes + others
 
 
+@PROFILER.profiled("refine")
 def refine_tubes_by_bbox_disp(tubes, min_disp=5, min_frames=1):
     """
     Subsample each tube so that consecutive kept frames have their
     bounding-box center moved at least max_disp pixels.
 
+    All tubes are processed together on one flat array of box centres:
+    step j compares detection j of every tube that long with the last
+    centre kept in that tube, so the Python loop runs max(len(tube)) times
+    instead of once per detection.
+
     Args:
-      tubes    : list of tube dicts, each with keys:
-                   - "frames":   list of int frame indices
-                   - "bboxes":   list of (x1,y1,x2,y2) tuples
-                   - "masks":    list of (H,W) bool masks
-                   - "cls_ids":  list of int class IDs
+      tubes    : list of tube.Tube records
       min_disp : minimum Euclidean displacement (in pixels) required
                  before keeping a new frame in the tube.
 
     Returns:
-      refined : new list of tubes in the same format, but with each
-                tube subsampled by displacement.
+      refined : new list of Tube records, each subsampled by displacement.
     """
-    refined = []
-    for tube in tubes:
-        frs = tube["frames"]
-        bbs = tube["bboxes"]
-        # msks = tube["masks"]
-        # cls_ids = tube.get("cls_ids", None)
-
-        last_cx = last_cy = None
-        new_tube = {k: [] for k in tube}
-
-        for idx, t in enumerate(frs):
-            x1, y1, x2, y2 = bbs[idx]
-            cx, cy = (x1 + x2) / 2.0, (y1 + y2) / 2.0
-
-            # Always keep the very first detection
-            if last_cx is None or np.hypot(cx - last_cx, cy - last_cy) >= min_disp:
-                # append this index to the new tube
-                for key in tube:
-                    new_tube[key].append(tube[key][idx])
-                last_cx, last_cy = cx, cy
+    if not tubes:
+        return []
+    lens = np.array([len(t) for t in tubes], dtype=np.int64)
+    starts = np.zeros(len(tubes), dtype=np.int64)
+    starts[1:] = np.cumsum(lens)[:-1]
+    bbs = np.concatenate([t.bboxes for t in tubes])
+    centres = np.column_stack(
+        [(bbs[:, 0] + bbs[:, 2]) / 2.0, (bbs[:, 1] + bbs[:, 3]) / 2.0]
+    )
 
-        # only include tubes whic has moving object lenth
-        if len(new_tube["frames"]) > min_frames:
-            refined.append(new_tube)
+    # Always keep the very first detection
+    keep = np.zeros(len(centres), dtype=bool)
+    keep[starts[lens > 0]] = True
+    last = centres[np.minimum(starts, len(centres) - 1)].copy()
+    for j in range(1, int(lens.max(initial=0))):
+        live = np.flatnonzero(lens > j)
+        idx = starts[live] + j
+        d = centres[idx] - last[live]
+        moved = np.hypot(d[:, 0], d[:, 1]) >= min_disp
+        keep[idx[moved]] = True
+        last[live[moved]] = centres[idx[moved]]
 
+    refined = []
+    for tube, s, n in zip(tubes, starts, lens):
+        idx = np.flatnonzero(keep[s : s + n])
+        # only include tubes whic has moving object lenth
+        if len(idx) > min_frames:
+            refined.append(tube.take(idx))
+    PROFILER.count("tubes_kept_min_disp", len(refined))
+    PROFILER.count("tubes_dropped_min_disp", len(tubes) - len(refined))
+    PROFILER.count("detections_dropped_min_disp", int(len(keep) - keep.sum()))
     return refined
 
 
 # save tubes for debugging
-def save_tubes_as_videos(frames, tubes, out_dir="tubes", fps=10):
+def save_tubes_as_videos(frames, tubes, out_dir="tubes", fps=10, codec="mp4v"):
     """
     For each tube, create a video of just that tube’s appearances.
 
     Arguments:
       frames : list of (H, W, 3) uint8 original frames
-      tubes  : list of dicts, each with:
-                 - "frames": list of frame indices
-                 - "masks" : list of (H, W) bool masks
+      tubes  : list of tube.Tube records
       out_dir : directory to write tube_0.mp4, tube_1.mp4, …
       fps     : output frames per second
+      codec   : videoOutput.CODECS key
     """
     os.makedirs(out_dir, exist_ok=True)
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
     H, W, _ = frames[0].shape
     for i, tube in enumerate(tubes):
-        tube_len = len(tube["frames"])
+        tube_len = len(tube)
         if tube_len == 0:
             continue
 
-        path = os.path.join(out_dir, f"tube_{i}.mp4")
-        writer = cv2.VideoWriter(path, fourcc, fps, (W, H), isColor=True)
+        path = output_path(os.path.join(out_dir, f"tube_{i}"), codec)
+        writer = open_writer(path, W, H, fps, codec)
 
-        for mask, t_idx in zip(tube["masks"], tube["frames"]):
+        for i, t_idx in enumerate(tube.frames):
 
             # start with a black frame
             out_frame = np.zeros_like(frames[0])
-            # print(frames[0].shape, mask.shape)
             # copy only the object pixels
-            out_frame[mask] = frames[t_idx][mask]
+            x1, y1, x2, y2 = tube.mask_boxes[i]
+            patch = tube.patch(i)
+            out_frame[y1:y2, x1:x2][patch] = frames[t_idx][y1:y2, x1:x2][patch]
             writer.write(out_frame)
 
-        writer.release()
+        writer.close()
         print(f"Saved tube {i} ({tube_len} frames) → {path}")
 
 
 # 4) Filter tubes by a single class ID
 def filter_tubes_by_class(tubes, class_id):
-    return [tube for tube in tubes if tube["cls_ids"][0] == class_id]
+    return [tube for tube in tubes if tube.cls_id == class_id]
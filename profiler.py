@@ -0,0 +1,210 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+_OFF = nullcontext()
+
+
+class StageRecord:
+    """Aggregated timings of one named stage."""
+
+    __slots__ = ("count", "total", "max", "peak_mem")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.peak_mem = 0
+
+    def as_dict(self):
+        d = dict(
+            count=self.count,
+            total_s=self.total,
+            mean_s=self.total / self.count if self.count else 0.0,
+            max_s=self.max,
+        )
+        if self.peak_mem:
+            d["peak_mem_mb"] = self.peak_mem / 2**20
+        return d
+
+
+class _Span:
+    __slots__ = ("prof", "name", "t0", "mem")
+
+    def __init__(self, prof, name):
+        self.prof = prof
+        self.name = name
+        self.mem = None
+
+    def __enter__(self):
+        if self.prof.memory:
+            self.mem = self.prof._mem_open()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = time.perf_counter()
+        self.prof._record(self.name, self.t0, t1, self.mem)
+        return False
+
+
+class Profiler:
+    """
+    Stage timers and counters for the synopsis pipeline.
+
+    Off by default: `span` then returns a shared no-op context and `count`
+    returns at once, so instrumented code pays one attribute check.
+
+      with PROFILER.span("schedule"): ...   # time a stage (nestable)
+      PROFILER.count("detections", n)       # add to a counter
+
+    When enabled, every span is aggregated per name (count, total, mean,
+    max), optionally with its peak traced memory (tracemalloc, `memory`)
+    and, with `trace`, kept as an event for a Chrome trace
+    (chrome://tracing, Perfetto). tracemalloc has one process-wide peak:
+    a span's peak is measured over everything allocated while it is open,
+    so spans running concurrently in other threads are included in each
+    other's.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.trace = False
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._open_mem = {}  # id -> [start, peak] of the open spans, all threads
+        self._t_start = time.perf_counter()
+
+    def enable(self, trace=False, memory=False):
+        self.reset()
+        self.enabled = True
+        self.trace = trace
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+
+    def span(self, name):
+        return _Span(self, name) if self.enabled else _OFF
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def profiled(self, name=None):
+        """Decorator running the whole function inside span(name)."""
+
+        def wrap(fn):
+            stage = name or fn.__name__
+
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+
+            return inner
+
+        return wrap
+
+    def _fold_peak(self):
+        # under self._lock: the traced peak is process-wide, so it is saved
+        # into every open span before anything resets it
+        cur, peak = tracemalloc.get_traced_memory()
+        for entry in self._open_mem.values():
+            entry[1] = max(entry[1], peak)
+        return cur
+
+    def _mem_open(self):
+        with self._lock:
+            cur = self._fold_peak()
+            entry = [cur, cur]
+            self._open_mem[id(entry)] = entry
+            tracemalloc.reset_peak()
+        return entry
+
+    def _record(self, name, t0, t1, mem=None):
+        peak = 0
+        if mem is not None:
+            with self._lock:
+                self._fold_peak()
+                self._open_mem.pop(id(mem), None)
+            peak = mem[1] - mem[0]
+        dt = t1 - t0
+        with self._lock:
+            rec = self.stages.get(name)
+            if rec is None:
+                rec = self.stages[name] = StageRecord()
+            rec.count += 1
+            rec.total += dt
+            rec.max = max(rec.max, dt)
+            rec.peak_mem = max(rec.peak_mem, peak)
+            if self.trace:
+                self.events.append(
+                    dict(
+                        name=name,
+                        ph="X",
+                        ts=(t0 - self._t_start) * 1e6,
+                        dur=dt * 1e6,
+                        pid=os.getpid(),
+                        tid=threading.get_ident(),
+                    )
+                )
+
+    def report(self):
+        """JSON-able summary: wall time since enable, stages and counters."""
+        return dict(
+            wall_s=time.perf_counter() - self._t_start,
+            stages={k: v.as_dict() for k, v in self.stages.items()},
+            counters=dict(self.counters),
+        )
+
+    def print_report(self):
+        rep = self.report()
+        print(
+            f"{'stage':>28} {'count':>8} {'total s':>9} {'mean ms':>9} {'peak MB':>8}"
+        )
+        for name, d in sorted(rep["stages"].items(), key=lambda kv: -kv[1]["total_s"]):
+            print(
+                f"{name:>28} {d['count']:>8} {d['total_s']:>9.3f} "
+                f"{1000 * d['mean_s']:>9.3f} {d.get('peak_mem_mb', 0):>8.1f}"
+            )
+        for name, n in sorted(rep["counters"].items()):
+            print(f"{name:>28} {n:>8}")
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+        print(f"[INFO] profile written to {path}")
+
+    def write_chrome_trace(self, path):
+        end = (time.perf_counter() - self._t_start) * 1e6
+        counters = [
+            dict(name=name, ph="C", ts=end, pid=os.getpid(), args={name: n})
+            for name, n in self.counters.items()
+        ]
+        with open(path, "w") as f:
+            json.dump(dict(traceEvents=self.events + counters), f)
+        print(f"[INFO] chrome trace written to {path}")
+
+
+# process-wide profiler used by the pipeline modules
+PROFILER = Profiler()
@@ -2,46 +2,530 @@ from collections import defaultdict
 
 import numpy as np
 
+from profiler import PROFILER
+
 
 # 5) Greedy schedule tubes into a short synopsis
+@PROFILER.profiled("schedule_greedy")
 def schedule_tubes_dynamic(tubes, H, W):
     shifts = [None] * len(tubes)
     occupancy = []
     for i, tube in enumerate(tubes):
-        L = len(tube["frames"])
+        L = len(tube)
+        # decode each bbox-cropped mask once per tube
+        patches = list(tube.patches())
+        boxes = tube.mask_boxes
         placed = False
+        n_starts = max(0, len(occupancy) - L) + 1
         # try all existing start positions
-        for s in range(max(0, len(occupancy) - L) + 1):
+        for s in range(n_starts):
             if any(
-                (tube["masks"][j] & occupancy[s + j]).any()
+                (
+                    patches[j]
+                    & occupancy[s + j][
+                        boxes[j, 1] : boxes[j, 3], boxes[j, 0] : boxes[j, 2]
+                    ]
+                ).any()
                 for j in range(L)
                 if s + j < len(occupancy)
             ):
                 continue
             shifts[i] = s
-            # extend occupancy
-            while len(occupancy) < s + L:
-                occupancy.append(np.zeros((H, W), dtype=bool))
-            for j, m in enumerate(tube["masks"]):
-                occupancy[s + j] |= m
             placed = True
             break
         if not placed:
             s = len(occupancy)
             shifts[i] = s
-            for _ in range(L):
-                occupancy.append(np.zeros((H, W), dtype=bool))
-            for j, m in enumerate(tube["masks"]):
-                occupancy[s + j] |= m
+        PROFILER.count("schedule_offsets_tried", s + 1 if placed else n_starts)
+        # extend occupancy
+        while len(occupancy) < s + L:
+            occupancy.append(np.zeros((H, W), dtype=bool))
+        for j, (x1, y1, x2, y2) in enumerate(boxes):
+            occupancy[s + j][y1:y2, x1:x2] |= patches[j]
     return shifts, len(occupancy)
 
 
+class OccupancyVolume:
+    """
+    Synopsis occupancy kept at two levels of detail.
+
+      grid : (T, gh * gw) count of placed masks touching each `cell` x
+             `cell` block (placed masks never overlap, so a cell holds at
+             most cell**2 of them: uint8 up to cell 15, then uint16)
+      bits : (T, H * ceil(W / 64)) uint64 bit-packed union of placed masks
+
+    A tube is reduced once to flat index arrays (`footprint`), so all of
+    its frames can be tested against a whole block of candidate starts with
+    one gather on the coarse grid; the packed mask words are then read only
+    for the (start, frame) pairs the grid could not clear.
+    """
+
+    def __init__(self, H, W, cell=8):
+        self.H, self.W, self.cell = H, W, cell
+        self.gh = -(-H // cell)
+        self.gw = -(-W // cell)
+        self.ww = -(-W // 64)
+        self.length = 0
+        if not 1 <= cell <= 255:
+            raise ValueError(f"cell must be in [1, 255], got {cell}")
+        self.count_dtype = np.min_scalar_type(cell * cell)
+        self.grid = np.zeros((0, self.gh * self.gw), dtype=self.count_dtype)
+        self.bits = np.zeros((0, H * self.ww), dtype=np.uint64)
+
+    def __len__(self):
+        return self.length
+
+    def _reserve(self, cap):
+        if cap > len(self.grid):
+            cap = max(cap, 2 * len(self.grid), 64)
+            grid = np.zeros((cap, self.grid.shape[1]), dtype=self.count_dtype)
+            grid[: len(self.grid)] = self.grid
+            bits = np.zeros((cap, self.bits.shape[1]), dtype=np.uint64)
+            bits[: len(self.bits)] = self.bits
+            self.grid, self.bits = grid, bits
+
+    def footprint(self, tube):
+        """
+        Flatten a tube's masks into index arrays:
+          (cell_t, cell_idx, cell_groups) : grid cells touched per frame
+          (word_t, word_idx, word_val, word_groups) : non-zero packed words
+        where *_t is the tube frame and *_groups the reduceat offsets.
+
+        Detections sharing a mask id (tube.mask_ids) at the same alignment
+        to the grid cells and the 64-bit words reuse one reduction.
+        """
+        c = self.cell
+        n_cells, cell_idx, n_words, word_idx, word_val = [], [], [], [], []
+        reduced = {}
+        ids = tube.mask_ids().tolist()
+        for mid, patch, box in zip(ids, tube.patches(), tube.mask_boxes.tolist()):
+            x1, y1, x2, y2 = box
+            key = (mid, x1 % c, y1 % c, x1 % 64)
+            rel = reduced.get(key)
+            if rel is None:
+                rel = reduced[key] = self._reduce(patch, *key[1:])
+            else:
+                PROFILER.count("footprint_masks_reused")
+            cy, cx, wy, wx, val = rel
+            n_cells.append(len(cy))
+            cell_idx.append((cy + y1 // c) * self.gw + cx + x1 // c)
+            n_words.append(len(wy))
+            word_idx.append((wy + y1) * self.ww + wx + x1 // 64)
+            word_val.append(val)
+
+        frames = np.arange(len(tube))
+        n_cells, n_words = np.array(n_cells), np.array(n_words)
+        return (
+            np.repeat(frames, n_cells),
+            np.concatenate(cell_idx),
+            np.cumsum(n_cells) - n_cells,
+            np.repeat(frames, n_words),
+            np.concatenate(word_idx),
+            np.concatenate(word_val),
+            np.cumsum(n_words) - n_words,
+        )
+
+    def _reduce(self, patch, ox, oy, wo):
+        """
+        Grid cells and packed words of a patch whose top-left pixel sits
+        at (ox, oy) in its cell and at bit wo of its word, relative to
+        that cell and word.
+        """
+        c = self.cell
+        h, w = patch.shape
+        # any() over the grid cells the patch straddles
+        ys = np.arange(-oy, h, c).clip(0)
+        xs = np.arange(-ox, w, c).clip(0)
+        cells = np.logical_or.reduceat(patch, ys, axis=0)
+        cells = np.logical_or.reduceat(cells, xs, axis=1)
+        cy, cx = np.nonzero(cells)
+
+        rows = np.zeros((h, -(-(wo + w) // 64) * 64), dtype=bool)
+        rows[:, wo : wo + w] = patch
+        packed = np.packbits(rows, axis=1).view(np.uint64)
+        wy, wx = np.nonzero(packed)
+        return cy, cx, wy, wx, packed[wy, wx]
+
+    def coarse_hits(self, fp, starts):
+        """(len(starts), L) bool: grid hit of tube frame j started at s."""
+        cell_t, cell_idx, groups = fp[:3]
+        vals = self.grid[starts[:, None] + cell_t[None, :], cell_idx[None, :]]
+        return np.logical_or.reduceat(vals > 0, groups, axis=1)
+
+    def exact_hits(self, fp, pair_s, pair_j):
+        """Packed-mask collision of tube frame pair_j[k] started at pair_s[k]."""
+        word_t, word_idx, word_val, groups = fp[3:]
+        lo = groups[pair_j]
+        n = np.append(groups, len(word_t))[pair_j + 1] - lo
+        offsets = np.zeros(len(n), dtype=np.int64)
+        offsets[1:] = np.cumsum(n)[:-1]
+        # ragged arange over each pair's word range
+        sel = np.arange(n.sum()) - np.repeat(offsets - lo, n)
+        t = np.repeat(pair_s, n) + word_t[sel]
+        vals = self.bits[t, word_idx[sel]] & word_val[sel]
+        return np.logical_or.reduceat(vals != 0, offsets)
+
+    def first_fit(self, fp, n_starts, block=16, rounds=(1, 4)):
+        """
+        Smallest start in [0, n_starts) where the tube collides with nothing,
+        or None.
+
+        Starts are evaluated in blocks that double in size, so a free slot
+        near the front is found without scanning every start. Within a
+        block, exact tests run in rounds: the first `rounds[0]` grid-flagged
+        frames of each start, then the next ones for the starts still alive,
+        which mimics the early exit of the per-offset loop.
+        """
+        first = 0
+        while first < n_starts:
+            starts = np.arange(first, min(first + block, n_starts))
+            coarse = self.coarse_hits(fp, starts)
+            free = np.flatnonzero(~coarse.any(axis=1))
+            # starts before the first grid-free one need an exact test
+            m = int(free[0]) if len(free) else len(starts)
+            if m:
+                ks, js = np.nonzero(coarse[:m])
+                # rank of each flagged pair within its start
+                rank = np.arange(len(ks)) - np.searchsorted(ks, ks)
+                collide = np.zeros(m, dtype=bool)
+                lo = 0
+                for hi in rounds + (len(js),):
+                    sel = np.flatnonzero((rank >= lo) & (rank < hi) & ~collide[ks])
+                    if len(sel):
+                        PROFILER.count("schedule_exact_tests", len(sel))
+                        hit = self.exact_hits(fp, starts[ks[sel]], js[sel])
+                        collide[ks[sel[hit]]] = True
+                    lo = hi
+                ok = np.flatnonzero(~collide)
+                if len(ok):
+                    return int(starts[ok[0]])
+            if len(free):
+                return int(starts[m])
+            first += len(starts)
+            block = min(2 * block, 64)
+        return None
+
+    def add(self, s, fp, L):
+        self._reserve(s + L)
+        self.length = max(self.length, s + L)
+        self.grid[s + fp[0], fp[1]] += 1
+        self.bits[s + fp[3], fp[4]] |= fp[5]
+
+    def remove(self, s, fp):
+        """
+        Undo `add(s, fp, L)`: placed masks never overlap, so clearing the
+        tube's words leaves every other tube's bits intact. `length` is
+        left to the caller (the tube need not be the last one).
+        """
+        self.grid[s + fp[0], fp[1]] -= 1
+        self.bits[s + fp[3], fp[4]] &= ~fp[5]
+
+
+@PROFILER.profiled("schedule_bbox")
+def schedule_tubes_bbox(tubes, H, W, cell=8):
+    """
+    Same greedy first-fit as `schedule_tubes_dynamic` (identical shifts),
+    but each block of candidate starts is tested with one gather against a
+    coarse occupancy grid and confirmed on bit-packed masks, touching only
+    the cells and bytes the tube's masks cover.
+
+    Args:
+      tubes : list of tube.Tube records
+      H, W  : frame size
+      cell  : grid cell size in pixels
+
+    Returns:
+      shifts, synopsis_length
+    """
+    occ = OccupancyVolume(H, W, cell)
+    shifts = [None] * len(tubes)
+    for i, tube in enumerate(tubes):
+        L = len(tube)
+        fp = occ.footprint(tube)
+        n_starts = max(0, len(occ) - L) + 1
+        # frames past the current end read as empty
+        occ._reserve(n_starts + L)
+        s = occ.first_fit(fp, n_starts)
+        PROFILER.count("schedule_offsets_tried", n_starts if s is None else s + 1)
+        if s is None:
+            s = len(occ)
+        shifts[i] = s
+        occ.add(s, fp, L)
+    return shifts, len(occ)
+
+
+class CollisionTable:
+    """
+    Lazily filled table of pairwise collision areas.
+
+    `area(i, j, d)` is the number of pixels where tube i and tube j overlap
+    when j starts d frames after i. Only pairs whose mask envelopes
+    intersect are ever evaluated, results are memoised per (i, j, d), and
+    each evaluation only touches the mask boxes that intersect. For tubes
+    with shared masks (tube.mask_ids), the overlap of two masks is also
+    memoised per mask pair and relative offset, so a stationary object
+    coded against few keyframes is compared once per keyframe pair.
+    """
+
+    def __init__(self, tubes):
+        self.tubes = tubes
+        self.patches = [list(t.patches()) for t in tubes]
+        self.mask_ids = [t.mask_ids() for t in tubes]
+        self.shared = [len(np.unique(m)) < len(m) for m in self.mask_ids]
+        env = np.array(
+            [
+                (
+                    t.mask_boxes[:, 0].min(),
+                    t.mask_boxes[:, 1].min(),
+                    t.mask_boxes[:, 2].max(),
+                    t.mask_boxes[:, 3].max(),
+                )
+                for t in tubes
+            ]
+        ).reshape(-1, 4)
+        inter = (
+            np.maximum(env[:, None, 0], env[None, :, 0])
+            < np.minimum(env[:, None, 2], env[None, :, 2])
+        ) & (
+            np.maximum(env[:, None, 1], env[None, :, 1])
+            < np.minimum(env[:, None, 3], env[None, :, 3])
+        )
+        np.fill_diagonal(inter, False)
+        self.neighbors = [np.flatnonzero(row) for row in inter]
+        self._cache = {}
+        self._mask_cache = {}
+
+    def area(self, i, j, d):
+        if i > j:
+            i, j, d = j, i, -d
+        key = (i, j, d)
+        hit = self._cache.get(key)
+        if hit is not None:
+            return hit
+        A, B = self.tubes[i], self.tubes[j]
+        # frame a of i is shown together with frame a - d of j
+        a = np.arange(max(0, d), min(len(A), len(B) + d))
+        total = 0
+        if len(a):
+            ba, bb = A.mask_boxes[a], B.mask_boxes[a - d]
+            ix1 = np.maximum(ba[:, 0], bb[:, 0])
+            iy1 = np.maximum(ba[:, 1], bb[:, 1])
+            ix2 = np.minimum(ba[:, 2], bb[:, 2])
+            iy2 = np.minimum(ba[:, 3], bb[:, 3])
+            shared = self.shared[i] or self.shared[j]
+            for k in np.flatnonzero((ix1 < ix2) & (iy1 < iy2)):
+                (ax1, ay1), (bx1, by1) = ba[k, :2], bb[k, :2]
+                if shared:
+                    pair = (
+                        i,
+                        int(self.mask_ids[i][a[k]]),
+                        j,
+                        int(self.mask_ids[j][a[k] - d]),
+                        int(bx1 - ax1),
+                        int(by1 - ay1),
+                    )
+                    n = self._mask_cache.get(pair)
+                    if n is not None:
+                        total += n
+                        continue
+                pa, pb = self.patches[i][a[k]], self.patches[j][a[k] - d]
+                ys, xs = slice(iy1[k], iy2[k]), slice(ix1[k], ix2[k])
+                n = int(
+                    np.count_nonzero(
+                        pa[
+                            ys.start - ay1 : ys.stop - ay1,
+                            xs.start - ax1 : xs.stop - ax1,
+                        ]
+                        & pb[
+                            ys.start - by1 : ys.stop - by1,
+                            xs.start - bx1 : xs.stop - bx1,
+                        ]
+                    )
+                )
+                if shared:
+                    self._mask_cache[pair] = n
+                total += n
+        self._cache[key] = total
+        return total
+
+
+@PROFILER.profiled("schedule_energy")
+def schedule_tubes_energy(
+    tubes,
+    H,
+    W,
+    target_len=None,
+    w_collision=1.0,
+    w_length=10.0,
+    w_chrono=0.0,
+    n_iters=20000,
+    t_start=None,
+    t_end=0.1,
+    max_step=None,
+    seed=0,
+):
+    """
+    Pack tubes by minimising a weighted energy with simulated annealing:
+
+      E = w_collision * sum of pairwise collision areas (pixels)
+        + w_length    * synopsis length (frames)
+        + w_chrono    * sum over pairs of frames by which a tube that
+                        started later in the source is shown earlier
+
+    Every tube starts inside [0, target_len - len(tube)], so the synopsis
+    never exceeds max(target_len, longest tube). Without a target_len the
+    search starts from the collision-free bbox schedule, and its length is
+    the budget: the annealing then only trades collisions for a shorter
+    synopsis where the weights favour it. A move re-times one tube
+    and only the energy terms involving that tube are re-scored; collision
+    areas come from a memoised CollisionTable. Results are deterministic
+    for a given seed.
+
+    Args:
+      tubes       : list of tube.Tube records
+      H, W        : frame size (unused; kept for a uniform scheduler API)
+      target_len  : synopsis length budget in frames
+                    (default: the length of the bbox schedule)
+      w_*         : energy weights
+      n_iters     : number of proposed moves
+      t_start     : initial temperature (default: scaled to the initial
+                    mean collision cost per tube)
+      t_end       : final temperature
+      max_step    : largest local re-timing step (default: target_len // 4)
+      seed        : RNG seed
+
+    Returns:
+      shifts, synopsis_length
+    """
+    n = len(tubes)
+    if n == 0:
+        return [], 0
+    lengths = np.array([len(t) for t in tubes])
+    orig = np.array([int(t.frames[0]) for t in tubes])
+    start = None
+    if target_len is None:
+        start, target_len = schedule_tubes(tubes, H, W, "bbox")
+    window = np.maximum(target_len - lengths, 0)
+    if max_step is None:
+        max_step = max(1, target_len // 4)
+    rng = np.random.default_rng(seed)
+    table = CollisionTable(tubes)
+
+    if start is not None:
+        shifts = np.array(start)
+    else:
+        # chronological start: compress source start times into the window
+        span = max(1, orig.max() - orig.min())
+        shifts = np.minimum(((orig - orig.min()) * target_len) // span, window)
+
+    def collision(i, s_i):
+        nb = table.neighbors[i]
+        d = shifts[nb] - s_i
+        live = (d < lengths[i]) & (d > -lengths[nb])  # overlap in time
+        return sum(table.area(i, int(j), int(dj)) for j, dj in zip(nb[live], d[live]))
+
+    def chrono(i, s_i):
+        if not w_chrono:
+            return 0
+        early = orig < orig[i]
+        late = orig > orig[i]
+        return int(
+            np.maximum(shifts[early] - s_i, 0).sum()
+            + np.maximum(s_i - shifts[late], 0).sum()
+        )
+
+    ends = shifts + lengths
+    end_count = np.bincount(ends, minlength=int(window.max() + lengths.max()) + 1)
+    syn_len = int(ends.max())
+
+    coll = sum(collision(i, shifts[i]) for i in range(n)) / 2
+    chron = sum(chrono(i, shifts[i]) for i in range(n)) / 2
+    energy = w_collision * coll + w_length * syn_len + w_chrono * chron
+    if t_start is None:
+        t_start = max(1.0, w_collision * coll / n)
+    cooling = (t_end / t_start) ** (1.0 / max(1, n_iters))
+
+    best_energy, best_shifts = energy, shifts.copy()
+    temp = t_start
+    for _ in range(n_iters):
+        i = int(rng.integers(n))
+        temp *= cooling
+        if window[i] == 0:
+            continue
+        s_old = int(shifts[i])
+        if rng.random() < 0.5:
+            s_new = int(rng.integers(window[i] + 1))
+        else:
+            step = int(rng.integers(-max_step, max_step + 1))
+            s_new = min(max(s_old + step, 0), int(window[i]))
+        if s_new == s_old:
+            continue
+
+        # new synopsis length if tube i moves
+        old_end, new_end = s_old + lengths[i], s_new + lengths[i]
+        end_count[old_end] -= 1
+        end_count[new_end] += 1
+        new_len = int(np.flatnonzero(end_count)[-1])
+
+        delta = w_length * (new_len - syn_len)
+        delta += w_collision * (collision(i, s_new) - collision(i, s_old))
+        if w_chrono:
+            delta += w_chrono * (chrono(i, s_new) - chrono(i, s_old))
+
+        PROFILER.count("schedule_offsets_tried")
+        if delta <= 0 or rng.random() < np.exp(-delta / temp):
+            PROFILER.count("schedule_moves_accepted")
+            shifts[i] = s_new
+            syn_len = new_len
+            energy += delta
+            if energy < best_energy:
+                best_energy, best_shifts = energy, shifts.copy()
+        else:
+            end_count[new_end] -= 1
+            end_count[old_end] += 1
+
+    PROFILER.count("collision_pairs_evaluated", len(table._cache))
+    best_shifts = [int(s) for s in best_shifts]
+    return best_shifts, int(max(s + L for s, L in zip(best_shifts, lengths)))
+
+
+def schedule_tubes(tubes, H, W, method="greedy", sort_by_length=True, **kwargs):
+    """
+    Run one of the scheduling engines and return (shifts, syn_len) in the
+    order of `tubes`.
+
+    Args:
+      method         : "greedy" (schedule_tubes_dynamic), "bbox"
+                       (schedule_tubes_bbox) or "energy"
+                       (schedule_tubes_energy)
+      sort_by_length : place longest tubes first (first-fit engines only)
+      kwargs         : passed to the engine
+    """
+    engines = {
+        "greedy": schedule_tubes_dynamic,
+        "bbox": schedule_tubes_bbox,
+        "energy": schedule_tubes_energy,
+    }
+    engine = engines[method]
+    if method == "energy" or not sort_by_length:
+        return engine(tubes, H, W, **kwargs)
+
+    order = sorted(range(len(tubes)), key=lambda i: -len(tubes[i]))
+    # Reorder
+    tubes_sorted = [tubes[i] for i in order]
+    shifts_sorted, syn_len = engine(tubes_sorted, H, W, **kwargs)
+    shifts = [None] * len(tubes)
+    for new_idx, orig_idx in enumerate(order):
+        shifts[orig_idx] = shifts_sorted[new_idx]
+    return shifts, syn_len
+
+
 def groub_tubes_by_classid(all_tubes: list):
     """list of tubes
     reurn dict containing tube by class ids
     """
     class_groups = defaultdict(list)
     for tube in all_tubes:
-        cid = tube["cls_ids"][0]
+        cid = tube.cls_id
         class_groups[cid].append(tube)
     return class_groups
@@ -0,0 +1,187 @@
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from computeBackground import MotionGate
+from detectionCache import DetectionCache
+from extractTube import extract_segmentation_tubes
+from loadVideo import VideoFrameSource
+from profiler import PROFILER
+from stitchTubes import stitch_shards
+from tube import Tube
+
+
+def plan_shards(n_frames, shard_len, overlap):
+    """
+    Split [0, n_frames) into time shards of shard_len frames, each one
+    extended by `overlap` frames into the next shard.
+
+    Returns:
+      list of (start, stop) source frame ranges
+    """
+    shards = []
+    for start in range(0, n_frames, shard_len):
+        shards.append((start, min(start + shard_len + overlap, n_frames)))
+        if start + shard_len + overlap >= n_frames:
+            break
+    return shards
+
+
+def _extract_shard(args):
+    """Worker: tubes of one shard, with frame indices made global."""
+    (
+        video_path,
+        start,
+        stop,
+        width,
+        height,
+        keep_classes,
+        conf,
+        batch_size,
+        detector_factory,
+        tracker_factory,
+        cache_dir,
+        motion_gating,
+        overlap,
+    ) = args
+    t0 = time.perf_counter()
+    gate = None
+    if motion_gating:
+        gate = MotionGate()
+        if start:
+            # the `overlap` frames before the shard prime its motion model
+            n = min(start, overlap)
+            before = VideoFrameSource(video_path, n, width, height, start=start - n)
+            gate.warm_up(before)
+            before.release()
+    frames = VideoFrameSource(video_path, stop - start, width, height, start=start)
+    detector = None if detector_factory is None else detector_factory()
+    tracker = None if tracker_factory is None else tracker_factory()
+    cache = None if cache_dir is None else DetectionCache(cache_dir)
+    # keep every track, however short: it may continue in the next shard
+    tubes, names = extract_segmentation_tubes(
+        frames,
+        keep_classes,
+        min_len=1,
+        conf=conf,
+        batch_size=batch_size,
+        detector=detector,
+        tracker=tracker,
+        cache=cache,
+        motion_gate=gate,
+    )
+    frames.release()
+    tubes = [
+        Tube(
+            t.track_id,
+            t.frames + start,
+            t.centroids,
+            t.bboxes,
+            t.cls_ids,
+            t.mask_boxes,
+            t._bits,
+            t._offsets,
+        )
+        for t in tubes
+    ]
+    return tubes, dict(names), time.perf_counter() - t0
+
+
+@PROFILER.profiled("extract_sharded")
+def extract_tubes_sharded(
+    video_path,
+    keep_classes=["person"],
+    min_len=5,
+    conf=0.4,
+    batch_size=8,
+    shard_len=90000,
+    overlap=50,
+    n_workers=None,
+    max_frames=None,
+    width=640,
+    height=380,
+    detector_factory=None,
+    tracker_factory=None,
+    cache_dir=None,
+    iou_thresh=0.3,
+    mask_thresh=0.3,
+    motion_gating=False,
+):
+    """
+    extract_segmentation_tubes over time shards of a long video, one worker
+    process per shard, followed by cross-shard stitching (stitch_shards).
+    Worker processes are not profiled; the profiler sees the whole
+    extraction as one "extract_sharded" stage.
+
+    Args:
+      video_path       : input video file
+      shard_len        : source frames per shard (90000 = 1 h at 25 fps)
+      overlap          : extra frames each shard decodes into the next one;
+                         tracks are matched inside this window
+      n_workers        : worker processes (default: CPU count); each one
+                         loads its own detector
+      detector_factory : picklable callable returning a detector.Detector
+                         (default: YoloSegDetector(conf, imgsz))
+      tracker_factory  : picklable callable returning a detector.Tracker
+                         (default: BoT-SORT)
+      cache_dir        : detectionCache directory, shards are cached
+                         independently
+      iou_thresh       : min mean bbox IoU to join two tracks
+      mask_thresh      : min mean mask IoU to join two tracks
+      motion_gating    : each shard skips the detector on frames without
+                         motion (a computeBackground.MotionGate per shard,
+                         primed on the `overlap` frames before it)
+      others           : as in extract_segmentation_tubes / open_video_source
+
+    Returns:
+      tubes, names : stitched tube.Tube records (frame indices global)
+                     and the model's id -> name map
+    """
+    src = VideoFrameSource(video_path, max_frames, width, height)
+    n_frames = len(src)
+    src.release()
+    shards = plan_shards(n_frames, shard_len, overlap)
+    n_workers = min(n_workers or os.cpu_count() or 1, len(shards))
+    print(
+        f"[INFO] {n_frames} frames in {len(shards)} shards of {shard_len} "
+        f"(+{overlap}) frames on {n_workers} workers"
+    )
+    jobs = [
+        (
+            video_path,
+            start,
+            stop,
+            width,
+            height,
+            keep_classes,
+            conf,
+            batch_size,
+            detector_factory,
+            tracker_factory,
+            cache_dir,
+            motion_gating,
+            overlap,
+        )
+        for start, stop in shards
+    ]
+    if n_workers == 1:
+        results = [_extract_shard(job) for job in jobs]
+    else:
+        # spawn: CUDA / model state does not survive fork
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(n_workers, mp_context=ctx) as pool:
+            results = list(pool.map(_extract_shard, jobs))
+    for (start, stop), (tubes, _, secs) in zip(shards, results):
+        print(f"[INFO] shard {start}-{stop}: {len(tubes)} tracks in {secs:.1f}s")
+
+    with PROFILER.span("stitch"):
+        tubes = stitch_shards([r[0] for r in results], shards, iou_thresh, mask_thresh)
+    out = [t for t in tubes if len(t) >= min_len]
+    PROFILER.count("tubes_kept_min_len", len(out))
+    PROFILER.count("tubes_dropped_min_len", len(tubes) - len(out))
+    print(
+        f"[INFO] Stitched {len(out)} tubes (min_len={min_len}, "
+        f"{len(tubes) - len(out)} short ones dropped)"
+    )
+    return out, results[0][1]
@@ -0,0 +1,100 @@
+import numpy as np
+
+from processTubes import bbox_iou, mask_iou
+from tube import concat_tubes
+
+
+def _window_score(a, b, lo, hi, iou_thresh, mask_thresh):
+    """Mean box IoU of a and b over their common frames in [lo, hi), or 0."""
+    ia = {int(f): i for i, f in enumerate(a.frames) if lo <= f < hi}
+    ib = {int(f): i for i, f in enumerate(b.frames) if lo <= f < hi}
+    common = sorted(set(ia) & set(ib))
+    if not common:
+        return 0.0
+    box_ious, mask_ious = [], []
+    for f in common:
+        i, j = ia[f], ib[f]
+        box_ious.append(bbox_iou(a.bboxes[i], b.bboxes[j]))
+        mask_ious.append(
+            mask_iou(a.patch(i), a.mask_boxes[i], b.patch(j), b.mask_boxes[j])
+        )
+    box_iou, m_iou = float(np.mean(box_ious)), float(np.mean(mask_ious))
+    if box_iou < iou_thresh or m_iou < mask_thresh:
+        return 0.0
+    return box_iou + m_iou
+
+
+def match_overlap(prev_tubes, next_tubes, lo, hi, iou_thresh=0.3, mask_thresh=0.3):
+    """
+    One-to-one matching of the tracks of two neighbouring shards that
+    both saw the overlap window [lo, hi): same class, mean bbox IoU and
+    mask IoU over their common frames above the thresholds, best pairs
+    first.
+
+    Returns:
+      dict index in prev_tubes -> index in next_tubes
+    """
+    ends = [k for k, t in enumerate(prev_tubes) if t.frames[-1] >= lo]
+    starts = [k for k, t in enumerate(next_tubes) if t.frames[0] < hi]
+    pairs = []
+    for i in ends:
+        for j in starts:
+            if prev_tubes[i].cls_id != next_tubes[j].cls_id:
+                continue
+            score = _window_score(
+                prev_tubes[i], next_tubes[j], lo, hi, iou_thresh, mask_thresh
+            )
+            if score > 0:
+                pairs.append((score, i, j))
+    match, used = {}, set()
+    for _, i, j in sorted(pairs, reverse=True):
+        if i not in match and j not in used:
+            match[i] = j
+            used.add(j)
+    return match
+
+
+def stitch_shards(shard_tubes, shards, iou_thresh=0.3, mask_thresh=0.3):
+    """
+    Merge per-shard tubes into one tube set. Each overlap window is split
+    at its midpoint: detections before it are taken from the earlier
+    shard, the rest from the later one, so no frame is counted twice;
+    tracks matched across the window are joined into a single tube.
+    """
+    n = len(shards)
+    cuts = [shards[0][0]]
+    cuts += [(shards[k + 1][0] + shards[k][1]) // 2 for k in range(n - 1)]
+    cuts += [shards[-1][1]]
+    matches = [
+        match_overlap(
+            shard_tubes[k],
+            shard_tubes[k + 1],
+            shards[k + 1][0],
+            shards[k][1],
+            iou_thresh,
+            mask_thresh,
+        )
+        for k in range(n - 1)
+    ]
+
+    def owned(k, t):
+        keep = np.flatnonzero((t.frames >= cuts[k]) & (t.frames < cuts[k + 1]))
+        return t.take(keep) if len(keep) < len(t) else t
+
+    continued = [set(m.values()) for m in matches]
+    out = []
+    for k in range(n):
+        for i, tube in enumerate(shard_tubes[k]):
+            if k > 0 and i in continued[k - 1]:
+                continue  # joined to a track of the previous shard
+            parts, kk, ii = [], k, i
+            while True:
+                part = owned(kk, shard_tubes[kk][ii])
+                if len(part):
+                    parts.append(part)
+                if kk == n - 1 or ii not in matches[kk]:
+                    break
+                ii, kk = matches[kk][ii], kk + 1
+            if parts:
+                out.append(concat_tubes(parts, track_id=len(out)))
+    return out
@@ -0,0 +1,343 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+
+# modules each subcommand loads when it runs; nothing heavier than the
+# standard library is imported before a subcommand is chosen, and only
+# `extract` reaches the detector (whose torch / ultralytics imports are
+# deferred further, to the model's construction)
+STAGE_MODULES = {
+    "extract": (
+        "computeBackground",
+        "detectionCache",
+        "extractTube",
+        "loadVideo",
+        "tubeStore",
+    ),
+    "schedule": (
+        "checkpoint",
+        "maskCodec",
+        "processTubes",
+        "scheduleTubes",
+        "tubeStore",
+    ),
+    "render": (
+        "checkpoint",
+        "computeBackground",
+        "loadVideo",
+        "tubeStore",
+        "videoOutput",
+        "writeVideo",
+    ),
+}
+STAGE_MODULES["full"] = tuple(
+    sorted({m for mods in STAGE_MODULES.values() for m in mods})
+)
+STAGE_MODULES["live"] = (
+    "computeBackground",
+    "detector",
+    "extractTube",
+    "liveSynopsis",
+    "loadVideo",
+)
+
+
+def load_stage(cmd):
+    """Import the modules of subcommand `cmd` (STAGE_MODULES), in order."""
+    t0 = time.perf_counter()
+    modules = [importlib.import_module(m) for m in STAGE_MODULES[cmd]]
+    print(f"[INFO] {cmd} imports: {time.perf_counter() - t0:.2f}s")
+    return modules
+
+
+def default_store(video, store_dir="tube_store"):
+    """Tube store path of a video: store_dir/<video name>."""
+    return os.path.join(store_dir, os.path.splitext(os.path.basename(video))[0])
+
+
+def cmd_extract(args):
+    """Detect and track objects, and store their tubes with the background."""
+    computeBackground, detectionCache, extractTube, loadVideo, tubeStore = load_stage(
+        "extract"
+    )
+
+    frames = loadVideo.open_video_source(args.video, args.max_frames, *args.size)
+    print(f"[INFO] opened {len(frames)} frames of {args.video}")
+    background = computeBackground.compute_background_timeline(
+        frames, step=args.bk_step, interval=args.bk_interval
+    )
+    cache = None
+    if args.cache_dir is not None:
+        cache = detectionCache.DetectionCache(args.cache_dir)
+    tubes, names = extractTube.extract_segmentation_tubes(
+        frames,
+        args.classes,
+        min_len=args.min_len,
+        conf=args.conf,
+        batch_size=args.batch_size,
+        cache=cache,
+        motion_gate=computeBackground.MotionGate() if args.motion_gating else None,
+    )
+    store = args.store or default_store(args.video)
+    tubeStore.TubeStore.create(store, tubes, names, args.size, frames.fps, background)
+    frames.release()
+    return store
+
+
+def _query(args):
+    q = dict(
+        classes=args.classes,
+        time_range=args.time_range,
+        region=args.region,
+        speed=args.speed,
+    )
+    return {k: v for k, v in q.items() if v is not None}
+
+
+def cmd_schedule(args):
+    """
+    Schedule the tubes of a store (all, or those matching the query
+    options) into one synopsis per class plus an all-classes one; writes
+    the refined tubes and the schedules to args.out.
+    """
+    checkpoint, maskCodec, processTubes, scheduleTubes, tubeStore = load_stage(
+        "schedule"
+    )
+    store = tubeStore.TubeStore(args.store)
+    tubes = store.query(**_query(args))
+    tubes = processTubes.refine_tubes_by_bbox_disp(tubes)
+    if args.mask_codec_iou is not None:
+        tubes = maskCodec.encode_tubes(tubes, args.mask_codec_iou)
+    ids = {id(t): k for k, t in enumerate(tubes)}
+    groups = dict(scheduleTubes.groub_tubes_by_classid(tubes))
+    groups[-1] = tubes
+    kwargs = {}
+    if args.scheduler == "energy":
+        kwargs = dict(target_len=args.target_len)
+    outputs = []
+    for cid, group in groups.items():
+        name = "all_classess" if cid == -1 else store.names[int(cid)]
+        shifts, syn_len = scheduleTubes.schedule_tubes(
+            group, store.H, store.W, args.scheduler, **kwargs
+        )
+        print(f"[INFO] scheduled {len(group)} tubes ({name}): {syn_len} frames")
+        outputs.append(
+            dict(
+                name=name,
+                tubes=[ids[id(t)] for t in group],
+                shifts=[int(s) for s in shifts],
+                length=int(syn_len),
+            )
+        )
+    os.makedirs(args.out, exist_ok=True)
+    checkpoint.save_tubes(os.path.join(args.out, "tubes.npz"), tubes)
+    with open(os.path.join(args.out, "schedule.json"), "w") as f:
+        json.dump(dict(store=os.path.abspath(args.store), outputs=outputs), f, indent=1)
+    return args.out
+
+
+def cmd_render(args):
+    """Render and encode the synopses scheduled in args.schedule."""
+    checkpoint, computeBackground, loadVideo, tubeStore, videoOutput, writeVideo = (
+        load_stage("render")
+    )
+    with open(os.path.join(args.schedule, "schedule.json")) as f:
+        plan = json.load(f)
+    store = tubeStore.TubeStore(plan["store"])
+    tubes = checkpoint.load_tubes(os.path.join(args.schedule, "tubes.npz"))
+    size = args.render_size or (store.W, store.H)
+    frames = loadVideo.open_video_source(args.video, args.max_frames, *size)
+    # the stored background has the store's size; synopses are composited
+    # at the size of the frames they are rendered from
+    background = computeBackground.resize_background(store.background(), size)
+    outputs = [
+        ([tubes[k] for k in o["tubes"]], o["shifts"], o["length"])
+        for o in plan["outputs"]
+    ]
+    os.makedirs(args.out, exist_ok=True)
+    pool = videoOutput.WriterPool(args.encode_workers)
+    streams = [
+        pool.open(
+            videoOutput.output_path(
+                os.path.join(args.out, f"synopsis_cls_{o['name']}"),
+                args.codec,
+                args.segment_len,
+            ),
+            args.fps,
+            args.codec,
+            args.segment_len,
+        )
+        for o in plan["outputs"]
+    ]
+    for o, frame in writeVideo.iter_multi_synopsis_frames(
+        frames, outputs, background, tube_size=(store.W, store.H)
+    ):
+        streams[o].write(frame)
+    for stream in streams:
+        stream.close()
+    pool.close()
+    frames.release()
+    for s in pool.stats:
+        print(f"[INFO] saved {s['path']} ({s['frames']} frames)")
+    return [s["path"] for s in pool.stats]
+
+
+def cmd_full(args):
+    """extract (unless the store exists), schedule and render."""
+    load_stage("full")
+    tubeStore = sys.modules["tubeStore"]
+    args.store = args.store or default_store(args.video)
+    if args.force or not tubeStore.TubeStore.exists(args.store):
+        cmd_extract(args)
+    args.schedule = args.out
+    cmd_schedule(args)
+    return cmd_render(args)
+
+
+def cmd_live(args):
+    """
+    Follow a video as a camera feed: tracks are placed in a rolling
+    synopsis of the last args.window source frames as they end, and the
+    touched segments and the playlist in args.out are rewritten every
+    args.update_every frames (see liveSynopsis.LiveSynopsis).
+    """
+    computeBackground, detector, extractTube, liveSynopsis, loadVideo = load_stage(
+        "live"
+    )
+    W, H = args.size
+    frames = loadVideo.open_video_source(args.video, args.max_frames, W, H)
+    print(f"[INFO] following {len(frames)} frames of {args.video}")
+    # the background is built online, from the frames seen so far
+    background = computeBackground.BackgroundTimeline(args.bk_interval)
+    model = detector.YoloSegDetector(conf=args.conf, imgsz=max(W, H))
+    assembler = extractTube.TubeAssembler(
+        detector.UltralyticsTracker("botsort.yaml"), model.names, args.classes
+    )
+    live = liveSynopsis.LiveSynopsis(
+        H, W, args.out, args.window, args.segment_len, args.fps, args.codec
+    )
+    gate = computeBackground.MotionGate() if args.motion_gating else None
+
+    def update(t_now, max_gap):
+        stats = liveSynopsis.update_live_synopsis(
+            live, assembler, t_now, frames, background, args.min_len, max_gap
+        )
+        print(
+            f"[LIVE] frame {t_now}: +{stats['added']} -{stats['expired']} tubes, "
+            f"{stats['rendered']} frames rendered, synopsis {stats['length']} frames"
+        )
+
+    t = -1
+    for t, f, dets in extractTube.iter_detections(frames, model, args.batch_size, gate):
+        if t % args.bk_step == 0:
+            background.update(t, f)
+        assembler.add(t, f, dets)
+        if (t + 1) % args.update_every == 0:
+            update(t + 1, args.max_gap)
+    # end of the video: the tracks still open have ended too
+    update(t + 1, -1)
+    frames.release()
+    return os.path.join(args.out, "index.m3u8")
+
+
+def _add_extract_args(p, cache=True):
+    p.add_argument("--classes", nargs="+", default=["car"])
+    p.add_argument("--conf", type=float, default=0.4)
+    p.add_argument("--min-len", type=int, default=5)
+    p.add_argument("--batch-size", type=int, default=8)
+    if cache:
+        p.add_argument("--cache-dir", default="detection_cache")
+    p.add_argument("--motion-gating", action="store_true")
+    p.add_argument("--bk-step", type=int, default=5)
+    p.add_argument("--bk-interval", type=int, default=1500)
+
+
+def _add_schedule_args(p, classes=True):
+    if classes:
+        p.add_argument("--classes", nargs="+", default=None)
+    p.add_argument("--time-range", nargs=2, type=int, metavar=("T0", "T1"))
+    p.add_argument("--region", nargs=4, type=int, metavar=("X1", "Y1", "X2", "Y2"))
+    p.add_argument("--speed", nargs=2, type=float, metavar=("MIN", "MAX"))
+    p.add_argument("--scheduler", choices=("greedy", "bbox", "energy"), default="bbox")
+    p.add_argument("--target-len", type=int, default=None)
+    p.add_argument("--mask-codec-iou", type=float, default=None)
+
+
+def _add_render_args(p):
+    p.add_argument("--render-size", nargs=2, type=int, metavar=("W", "H"))
+    p.add_argument("--fps", type=float, default=10)
+    p.add_argument("--codec", default="mp4v")
+    p.add_argument("--segment-len", type=int, default=None)
+    p.add_argument("--encode-workers", type=int, default=2)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="synopsisCli", description="Video synopsis, stage by stage"
+    )
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    size = dict(nargs=2, type=int, default=(640, 380), metavar=("W", "H"))
+    frames = dict(type=int, default=None, help="first frames only")
+
+    p = sub.add_parser("extract", help="detect, track and store tubes")
+    p.add_argument("video")
+    p.add_argument("--store", help="default: tube_store/<video name>")
+    p.add_argument("--size", **size)
+    p.add_argument("--max-frames", **frames)
+    _add_extract_args(p)
+    p.set_defaults(func=cmd_extract)
+
+    p = sub.add_parser("schedule", help="schedule the tubes of a store")
+    p.add_argument("store")
+    p.add_argument("--out", default="synopsis")
+    _add_schedule_args(p)
+    p.set_defaults(func=cmd_schedule)
+
+    p = sub.add_parser("render", help="render scheduled synopses")
+    p.add_argument("video")
+    p.add_argument("schedule", help="output directory of `schedule`")
+    p.add_argument("--out", default="synopsis")
+    p.add_argument("--max-frames", **frames)
+    _add_render_args(p)
+    p.set_defaults(func=cmd_render)
+
+    p = sub.add_parser("full", help="extract (if needed), schedule and render")
+    p.add_argument("video")
+    p.add_argument("--store", help="default: tube_store/<video name>")
+    p.add_argument("--out", default="synopsis")
+    p.add_argument("--force", action="store_true", help="extract again")
+    p.add_argument("--size", **size)
+    p.add_argument("--max-frames", **frames)
+    _add_extract_args(p)
+    _add_schedule_args(p, classes=False)
+    _add_render_args(p)
+    p.set_defaults(func=cmd_full)
+
+    p = sub.add_parser("live", help="rolling synopsis of a followed video")
+    p.add_argument("video")
+    p.add_argument("--out", default="live_synopsis")
+    p.add_argument("--size", **size)
+    p.add_argument("--max-frames", **frames)
+    _add_extract_args(p, cache=False)
+    p.add_argument("--window", type=int, default=9000, help="source frames shown")
+    p.add_argument("--update-every", type=int, default=250)
+    p.add_argument("--max-gap", type=int, default=30, help="frames before a track ends")
+    p.add_argument("--segment-len", type=int, default=250)
+    p.add_argument("--fps", type=float, default=10)
+    p.add_argument("--codec", default="mp4v")
+    p.set_defaults(func=cmd_live)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    t0 = time.perf_counter()
+    args.func(args)
+    print(f"[INFO] {args.cmd} done in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
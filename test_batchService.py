@@ -0,0 +1,56 @@
+import json
+import os
+import threading
+import time
+
+from batchService import BatchRunner, JobQueue
+
+
+def _queue(tmp_path, names=("a.avi",), lease=60):
+    jobs = JobQueue(str(tmp_path), lease)
+    for name in names:
+        open(os.path.join(jobs._dir("inbox"), name), "wb").close()
+    return jobs
+
+
+def test_recover_keeps_live_claims(tmp_path):
+    jobs = _queue(tmp_path)
+    path = jobs.claim()
+    assert JobQueue(str(tmp_path)).recover() == []
+    assert os.path.exists(path)
+
+
+def test_recover_requeues_dead_owner(tmp_path):
+    jobs = _queue(tmp_path)
+    path = jobs.claim()
+    with open(path + ".claim", "w") as f:
+        json.dump(dict(host=jobs.host, pid=2**22 + 12345), f)
+    assert jobs.recover() == ["a.avi"]
+    assert jobs.pending() == ["a.avi"]
+    assert not os.path.exists(path + ".claim")
+
+
+def test_recover_requeues_expired_lease(tmp_path):
+    jobs = _queue(tmp_path)
+    path = jobs.claim()
+    old = time.time() - 3600
+    os.utime(path + ".claim", (old, old))
+    assert jobs.recover() == ["a.avi"]
+
+
+def test_worker_survives_lost_claim(tmp_path):
+    jobs = _queue(tmp_path, ("a.avi", "b.avi"))
+
+    class Runner(BatchRunner):
+        def __init__(self):
+            self.records, self._active = [], set()
+            self._lock = threading.Lock()
+
+        def run_job(self, path):
+            os.remove(path)  # job taken away while running
+            return dict(job=os.path.basename(path), ok=True, latency_s=0.0)
+
+    runner = Runner()
+    runner._worker(jobs, None)
+    assert [r["job"] for r in runner.records] == ["a.avi", "b.avi"]
+    assert all("finish_error" in r for r in runner.records)
@@ -0,0 +1,39 @@
+import numpy as np
+
+from benchmarks import SYNTHETIC_CLASSES, make_synthetic_clip
+from computeBackground import MotionGate
+from detector import ColorKeyDetector, IouTracker
+from extractTube import extract_segmentation_tubes
+
+
+def test_motion_gate_skips_static_frames_only():
+    n_frames = 600
+    frames, objects = make_synthetic_clip(n_frames, 190, 320, 2, seed=4)
+    visible = np.zeros(n_frames, dtype=bool)
+    for o in objects:
+        visible[o["t0"] : min(o["t1"], n_frames)] = True
+    assert not visible.all()
+    detector = ColorKeyDetector(SYNTHETIC_CLASSES)
+    keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+    index = {id(f): t for t, f in enumerate(frames)}
+    seen = np.zeros(n_frames, dtype=bool)
+
+    class Recorder:
+        names = detector.names
+
+        def detect(self, batch):
+            seen[[index[id(f)] for f in batch]] = True
+            return detector.detect(batch)
+
+    ref, _ = extract_segmentation_tubes(
+        frames, keep, detector=detector, tracker=IouTracker()
+    )
+    gate = MotionGate()
+    out, _ = extract_segmentation_tubes(
+        frames, keep, detector=Recorder(), tracker=IouTracker(), motion_gate=gate
+    )
+    assert not (visible & ~seen).any(), "skipped frames showing objects"
+    assert gate.skip_fraction > 0.5 * (1 - visible.mean())
+    assert [len(t) for t in out] == [len(t) for t in ref]
+    for a, b in zip(ref, out):
+        assert np.array_equal(a.frames, b.frames)
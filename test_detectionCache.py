@@ -0,0 +1,22 @@
+import cv2
+import numpy as np
+
+from detectionCache import source_config
+from loadVideo import open_video_source
+
+
+def test_source_config_has_decode_size(tmp_path):
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+    for i in range(20):
+        writer.write(np.full((48, 64, 3), 10 * i, dtype=np.uint8))
+    writer.release()
+
+    configs = []
+    for W, H in ((64, 48), (128, 48)):
+        frames = open_video_source(path, None, W, H)
+        configs.append(source_config(frames))
+        frames.release()
+    assert configs[0]["width"] == 64 and configs[0]["height"] == 48
+    assert configs[1]["width"] == 128 and configs[1]["n_frames"] == 20
+    assert configs[0] != configs[1]
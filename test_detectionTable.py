@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks import _per_detection_tubes
+from detectionTable import DetectionTable, frame_rows
+from processTubes import refine_tubes_by_bbox_disp
+
+
+def _blocks(n_frames=60, n_objects=6, H=96, W=160, seed=0):
+    # tracked detections with float masks: objects drift, tracks restart
+    # every 20 frames and some detections are missing
+    rng = np.random.default_rng(seed)
+    axes = rng.integers(4, 12, (n_objects, 2))
+    pos = rng.uniform(15, [W - 15, H - 15], (n_objects, 2))
+    vel = rng.uniform(-4, 4, (n_objects, 2))
+    blocks = []
+    for t in range(n_frames):
+        keep = rng.random(n_objects) < 0.85
+        masks = np.zeros((n_objects, H, W), dtype=np.float32)
+        boxes = np.zeros((n_objects, 4), dtype=int)
+        for k in range(n_objects):
+            cx, cy = (pos[k] + t * vel[k]).astype(int) % [W, H]
+            a, b = axes[k]
+            cv2.ellipse(
+                masks[k], (int(cx), int(cy)), (int(a), int(b)), 0, 0, 360, 0.9, -1
+            )
+            boxes[k] = (cx - a, cy - b, cx + a, cy + b)
+        ids = np.arange(n_objects) + n_objects * (t // 20)
+        cls = np.arange(n_objects) % 3
+        blocks.append((ids[keep], cls[keep], boxes[keep], masks[keep]))
+    return blocks
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_columnar_tubes_match_per_detection(seed):
+    blocks = _blocks(seed=seed)
+    ref = _per_detection_tubes(blocks, min_disp=3)
+    table = DetectionTable()
+    for t, (ids, cls, boxes, masks) in enumerate(blocks):
+        table.append(*frame_rows(t, ids, cls, boxes, masks, search_boxes=boxes))
+    out = refine_tubes_by_bbox_disp(table.to_tubes(), min_disp=3)
+    assert len(out) == len(ref) > 0
+    for a, b in zip(ref, out):
+        assert a.track_id == b.track_id
+        assert np.array_equal(a.frames, b.frames)
+        assert np.array_equal(a.centroids, b.centroids)
+        assert np.array_equal(a.bboxes, b.bboxes)
+        assert np.array_equal(a.mask_boxes, b.mask_boxes)
+        assert np.array_equal(np.asarray(a._bits), np.asarray(b._bits))
@@ -0,0 +1,39 @@
+import numpy as np
+
+from main import store_and_query
+from tube import Tube
+from tubeStore import TubeStore
+
+
+def _tube(track_id, cls_id, t0, n=8):
+    boxes = np.array([[4 * i, 10, 4 * i + 8, 18] for i in range(n)])
+    return Tube.from_patches(
+        track_id,
+        np.arange(t0, t0 + n),
+        (boxes[:, :2] + boxes[:, 2:]) / 2.0,
+        boxes,
+        np.full(n, cls_id),
+        boxes,
+        [np.ones((8, 8), dtype=bool)] * n,
+    )
+
+
+def test_first_run_applies_the_query(tmp_path):
+    tubes = [_tube(1, 0, 0), _tube(2, 1, 5), _tube(3, 0, 100)]
+    path = str(tmp_path / "store")
+    query = dict(classes=["car"], time_range=(0, 50))
+    selected = store_and_query(
+        path, tubes, {0: "car", 1: "person"}, (64, 48), 10, None, query
+    )
+    assert [t.track_id for t in selected] == [1]
+    # a later run opening the store gets the same tubes
+    again = TubeStore(path).query(**query)
+    assert [t.track_id for t in again] == [1]
+    assert np.array_equal(again[0].frames, selected[0].frames)
+
+
+def test_no_query_keeps_every_tube(tmp_path):
+    tubes = [_tube(1, 0, 0), _tube(2, 1, 5)]
+    path = str(tmp_path / "store")
+    assert store_and_query(path, tubes, {0: "car", 1: "person"}, (64, 48)) is tubes
+    assert TubeStore.exists(path)
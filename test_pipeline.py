@@ -0,0 +1,48 @@
+import queue
+import threading
+
+import pytest
+
+from pipeline import _DONE, _Stage
+
+
+def _run_stage(fn=lambda item: 1, on_done=None, n_items=3):
+    """Feed n_items and _DONE to a _Stage; returns it and what it forwarded."""
+    inq, outq = queue.Queue(), queue.Queue()
+    stage = _Stage("test", fn, inq, (outq,), on_done)
+    stage.start()
+    for i in range(n_items):
+        inq.put(i)
+    inq.put(_DONE)
+    forwarded = outq.get(timeout=5)
+    threading.Thread.join(stage, timeout=5)  # without re-raising
+    return stage, forwarded
+
+
+def test_stage_forwards_done():
+    stage, forwarded = _run_stage()
+    assert forwarded is _DONE
+    assert stage.stats.items == 3
+    stage.join()
+
+
+def test_stage_error_in_fn_drains_and_forwards_done():
+    def fn(item):
+        raise ValueError("item")
+
+    stage, forwarded = _run_stage(fn)
+    assert forwarded is _DONE
+    assert not stage.is_alive()
+    with pytest.raises(ValueError):
+        stage.join()
+
+
+def test_stage_error_in_on_done_forwards_done():
+    def on_done():
+        raise RuntimeError("flush")
+
+    stage, forwarded = _run_stage(on_done=on_done)
+    assert forwarded is _DONE
+    assert not stage.is_alive()
+    with pytest.raises(RuntimeError):
+        stage.join()
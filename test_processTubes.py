@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from benchmarks import make_synthetic_tubes
+from processTubes import bbox_iou, merge_masks_by_class
+from tube import union_patches
+
+
+def _reference_merge(tubes, target_cls, source_cls, iou_thresh):
+    """The per-tube-pair merge merge_masks_by_class replaced."""
+    for P in [t for t in tubes if t.cls_id == target_cls]:
+        idxP = {int(fr): i for i, fr in enumerate(P.frames)}
+        updates = {}
+        for B in [t for t in tubes if t.cls_id == source_cls]:
+            idxB = {int(fr): i for i, fr in enumerate(B.frames)}
+            for fr in set(idxP) & set(idxB):
+                iP, iB = idxP[fr], idxB[fr]
+                boxP, boxB = P.bboxes[iP], B.bboxes[iB]
+                if bbox_iou(boxP, boxB) >= iou_thresh:
+                    if iP in updates:
+                        patchP, mboxP = updates[iP]
+                    else:
+                        patchP, mboxP = P.patch(iP), P.mask_boxes[iP]
+                    updates[iP] = union_patches(
+                        patchP, mboxP, B.patch(iB), B.mask_boxes[iB]
+                    )
+                    P.bboxes[iP] = (
+                        min(boxP[0], boxB[0]),
+                        min(boxP[1], boxB[1]),
+                        max(boxP[2], boxB[2]),
+                        max(boxP[3], boxB[3]),
+                    )
+        P.set_masks(updates)
+    return tubes
+
+
+def _scene(seed, n=40, window=150):
+    tubes = make_synthetic_tubes(n, 190, 320, 20, 60, seed=seed)
+    for t in tubes:
+        t.frames[:] = t.frames % window
+    return tubes
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_merge_matches_reference(seed):
+    ref = _reference_merge(_scene(seed), 0, 1, 0.1)
+    out = merge_masks_by_class(_scene(seed), [(0, 1)], 0.1)
+    for a, b in zip(ref, out):
+        assert np.array_equal(a.bboxes, b.bboxes)
+        assert np.array_equal(a.mask_boxes, b.mask_boxes)
+        for pa, pb in zip(a.patches(), b.patches()):
+            assert np.array_equal(pa, pb)
+    # the scene does merge masks
+    assert any(
+        not np.array_equal(a.bboxes, c.bboxes) for a, c in zip(out, _scene(seed))
+    )
@@ -0,0 +1,53 @@
+import threading
+
+import numpy as np
+
+from profiler import Profiler
+
+MB = 2**20
+
+
+def _peak_mb(prof, name):
+    return prof.stages[name].peak_mem / MB
+
+
+def test_nested_span_keeps_outer_peak():
+    prof = Profiler()
+    prof.enable(memory=True)
+    try:
+        with prof.span("outer"):
+            big = np.ones(50 * MB, dtype=np.uint8)
+            del big
+            with prof.span("inner"):
+                small = np.ones(MB, dtype=np.uint8)
+                del small
+    finally:
+        prof.disable()
+    assert _peak_mb(prof, "outer") >= 50
+    assert 1 <= _peak_mb(prof, "inner") < 10
+
+
+def test_span_in_other_thread_keeps_peak():
+    prof = Profiler()
+    prof.enable(memory=True)
+    allocated, nested = threading.Event(), threading.Event()
+
+    def worker():
+        with prof.span("worker"):
+            big = np.ones(30 * MB, dtype=np.uint8)
+            del big
+            allocated.set()
+            nested.wait(5)
+
+    try:
+        t = threading.Thread(target=worker)
+        t.start()
+        allocated.wait(5)
+        with prof.span("main"):  # resets the process-wide peak
+            pass
+        nested.set()
+        t.join()
+    finally:
+        prof.disable()
+    assert _peak_mb(prof, "worker") >= 30
+    assert _peak_mb(prof, "main") < 10
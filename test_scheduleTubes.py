@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from benchmarks import make_synthetic_tubes
+from scheduleTubes import (
+    CollisionTable,
+    OccupancyVolume,
+    schedule_tubes,
+    schedule_tubes_bbox,
+    schedule_tubes_dynamic,
+)
+from tube import Tube
+
+
+def _collision_area(tubes, shifts):
+    table = CollisionTable(tubes)
+    return sum(
+        table.area(i, int(j), shifts[j] - shifts[i])
+        for i in range(len(tubes))
+        for j in table.neighbors[i]
+        if i < j
+    )
+
+
+def test_energy_default_no_worse_than_greedy():
+    H, W = 190, 320
+    tubes = make_synthetic_tubes(30, H, W, 20, 60, seed=3)
+    _, greedy_len = schedule_tubes(tubes, H, W, "bbox")
+    shifts, syn_len = schedule_tubes(tubes, H, W, "energy", n_iters=3000)
+    area = _collision_area(tubes, shifts)
+    # default weights: w_collision=1, w_length=10
+    assert area + 10 * syn_len <= 10 * greedy_len
+    assert syn_len <= greedy_len
+    if syn_len == greedy_len:
+        assert area == 0
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("cell", [4, 8, 16])
+def test_bbox_schedule_equals_greedy(seed, cell):
+    H, W = 96, 160
+    tubes = make_synthetic_tubes(15, H, W, 10, 40, seed=seed)
+    assert schedule_tubes_bbox(tubes, H, W, cell) == schedule_tubes_dynamic(tubes, H, W)
+
+
+def _pixel_tube(x, y):
+    box = np.array([[x, y, x + 1, y + 1]])
+    return Tube.from_patches(
+        0,
+        np.zeros(1),
+        np.zeros((1, 2)),
+        box,
+        np.zeros(1),
+        box,
+        [np.ones((1, 1), dtype=bool)],
+    )
+
+
+def test_full_cell_counts_every_mask():
+    # 256 one-pixel masks fill a 16 x 16 cell: a uint8 count would wrap to 0
+    occ = OccupancyVolume(16, 16, cell=16)
+    for y in range(16):
+        for x in range(16):
+            occ._reserve(1)
+            occ.add(0, occ.footprint(_pixel_tube(x, y)), 1)
+    assert int(occ.grid[0, 0]) == 256
+    assert occ.first_fit(occ.footprint(_pixel_tube(3, 5)), 1) is None
+
+
+def test_cell_out_of_range():
+    with pytest.raises(ValueError):
+        OccupancyVolume(16, 16, cell=256)
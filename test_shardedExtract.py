@@ -0,0 +1,29 @@
+import functools
+
+import cv2
+
+from benchmarks import SYNTHETIC_CLASSES, make_synthetic_clip
+from detector import ColorKeyDetector, IouTracker
+from shardedExtract import extract_tubes_sharded
+
+
+def test_motion_gating_keeps_sharded_tubes(tmp_path):
+    path = str(tmp_path / "clip.avi")
+    frames, _ = make_synthetic_clip(600, 190, 320, 3, seed=4)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (320, 190))
+    for f in frames:
+        writer.write(f)
+    writer.release()
+    kwargs = dict(
+        shard_len=200,
+        n_workers=1,
+        width=320,
+        height=190,
+        detector_factory=functools.partial(ColorKeyDetector, SYNTHETIC_CLASSES, 60),
+        tracker_factory=IouTracker,
+    )
+    keep = [name for name, _ in SYNTHETIC_CLASSES.values()]
+    ref, _ = extract_tubes_sharded(path, keep, **kwargs)
+    out, _ = extract_tubes_sharded(path, keep, motion_gating=True, **kwargs)
+    # an object crosses the start of the last shard (frame 400)
+    assert [t.frames.tolist() for t in out] == [t.frames.tolist() for t in ref]
@@ -0,0 +1,11 @@
+import pytest
+
+from benchmarks import LIGHT_COMMANDS, STARTUP_BUDGET_S, probe_startup
+
+
+@pytest.mark.parametrize("cmd", list(STARTUP_BUDGET_S))
+def test_startup_within_budget(cmd):
+    r = probe_startup(cmd, repeats=3)
+    if cmd in LIGHT_COMMANDS:
+        assert not r["heavy"], f"{cmd} imports {', '.join(r['heavy'])}"
+    assert r["wall_s"] <= r["budget_s"], f"{cmd}: {r['wall_s']:.2f}s"
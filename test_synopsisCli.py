@@ -0,0 +1,50 @@
+import glob
+import os
+
+import cv2
+import numpy as np
+
+import synopsisCli
+from computeBackground import compute_background_timeline
+from loadVideo import open_video_source
+from tube import Tube
+from tubeStore import TubeStore
+
+
+def _clip(path, n=20, W=64, H=48):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (W, H))
+    for i in range(n):
+        writer.write(np.full((H, W, 3), 100, dtype=np.uint8))
+    writer.release()
+
+
+def test_render_size_resizes_stored_background(tmp_path):
+    video = str(tmp_path / "clip.avi")
+    _clip(video)
+    frames = open_video_source(video, None, 64, 48)
+    background = compute_background_timeline(frames, step=5, interval=10)
+    frames.release()
+    n = 6
+    boxes = np.array([[5 * i, 10, 5 * i + 10, 20] for i in range(n)])
+    tube = Tube.from_patches(
+        1,
+        np.arange(n),
+        (boxes[:, :2] + boxes[:, 2:]) / 2.0,
+        boxes,
+        np.zeros(n, dtype=np.int64),
+        boxes,
+        [np.ones((10, 10), dtype=bool)] * n,
+    )
+    store = str(tmp_path / "store")
+    TubeStore.create(store, [tube], {0: "car"}, (64, 48), 10, background)
+
+    schedule = str(tmp_path / "schedule")
+    synopsisCli.main(["schedule", store, "--out", schedule])
+    out = str(tmp_path / "render")
+    synopsisCli.main(
+        ["render", video, schedule, "--out", out, "--codec", "png"]
+        + ["--render-size", "128", "96"]
+    )
+    images = glob.glob(os.path.join(out, "**", "*.png"), recursive=True)
+    assert images
+    assert {cv2.imread(p).shape for p in images} == {(96, 128, 3)}
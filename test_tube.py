@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from tube import Tube, take_ragged
+
+
+def _records(n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(0, 30, n)
+    offsets = np.r_[0, np.cumsum(sizes)].astype(np.int64)
+    bits = rng.integers(0, 256, offsets[-1], dtype=np.uint8)
+    return rng, bits, offsets
+
+
+@pytest.mark.parametrize("chunk", [1, 16, 2**22])
+@pytest.mark.parametrize("order", ["subset", "interleaved", "empty"])
+def test_take_ragged_matches_per_record_slices(chunk, order):
+    rng, bits, offsets = _records()
+    n = len(offsets) - 1
+    if order == "subset":
+        idx = np.flatnonzero(rng.random(n) < 0.7)
+    elif order == "interleaved":
+        idx = np.argsort(rng.integers(0, 4, n), kind="stable")
+    else:
+        idx = np.zeros(0, dtype=np.int64)
+    new_offsets, out = take_ragged(bits, offsets, idx, chunk)
+    parts = [bits[offsets[i] : offsets[i + 1]] for i in idx]
+    assert np.array_equal(new_offsets, np.r_[0, np.cumsum([len(p) for p in parts])])
+    assert np.array_equal(out, np.concatenate(parts) if parts else bits[:0])
+
+
+def test_tube_take_keeps_patches():
+    rng = np.random.default_rng(1)
+    n = 12
+    boxes = np.stack([np.r_[0, 0, rng.integers(1, 9, 2)] for _ in range(n)])
+    patches = [rng.random((y2, x2)) < 0.5 for _, _, x2, y2 in boxes]
+    tube = Tube.from_patches(
+        7,
+        np.arange(n),
+        np.zeros((n, 2)),
+        boxes,
+        np.zeros(n, dtype=np.int64),
+        boxes,
+        patches,
+    )
+    idx = [0, 3, 4, 5, 11]
+    kept = tube.take(idx)
+    assert np.array_equal(kept.frames, idx)
+    for i, patch in zip(idx, kept.patches()):
+        assert np.array_equal(patch, patches[i])
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+
+from videoOutput import open_writer, segmented_frames_done
+
+FRAME = np.zeros((16, 16, 3), dtype=np.uint8)
+
+
+def _write(path, n, key, crash=False):
+    writer = open_writer(path, 16, 16, 10, "png", segment_len=4, resume=key)
+    for _ in range(n):
+        writer.write(FRAME)
+    if not crash:
+        writer.close()
+    return writer
+
+
+def test_resume_same_key(tmp_path):
+    path = str(tmp_path / "out")
+    _write(path, 10, "run-a", crash=True)
+    assert segmented_frames_done(path, "run-a") == 8
+    writer = _write(path, 2, "run-a")
+    assert [n for _, n in writer.segments] == [4, 4, 2]
+
+
+def test_other_key_starts_fresh(tmp_path):
+    path = str(tmp_path / "out")
+    _write(path, 10, "run-a", crash=True)
+    assert segmented_frames_done(path, "run-b") == 0
+    assert segmented_frames_done(path, None) == 0
+    writer = _write(path, 5, "run-b")
+    assert [n for _, n in writer.segments] == [4, 1]
+    # the third segment of the old run is gone
+    assert len([n for n in os.listdir(path) if n.startswith("seg_")]) == 2
+
+
+def test_finished_run_starts_fresh(tmp_path):
+    path = str(tmp_path / "out")
+    _write(path, 10, "run-a")
+    assert segmented_frames_done(path, "run-a") == 0
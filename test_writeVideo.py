@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from tube import Tube
+from writeVideo import SpriteCache, iter_multi_synopsis_frames
+
+
+def _tubes(n_tubes=6, L=12, H=60, W=80, seed=0):
+    rng = np.random.default_rng(seed)
+    tubes = []
+    for k in range(n_tubes):
+        x, y = rng.integers(0, W - 12), rng.integers(0, H - 12)
+        boxes = [(x + j // 3, y, x + j // 3 + 10, y + 8) for j in range(L)]
+        patches = [rng.random((8, 10)) < 0.7 for _ in range(L)]
+        t0 = int(rng.integers(0, 20))
+        tubes.append(
+            Tube.from_patches(
+                k,
+                np.arange(t0, t0 + L),
+                [(0, 0)] * L,
+                boxes,
+                [k % 2] * L,
+                boxes,
+                patches,
+            )
+        )
+    return tubes
+
+
+@pytest.mark.parametrize("feather", [False, True])
+def test_streaming_fallback_matches_sprite_cache(feather, capsys):
+    rng = np.random.default_rng(1)
+    frames = [rng.integers(0, 255, (60, 80, 3), dtype=np.uint8) for _ in range(40)]
+    background = np.full((60, 80, 3), 90, dtype=np.uint8)
+    tubes = _tubes()
+    outputs = [(tubes, [0, 3, 5, 1, 8, 2], 20), (tubes[:3], [0, 0, 4], 16)]
+    need = SpriteCache.estimate_bytes(tubes, 60, 80, feather=feather)
+    cached = list(
+        iter_multi_synopsis_frames(frames, outputs, background, feather=feather)
+    )
+    streamed = list(
+        iter_multi_synopsis_frames(
+            frames, outputs, background, feather=feather, max_sprite_bytes=need - 1
+        )
+    )
+    assert "compositing from the source" in capsys.readouterr().out
+    assert [o for o, _ in cached] == [o for o, _ in streamed]
+    assert all(np.array_equal(a, b) for (_, a), (_, b) in zip(cached, streamed))
@@ -0,0 +1,353 @@
+import cv2
+import numpy as np
+
+
+def crop_mask(mask):
+    """
+    Crop a full-frame bool mask to its tight bounding box.
+
+    Returns:
+      (patch, box) : (h, w) bool patch and its (x1, y1, x2, y2) box in frame
+                     coordinates (x2/y2 exclusive), or (None, None) if empty
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return None, None
+    cols = np.flatnonzero(mask.any(axis=0))
+    y1, y2 = int(rows[0]), int(rows[-1]) + 1
+    x1, x2 = int(cols[0]), int(cols[-1]) + 1
+    return mask[y1:y2, x1:x2], (x1, y1, x2, y2)
+
+
+def union_patches(patch_a, box_a, patch_b, box_b):
+    """OR two bbox-cropped patches into one patch covering both boxes."""
+    x1 = min(box_a[0], box_b[0])
+    y1 = min(box_a[1], box_b[1])
+    x2 = max(box_a[2], box_b[2])
+    y2 = max(box_a[3], box_b[3])
+    out = np.zeros((y2 - y1, x2 - x1), dtype=bool)
+    for patch, (bx1, by1, bx2, by2) in ((patch_a, box_a), (patch_b, box_b)):
+        out[by1 - y1 : by2 - y1, bx1 - x1 : bx2 - x1] |= patch
+    return out, (x1, y1, x2, y2)
+
+
+def scale_patch(patch, box, sx, sy, W, H):
+    """
+    Upsample a mask patch and its box by (sx, sy) into a W x H frame: the
+    box is scaled outwards and the patch resized bilinearly into it and
+    thresholded at one half, so edges stay smooth instead of blocky.
+
+    Returns:
+      (patch, box) : (h, w) bool patch and its (x1, y1, x2, y2) box
+    """
+    x1, y1, x2, y2 = box
+    X1, Y1 = int(x1 * sx), int(y1 * sy)
+    X2, Y2 = min(int(np.ceil(x2 * sx)), W), min(int(np.ceil(y2 * sy)), H)
+    up = cv2.resize(
+        patch.view(np.uint8) * np.uint8(255),
+        (X2 - X1, Y2 - Y1),
+        interpolation=cv2.INTER_LINEAR,
+    )
+    return up >= 128, (X1, Y1, X2, Y2)
+
+
+def _pack(patches):
+    chunks = [np.packbits(p, axis=None) for p in patches]
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    if chunks:
+        offsets[1:] = np.cumsum([len(c) for c in chunks])
+        bits = np.concatenate(chunks)
+    else:
+        bits = np.zeros(0, dtype=np.uint8)
+    return bits, offsets
+
+
+def take_ragged(bits, offsets, idx, chunk=2**22):
+    """
+    Gather the variable-length records `idx` of a byte buffer indexed by
+    `offsets`, in that order. Records adjacent in the buffer are copied as
+    runs, and the byte index is built at most `chunk` bytes at a time (in
+    int32 when the buffer allows), so the gather needs no index as large
+    as its output.
+
+    Returns:
+      new_offsets, gathered bytes
+    """
+    bits, offsets = np.asarray(bits), np.asarray(offsets)
+    idx = np.asarray(idx, dtype=np.int64)
+    starts = offsets[idx]
+    sizes = offsets[idx + 1] - starts
+    new_offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(sizes)
+    out = np.empty(int(new_offsets[-1]), dtype=bits.dtype)
+    if len(idx) == 0:
+        return new_offsets, out
+    # runs of records that follow each other in the buffer
+    cut = np.flatnonzero(starts[1:] != starts[:-1] + sizes[:-1]) + 1
+    src = starts[np.r_[0, cut]]
+    dst = new_offsets[np.r_[0, cut]]
+    end = new_offsets[np.r_[cut, len(idx)]]
+    itype = np.int32 if len(bits) < 2**31 else np.int64
+    a = 0
+    while a < len(src):
+        # runs [a, b) fill at most `chunk` output bytes, or are one run
+        b = max(int(np.searchsorted(end, dst[a] + chunk, side="right")), a + 1)
+        d0, d1 = int(dst[a]), int(end[b - 1])
+        if b == a + 1:
+            out[d0:d1] = bits[src[a] : src[a] + d1 - d0]
+        else:
+            ix = np.arange(d1 - d0, dtype=itype)
+            ix += np.repeat(
+                (src[a:b] - dst[a:b] + d0).astype(itype), end[a:b] - dst[a:b]
+            )
+            np.take(bits, ix, out=out[d0:d1])
+        a = b
+    return new_offsets, out
+
+
+class Tube:
+    """
+    Array-backed record of one tracked object.
+
+    Per-detection data lives in contiguous arrays:
+      frames     : (N,)   int32 source frame indices
+      centroids  : (N, 2) int32 mask centroids (cx, cy)
+      bboxes     : (N, 4) int32 detector boxes (x1, y1, x2, y2)
+      cls_ids    : (N,)   int32 class id per detection
+      mask_boxes : (N, 4) int32 tight mask boxes, x2/y2 exclusive
+
+    Masks are stored as bit-packed patches cropped to `mask_boxes`, all in
+    one uint8 buffer, and are only unpacked on demand via `patch(i)` or
+    `mask(i, H, W)`.
+    """
+
+    __slots__ = (
+        "track_id",
+        "frames",
+        "centroids",
+        "bboxes",
+        "cls_ids",
+        "mask_boxes",
+        "_bits",
+        "_offsets",
+    )
+
+    def __init__(
+        self, track_id, frames, centroids, bboxes, cls_ids, mask_boxes, bits, offsets
+    ):
+        self.track_id = track_id
+        self.frames = np.asarray(frames, dtype=np.int32)
+        self.centroids = np.asarray(centroids, dtype=np.int32).reshape(-1, 2)
+        self.bboxes = np.asarray(bboxes, dtype=np.int32).reshape(-1, 4)
+        self.cls_ids = np.asarray(cls_ids, dtype=np.int32)
+        self.mask_boxes = np.asarray(mask_boxes, dtype=np.int32).reshape(-1, 4)
+        self._bits = bits
+        self._offsets = offsets
+
+    @classmethod
+    def from_patches(
+        cls, track_id, frames, centroids, bboxes, cls_ids, mask_boxes, patches
+    ):
+        bits, offsets = _pack(patches)
+        return cls(
+            track_id, frames, centroids, bboxes, cls_ids, mask_boxes, bits, offsets
+        )
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __repr__(self):
+        return (
+            f"Tube(track_id={self.track_id}, cls={self.cls_id}, len={len(self)}, "
+            f"frames={self.frames[0] if len(self) else None}..."
+            f"{self.frames[-1] if len(self) else None})"
+        )
+
+    @property
+    def cls_id(self):
+        return int(self.cls_ids[0])
+
+    @property
+    def nbytes(self):
+        return sum(
+            a.nbytes
+            for a in (
+                self.frames,
+                self.centroids,
+                self.bboxes,
+                self.cls_ids,
+                self.mask_boxes,
+                self._bits,
+                self._offsets,
+            )
+        )
+
+    def patch(self, i):
+        """Decode the (h, w) bool mask patch of detection i."""
+        x1, y1, x2, y2 = self.mask_boxes[i]
+        h, w = int(y2 - y1), int(x2 - x1)
+        raw = self._bits[self._offsets[i] : self._offsets[i + 1]]
+        return np.unpackbits(raw, count=h * w).reshape(h, w).view(bool)
+
+    def patches(self):
+        """Decode all patches in order, unpacking the bit buffer once."""
+        flat = np.unpackbits(self._bits).view(bool)
+        starts = self._offsets[:-1] * 8
+        hs = self.mask_boxes[:, 3] - self.mask_boxes[:, 1]
+        ws = self.mask_boxes[:, 2] - self.mask_boxes[:, 0]
+        for i in range(len(self)):
+            h, w = int(hs[i]), int(ws[i])
+            yield flat[starts[i] : starts[i] + h * w].reshape(h, w)
+
+    def mask_ids(self):
+        """
+        (N,) id per detection; detections with the same id have identical
+        patches, so work done on one patch can be reused for the others
+        (every mask is distinct here; see maskCodec.KeyframeTube).
+        """
+        return np.arange(len(self))
+
+    def expanded(self):
+        """This tube with one stored patch per detection (itself here)."""
+        return self
+
+    def mask(self, i, H, W):
+        """Decode detection i as a full-frame (H, W) bool mask."""
+        out = np.zeros((H, W), dtype=bool)
+        x1, y1, x2, y2 = self.mask_boxes[i]
+        out[y1:y2, x1:x2] = self.patch(i)
+        return out
+
+    def take(self, idx):
+        """New Tube holding only the detections at positions `idx`."""
+        idx = np.asarray(idx, dtype=np.int64)
+        offsets, bits = take_ragged(self._bits, self._offsets, idx)
+        return Tube(
+            self.track_id,
+            self.frames[idx],
+            self.centroids[idx],
+            self.bboxes[idx],
+            self.cls_ids[idx],
+            self.mask_boxes[idx],
+            bits,
+            offsets,
+        )
+
+    def scaled(self, sx, sy, W, H):
+        """
+        New Tube in a W x H frame, (sx, sy) times the size of this one's:
+        boxes and centroids are scaled and every mask patch is upsampled
+        inside its box (see scale_patch).
+        """
+        scale = np.array([sx, sy, sx, sy])
+        patches, boxes = [], []
+        for patch, box in zip(self.patches(), self.mask_boxes.tolist()):
+            patch, box = scale_patch(patch, box, sx, sy, W, H)
+            patches.append(patch)
+            boxes.append(box)
+        return Tube.from_patches(
+            self.track_id,
+            self.frames,
+            np.rint(self.centroids * [sx, sy]),
+            np.minimum(np.rint(self.bboxes * scale), [W, H, W, H]),
+            self.cls_ids,
+            np.array(boxes, dtype=np.int32).reshape(-1, 4),
+            patches,
+        )
+
+    def set_masks(self, updates):
+        """
+        Replace some masks in place.
+
+        Args:
+          updates : dict i -> (patch, mask_box)
+        """
+        if not updates:
+            return
+        patches = [
+            updates[i][0] if i in updates else self.patch(i) for i in range(len(self))
+        ]
+        for i, (_, box) in updates.items():
+            self.mask_boxes[i] = box
+        self._bits, self._offsets = _pack(patches)
+
+
+def concat_tubes(parts, track_id=None):
+    """
+    Join tubes of the same object, in order, into one Tube (e.g. pieces of
+    a track split over several shards).
+    """
+    parts = [p.expanded() for p in parts]
+    bits = [p._bits for p in parts]
+    sizes = np.concatenate([np.diff(p._offsets) for p in parts])
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)
+    return Tube(
+        parts[0].track_id if track_id is None else track_id,
+        np.concatenate([p.frames for p in parts]),
+        np.concatenate([p.centroids for p in parts]),
+        np.concatenate([p.bboxes for p in parts]),
+        np.concatenate([p.cls_ids for p in parts]),
+        np.concatenate([p.mask_boxes for p in parts]),
+        np.concatenate(bits) if bits else np.zeros(0, dtype=np.uint8),
+        offsets,
+    )
+
+
+class TubeBuilder:
+    """Append-only accumulator used while tracking; `build()` freezes it."""
+
+    __slots__ = (
+        "track_id",
+        "frames",
+        "centroids",
+        "bboxes",
+        "cls_ids",
+        "mask_boxes",
+        "patches",
+    )
+
+    def __init__(self, track_id=None):
+        self.track_id = track_id
+        self.frames = []
+        self.centroids = []
+        self.bboxes = []
+        self.cls_ids = []
+        self.mask_boxes = []
+        self.patches = []
+
+    def __len__(self):
+        return len(self.frames)
+
+    def append(self, frame, patch, mask_box, centroid, bbox, cls_id):
+        self.append_packed(
+            frame, np.packbits(patch, axis=None), mask_box, centroid, bbox, cls_id
+        )
+
+    def append_packed(self, frame, bits, mask_box, centroid, bbox, cls_id):
+        """Like `append`, with the patch already packed by np.packbits."""
+        self.frames.append(frame)
+        self.patches.append(bits)
+        self.mask_boxes.append(mask_box)
+        self.centroids.append(centroid)
+        self.bboxes.append(bbox)
+        self.cls_ids.append(cls_id)
+
+    def build(self):
+        offsets = np.zeros(len(self.patches) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in self.patches])
+        bits = (
+            np.concatenate(self.patches)
+            if self.patches
+            else np.zeros(0, dtype=np.uint8)
+        )
+        return Tube(
+            self.track_id,
+            self.frames,
+            self.centroids,
+            self.bboxes,
+            self.cls_ids,
+            self.mask_boxes,
+            bits,
+            offsets,
+        )
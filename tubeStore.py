@@ -0,0 +1,299 @@
+import json
+import os
+
+import numpy as np
+
+from checkpoint import load_background, save_background
+from tube import Tube
+
+# per-detection columns, one .npy file each, memory-mapped on open
+_COLUMNS = {
+    "frames": (np.int32, None),
+    "centroids": (np.int32, 2),
+    "bboxes": (np.int32, 4),
+    "cls_ids": (np.int32, None),
+    "mask_boxes": (np.int32, 4),
+}
+
+
+def _mean_speed(tube):
+    """Mean centroid speed of a tube in px per source frame."""
+    if len(tube) < 2:
+        return 0.0
+    dist = np.linalg.norm(np.diff(tube.centroids, axis=0), axis=1).sum()
+    return float(dist / max(int(tube.frames[-1] - tube.frames[0]), 1))
+
+
+def _save_npy(path, a):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, a)
+    os.replace(tmp, path)
+
+
+class TubeStore:
+    """
+    Extracted tubes on disk, indexed for queries like "cars in the left
+    lane between frames 90000 and 180000", so filtered synopses are
+    scheduled and rendered without another detection pass.
+
+    Layout of the store directory:
+      manifest.json : names, frame size, fps, number of tubes
+      tubes.npz     : per-tube metadata: track id, class, time span
+                      [t_start, t_end], bbox envelope, mean speed and the
+                      tube's rows in the detection columns
+      <column>.npy  : per-detection columns of all tubes (see tube.Tube),
+                      masks as one packed bit buffer (bits.npy) with
+                      per-detection offsets; memory-mapped, so a query
+                      only reads the detections of the tubes it returns
+      background.npz: optional BackgroundTimeline of the run
+
+    Indexes, built on open from the metadata:
+      interval : tubes sorted by t_start with the running max of t_end,
+                 so a time window scans only the tubes that start before
+                 its end, and stops where no earlier tube reaches it
+      grid     : `cell` px cells -> tubes whose envelope covers them
+    """
+
+    def __init__(self, path, cell=32):
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.names = {int(k): v for k, v in self.manifest["names"].items()}
+        self.W, self.H = self.manifest["size"]
+        self.fps = self.manifest["fps"]
+        with np.load(os.path.join(path, "tubes.npz")) as z:
+            self.meta = {k: z[k] for k in z.files}
+        cols = {k: self._column(k) for k in list(_COLUMNS) + ["offsets", "bits"]}
+        self.columns = cols
+        self._build_interval_index()
+        self._build_grid(cell)
+
+    @classmethod
+    def create(cls, path, tubes, names, size, fps=None, background=None):
+        """
+        Write `tubes` (tube.Tube records) as a new store and open it.
+
+        Args:
+          names      : class id -> name map of the detector
+          size       : (W, H) of the frames the tubes were extracted on
+          fps        : source frame rate, to convert times given in seconds
+          background : computeBackground.BackgroundTimeline to keep with
+                       the tubes, so a query can be rendered at once
+        """
+        tubes = [t.expanded() for t in tubes]  # see maskCodec
+        os.makedirs(path, exist_ok=True)
+        if cls.exists(path):
+            os.remove(os.path.join(path, "manifest.json"))
+        lengths = np.array([len(t) for t in tubes], dtype=np.int64)
+        starts = np.zeros(len(tubes) + 1, dtype=np.int64)
+        starts[1:] = np.cumsum(lengths)
+        for name, (dtype, width) in _COLUMNS.items():
+            parts = [getattr(t, name) for t in tubes]
+            shape = (0,) if width is None else (0, width)
+            a = np.concatenate(parts) if parts else np.zeros(shape, dtype=dtype)
+            _save_npy(os.path.join(path, name + ".npy"), a.astype(dtype))
+        sizes = [np.diff(t._offsets) for t in tubes]
+        offsets = np.zeros(int(starts[-1]) + 1, dtype=np.int64)
+        if sizes:
+            offsets[1:] = np.cumsum(np.concatenate(sizes))
+        _save_npy(os.path.join(path, "offsets.npy"), offsets)
+        bits = [np.asarray(t._bits) for t in tubes]
+        _save_npy(
+            os.path.join(path, "bits.npy"),
+            np.concatenate(bits) if bits else np.zeros(0, dtype=np.uint8),
+        )
+        envelopes = np.array(
+            [
+                [*t.bboxes[:, :2].min(axis=0), *t.bboxes[:, 2:].max(axis=0)]
+                for t in tubes
+            ],
+            dtype=np.int32,
+        ).reshape(-1, 4)
+        np.savez(
+            os.path.join(path, "tubes.npz"),
+            track_ids=np.array([t.track_id for t in tubes], dtype=np.int64),
+            cls_ids=np.array([t.cls_id for t in tubes], dtype=np.int32),
+            t_start=np.array([t.frames[0] for t in tubes], dtype=np.int64),
+            t_end=np.array([t.frames[-1] for t in tubes], dtype=np.int64),
+            envelopes=envelopes,
+            speeds=np.array([_mean_speed(t) for t in tubes], dtype=np.float64),
+            starts=starts,
+        )
+        if background is not None:
+            save_background(os.path.join(path, "background.npz"), background)
+        manifest = dict(
+            names={str(k): v for k, v in names.items()},
+            size=[int(v) for v in size],
+            fps=fps,
+            n_tubes=len(tubes),
+            n_detections=int(starts[-1]),
+        )
+        # written last: a store without a manifest is incomplete
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=1)
+        print(f"[INFO] stored {len(tubes)} tubes in {path}")
+        return cls(path)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "manifest.json"))
+
+    def _column(self, name):
+        # plain ndarray view of the map: slicing an np.memmap is slower
+        return np.asarray(
+            np.load(os.path.join(self.path, name + ".npy"), mmap_mode="r")
+        )
+
+    def _build_interval_index(self):
+        self.by_start = np.argsort(self.meta["t_start"], kind="stable")
+        self.sorted_starts = self.meta["t_start"][self.by_start]
+        # running max of t_end, to stop at the first tube reaching t0
+        self.max_end = np.maximum.accumulate(self.meta["t_end"][self.by_start])
+
+    def _build_grid(self, cell):
+        self.cell = cell
+        gw, gh = -(-self.W // cell), -(-self.H // cell)
+        self.grid_shape = (gh, gw)
+        env = self.meta["envelopes"]
+        cx1 = np.clip(env[:, 0] // cell, 0, gw - 1)
+        cy1 = np.clip(env[:, 1] // cell, 0, gh - 1)
+        cx2 = np.clip((env[:, 2] - 1) // cell, 0, gw - 1)
+        cy2 = np.clip((env[:, 3] - 1) // cell, 0, gh - 1)
+        cells, ids = [], []
+        for k in range(len(env)):
+            ys, xs = np.mgrid[cy1[k] : cy2[k] + 1, cx1[k] : cx2[k] + 1]
+            cells.append((ys * gw + xs).ravel())
+            ids.append(np.full(ys.size, k, dtype=np.int64))
+        cells = np.concatenate(cells) if cells else np.zeros(0, dtype=np.int64)
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+        # CSR: tubes of cell c are grid_ids[grid_ptr[c]:grid_ptr[c + 1]]
+        order = np.argsort(cells, kind="stable")
+        self.grid_ids = ids[order]
+        self.grid_ptr = np.searchsorted(cells[order], np.arange(gh * gw + 1))
+
+    def __len__(self):
+        return len(self.meta["track_ids"])
+
+    def during(self, t0, t1):
+        """Ids of tubes whose time span meets [t0, t1] (interval index)."""
+        hi = np.searchsorted(self.sorted_starts, t1, side="right")
+        lo = np.searchsorted(self.max_end[:hi], t0, side="left")
+        cand = self.by_start[lo:hi]
+        return np.sort(cand[self.meta["t_end"][cand] >= t0])
+
+    def within(self, region):
+        """Ids of tubes whose bbox envelope meets region (grid index)."""
+        x1, y1, x2, y2 = region
+        gh, gw = self.grid_shape
+        c = self.cell
+        cx = np.arange(max(x1 // c, 0), min((x2 - 1) // c, gw - 1) + 1)
+        cy = np.arange(max(y1 // c, 0), min((y2 - 1) // c, gh - 1) + 1)
+        cells = (cy[:, None] * gw + cx[None, :]).ravel()
+        cand = np.unique(
+            np.concatenate(
+                [self.grid_ids[self.grid_ptr[k] : self.grid_ptr[k + 1]] for k in cells]
+                + [np.zeros(0, dtype=np.int64)]
+            )
+        )
+        env = self.meta["envelopes"][cand]
+        hit = (env[:, 0] < x2) & (env[:, 2] > x1) & (env[:, 1] < y2) & (env[:, 3] > y1)
+        return cand[hit]
+
+    def select(self, classes=None, time_range=None, region=None, speed=None):
+        """
+        Ids of the tubes matching every given filter, from the metadata and
+        indexes only (no detection is read).
+
+        Args:
+          classes    : class names (or ids) to keep
+          time_range : (t0, t1) source frames, inclusive
+          region     : (x1, y1, x2, y2) the bbox envelope must meet
+          speed      : (min, max) mean speed in px per frame, None = open
+        """
+        ids = np.arange(len(self))
+        if time_range is not None:
+            ids = self.during(*time_range)
+        if region is not None:
+            ids = np.intersect1d(ids, self.within(region))
+        if classes is not None:
+            by_name = {v: k for k, v in self.names.items()}
+            cids = [by_name.get(c, c) for c in classes]
+            ids = ids[np.isin(self.meta["cls_ids"][ids], cids)]
+        if speed is not None:
+            lo, hi = speed
+            s = self.meta["speeds"][ids]
+            keep = np.ones(len(ids), dtype=bool)
+            if lo is not None:
+                keep &= s >= lo
+            if hi is not None:
+                keep &= s <= hi
+            ids = ids[keep]
+        return ids
+
+    def tube(self, k):
+        """Tube k, its columns and masks still memory-mapped."""
+        a, b = (int(v) for v in self.meta["starts"][k : k + 2])
+        cols = self.columns
+        offsets = np.asarray(cols["offsets"][a : b + 1])
+        return Tube(
+            int(self.meta["track_ids"][k]),
+            cols["frames"][a:b],
+            cols["centroids"][a:b],
+            cols["bboxes"][a:b],
+            cols["cls_ids"][a:b],
+            cols["mask_boxes"][a:b],
+            cols["bits"][offsets[0] : offsets[-1]],
+            offsets - offsets[0],
+        )
+
+    def query(
+        self,
+        classes=None,
+        time_range=None,
+        region=None,
+        speed=None,
+        clip=True,
+        min_len=1,
+    ):
+        """
+        Tubes matching the filters (see select), ready for
+        scheduleTubes.schedule_tubes and the renderers.
+
+        With `clip`, every tube is cut down to its detections inside
+        time_range whose box centre lies in region, and tubes left with
+        fewer than min_len detections are dropped; otherwise whole tubes
+        are returned.
+        """
+        out = []
+        for k in self.select(classes, time_range, region, speed).tolist():
+            tube = self.tube(k)
+            if clip and (time_range is not None or region is not None):
+                keep = np.ones(len(tube), dtype=bool)
+                if time_range is not None:
+                    keep &= (tube.frames >= time_range[0]) & (
+                        tube.frames <= time_range[1]
+                    )
+                if region is not None:
+                    x1, y1, x2, y2 = region
+                    cx = (tube.bboxes[:, 0] + tube.bboxes[:, 2]) / 2
+                    cy = (tube.bboxes[:, 1] + tube.bboxes[:, 3]) / 2
+                    keep &= (cx >= x1) & (cx < x2) & (cy >= y1) & (cy < y2)
+                if keep.sum() < min_len:
+                    continue
+                if not keep.all():
+                    tube = tube.take(np.flatnonzero(keep))
+            out.append(tube)
+        print(f"[INFO] query matched {len(out)} of {len(self)} tubes")
+        return out
+
+    def seconds_to_frames(self, t0, t1):
+        """(t0, t1) in seconds from the start of the video as a time_range."""
+        if not self.fps:
+            raise ValueError("store has no fps; give time_range in frames")
+        return int(t0 * self.fps), int(np.ceil(t1 * self.fps))
+
+    def background(self):
+        """The stored BackgroundTimeline, or None."""
+        path = os.path.join(self.path, "background.npz")
+        return load_background(path) if os.path.exists(path) else None
@@ -0,0 +1,394 @@
+import json
+import math
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from profiler import PROFILER
+
+# codec name -> how to encode it
+#   cv2    : cv2.VideoWriter with a fourcc
+#   ffmpeg : raw BGR frames piped to an ffmpeg process (output args)
+#   images : one image file per frame in a directory
+CODECS = {
+    "mp4v": dict(backend="cv2", fourcc="mp4v", ext=".mp4"),
+    "mjpg": dict(backend="cv2", fourcc="MJPG", ext=".avi"),  # intra-only
+    "xvid": dict(backend="cv2", fourcc="XVID", ext=".avi"),
+    "vp8": dict(backend="cv2", fourcc="VP80", ext=".webm"),  # small, slow
+    "x264": dict(
+        backend="ffmpeg",
+        args=["-c:v", "libx264", "-preset", "veryfast", "-crf", "23"],
+        ext=".mp4",
+    ),
+    "x264-ultrafast": dict(
+        backend="ffmpeg",
+        args=["-c:v", "libx264", "-preset", "ultrafast", "-crf", "23"],
+        ext=".mp4",
+    ),
+    "nvenc": dict(  # NVIDIA hardware encoder
+        backend="ffmpeg", args=["-c:v", "h264_nvenc", "-preset", "p1"], ext=".mp4"
+    ),
+    "jpg": dict(backend="images", ext=".jpg", params=[cv2.IMWRITE_JPEG_QUALITY, 90]),
+    "png": dict(backend="images", ext=".png", params=[cv2.IMWRITE_PNG_COMPRESSION, 1]),
+}
+FALLBACK_CODEC = "mp4v"
+
+
+def ffmpeg_path():
+    """The ffmpeg executable ($FFMPEG_BINARY or on PATH), or None."""
+    return os.environ.get("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+
+def resolve_codec(codec):
+    """
+    Codec name to use: ffmpeg codecs fall back to FALLBACK_CODEC when no
+    ffmpeg executable is present.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec {codec!r}, expected one of {list(CODECS)}")
+    if CODECS[codec]["backend"] == "ffmpeg" and ffmpeg_path() is None:
+        print(f"[INFO] ffmpeg not found, encoding {codec} as {FALLBACK_CODEC}")
+        return FALLBACK_CODEC
+    return codec
+
+
+def output_path(stem, codec="mp4v", segment_len=None):
+    """Output file (or directory, for image / segmented output) for a codec."""
+    if segment_len or CODECS[resolve_codec(codec)]["backend"] == "images":
+        return stem
+    return stem + CODECS[resolve_codec(codec)]["ext"]
+
+
+class _CvWriter:
+    def __init__(self, path, W, H, fps, fourcc):
+        self.w = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, (W, H))
+        if not self.w.isOpened():
+            raise IOError(f"cv2.VideoWriter cannot encode {fourcc} to {path}")
+
+    def write(self, frame):
+        self.w.write(frame)
+
+    def close(self):
+        self.w.release()
+
+
+class _PipeWriter:
+    """Raw bgr24 frames on the stdin of an ffmpeg process."""
+
+    def __init__(self, path, W, H, fps, args):
+        cmd = [ffmpeg_path(), "-y", "-loglevel", "error"]
+        cmd += ["-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{W}x{H}"]
+        cmd += ["-r", str(fps), "-i", "-", *args, "-pix_fmt", "yuv420p", path]
+        self.path = path
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        self.proc.stdin.write(np.ascontiguousarray(frame).data)
+
+    def close(self):
+        self.proc.stdin.close()
+        err = self.proc.stderr.read().decode(errors="replace")
+        if self.proc.wait():
+            raise IOError(f"ffmpeg failed writing {self.path}: {err.strip()}")
+
+
+class _ImageWriter:
+    """frame_000000.jpg, frame_000001.jpg, ... in a directory."""
+
+    def __init__(self, path, ext, params):
+        os.makedirs(path, exist_ok=True)
+        self.path, self.ext, self.params = path, ext, params
+        self.n = 0
+
+    def write(self, frame):
+        name = os.path.join(self.path, f"frame_{self.n:06d}{self.ext}")
+        if not cv2.imwrite(name, frame, self.params):
+            raise IOError(f"cannot write {name}")
+        self.n += 1
+
+    def close(self):
+        pass
+
+
+class SegmentedWriter:
+    """
+    Splits the output into files of `segment_len` frames in directory
+    `path` and lists every finished one in an m3u8 playlist (atomically
+    rewritten), so a player or server can start on the first segments
+    while the rest are still being rendered. With an ffmpeg codec the
+    segments are MPEG-TS and the playlist is a regular HLS event playlist.
+
+    The finished segments are also recorded in progress.json, with the
+    run key given as `resume` (e.g. checkpoint.RunCheckpoint.key): a
+    writer opened with the same key continues after the segments of an
+    unfinished run (see segmented_frames_done); any other output in
+    `path` is discarded and the writer starts fresh.
+    """
+
+    def __init__(self, path, W, H, fps, codec, segment_len, resume=None):
+        os.makedirs(path, exist_ok=True)
+        self.path, self.W, self.H, self.fps = path, W, H, fps
+        self.codec, self.segment_len = codec, segment_len
+        self.key = resume or None
+        spec = CODECS[codec]
+        self.ext = ".ts" if spec["backend"] == "ffmpeg" else spec["ext"]
+        # (file name, n_frames) of finished segments
+        self.segments = _resumable_segments(path, self.key)
+        if not self.segments:
+            for name in os.listdir(path):
+                if name.startswith("seg_"):
+                    _remove(os.path.join(path, name))
+        self._cur = None
+        self._n = 0
+
+    def write(self, frame):
+        if self._cur is None:
+            name = f"seg_{len(self.segments):05d}{self.ext}"
+            self._cur = _open(
+                os.path.join(self.path, name), self.W, self.H, self.fps, self.codec
+            )
+            self._name = name
+        self._cur.write(frame)
+        self._n += 1
+        if self._n == self.segment_len:
+            self._finish_segment()
+
+    def _finish_segment(self):
+        self._cur.close()
+        self.segments.append((self._name, self._n))
+        self._cur, self._n = None, 0
+        self._write_playlist(done=False)
+
+    def _write_playlist(self, done):
+        target = math.ceil(self.segment_len / self.fps)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{target}"]
+        lines += ["#EXT-X-PLAYLIST-TYPE:EVENT", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for name, n in self.segments:
+            lines += [f"#EXTINF:{n / self.fps:.3f},", name]
+        if done:
+            lines.append("#EXT-X-ENDLIST")
+        tmp = os.path.join(self.path, ".index.m3u8.tmp")
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, os.path.join(self.path, "index.m3u8"))
+        tmp = os.path.join(self.path, ".progress.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(dict(key=self.key, segments=self.segments, done=done), f)
+        os.replace(tmp, os.path.join(self.path, "progress.json"))
+
+    def close(self):
+        if self._cur is not None:
+            self._finish_segment()
+        self._write_playlist(done=True)
+
+
+def _read_progress(path):
+    try:
+        with open(os.path.join(path, "progress.json")) as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return dict(segments=[], done=False)
+    progress["segments"] = [tuple(s) for s in progress["segments"]]
+    return progress
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _resumable_segments(path, key):
+    """Finished segments of an unfinished SegmentedWriter run with this key."""
+    if key is None:
+        return []
+    progress = _read_progress(path)
+    if progress.get("key") != key or progress["done"]:
+        return []
+    return progress["segments"]
+
+
+def segmented_frames_done(path, key):
+    """
+    Frames already in the finished segments of a SegmentedWriter output
+    left unfinished by the run with this key (0 for any other output).
+    """
+    return sum(n for _, n in _resumable_segments(path, key))
+
+
+def _open(path, W, H, fps, codec):
+    spec = CODECS[codec]
+    if spec["backend"] == "cv2":
+        return _CvWriter(path, W, H, fps, spec["fourcc"])
+    if spec["backend"] == "ffmpeg":
+        args = spec["args"] + (["-f", "mpegts"] if path.endswith(".ts") else [])
+        return _PipeWriter(path, W, H, fps, args)
+    return _ImageWriter(path, spec["ext"], spec["params"])
+
+
+def open_writer(path, W, H, fps=10, codec="mp4v", segment_len=None, resume=None):
+    """
+    Video writer for (H, W, 3) uint8 BGR frames: `.write(frame)`, then
+    `.close()`.
+
+    Args:
+      path        : output file; a directory for image codecs and for
+                    segmented output (see output_path)
+      codec       : key of CODECS; ffmpeg codecs need an ffmpeg executable
+                    and otherwise fall back to FALLBACK_CODEC
+      segment_len : frames per segment; writes a SegmentedWriter directory
+                    instead of a single file (None = one file)
+      resume      : segmented output only: run key; the finished segments
+                    of an unfinished run with this key are kept and the
+                    writer continues after them (see SegmentedWriter)
+    """
+    codec = resolve_codec(codec)
+    if segment_len:
+        return SegmentedWriter(path, W, H, fps, codec, segment_len, resume)
+    return _open(path, W, H, fps, codec)
+
+
+_CLOSE = object()
+
+
+class OutputStream:
+    """One output of a WriterPool; frames are queued to its worker."""
+
+    def __init__(self, pool, worker, path, fps, codec, segment_len, resume):
+        self.pool, self.worker = pool, worker
+        self.path, self.fps, self.codec = path, fps, codec
+        self.segment_len, self.resume = segment_len, resume
+        self.writer = None
+        self.n_frames = 0
+        self.encode_s = 0.0
+        self.error = None
+
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.pool._queues[self.worker].put((self, frame))
+
+    def close(self):
+        self.pool._queues[self.worker].put((self, _CLOSE))
+
+    def as_dict(self):
+        return dict(
+            path=self.path,
+            codec=self.codec,
+            frames=self.n_frames,
+            encode_s=self.encode_s,
+            fps=self.n_frames / self.encode_s if self.encode_s else 0.0,
+        )
+
+
+class WriterPool:
+    """
+    Encoder threads shared by several outputs, so the per-class synopses
+    are encoded concurrently while the caller keeps rendering. Each
+    output is pinned to the least loaded worker, which keeps its frames
+    in order; every worker has a bounded queue of `queue_size` frames, so
+    a slow encoder applies back-pressure to the renderer. cv2 and the
+    ffmpeg pipe release the GIL while encoding.
+
+      with WriterPool(2) as pool:
+          for path, frames in outputs:
+              pool.write(frames, path, fps, codec)
+      pool.stats  # per-output frames / encode seconds / fps
+
+    Args:
+      n_workers  : encoder threads
+      queue_size : frames buffered per worker
+    """
+
+    def __init__(self, n_workers=2, queue_size=32):
+        self._queues = [queue.Queue(queue_size) for _ in range(n_workers)]
+        self._load = [0] * n_workers
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), daemon=True)
+            for q in self._queues
+        ]
+        self.streams = []
+        for t in self._threads:
+            t.start()
+
+    def open(self, path, fps=10, codec="mp4v", segment_len=None, resume=None):
+        k = min(range(len(self._load)), key=self._load.__getitem__)
+        self._load[k] += 1
+        stream = OutputStream(self, k, path, fps, codec, segment_len, resume)
+        self.streams.append(stream)
+        return stream
+
+    def write(self, frames, path, fps=10, codec="mp4v", segment_len=None):
+        """Queue every frame of the iterable `frames` for `path`; returns the count."""
+        stream = self.open(path, fps, codec, segment_len)
+        n = 0
+        try:
+            for f in frames:
+                stream.write(f)
+                n += 1
+        finally:
+            stream.close()
+        return n
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            stream, frame = item
+            if frame is _CLOSE:
+                self._load[stream.worker] -= 1
+            if stream.error is not None:
+                continue  # drop the rest of a failed output
+            try:
+                t0 = time.perf_counter()
+                if frame is _CLOSE:
+                    if stream.writer is not None:
+                        stream.writer.close()
+                else:
+                    if stream.writer is None:
+                        H, W = frame.shape[:2]
+                        stream.writer = open_writer(
+                            stream.path,
+                            W,
+                            H,
+                            stream.fps,
+                            stream.codec,
+                            stream.segment_len,
+                            stream.resume,
+                        )
+                    with PROFILER.span("encode"):
+                        stream.writer.write(frame)
+                    stream.n_frames += 1
+                stream.encode_s += time.perf_counter() - t0
+            except Exception as e:
+                stream.error = e
+
+    def close(self):
+        """Finish every output; re-raises the first encoding error."""
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join()
+        PROFILER.count("frames_encoded", sum(s.n_frames for s in self.streams))
+        for s in self.streams:
+            if s.error is not None:
+                raise s.error
+
+    @property
+    def stats(self):
+        return [s.as_dict() for s in self.streams]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
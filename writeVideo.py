@@ -1,21 +1,484 @@
+import tempfile
+
 import cv2
 import numpy as np
 
+from profiler import PROFILER
+from videoOutput import open_writer
+
 
 # 6) Build & write one synopsis video per class ID
+def synopsis_index(tubes, shifts, synopsis_length):
+    """
+    Group tube detections by the synopsis frame they land on.
+
+    Returns:
+      bounds  : (synopsis_length + 1,) entries of synopsis frame t are
+                bounds[t]:bounds[t + 1]
+      tube_ix : tube index per entry, in tube order within a frame
+      det_ix  : detection index within that tube
+    """
+    tube_ix, det_ix = [], []
+    for k, (tube, shift) in enumerate(zip(tubes, shifts)):
+        lo, hi = max(0, -shift), min(len(tube), synopsis_length - shift)
+        if hi > lo:
+            det_ix.append(np.arange(lo, hi))
+            tube_ix.append(np.full(hi - lo, k))
+    if not det_ix:
+        z = np.zeros(0, dtype=np.int64)
+        return np.zeros(synopsis_length + 1, dtype=np.int64), z, z
+    tube_ix = np.concatenate(tube_ix)
+    det_ix = np.concatenate(det_ix)
+    t_syn = np.asarray(shifts, dtype=np.int64)[tube_ix] + det_ix
+    order = np.argsort(t_syn, kind="stable")
+    bounds = np.searchsorted(t_syn[order], np.arange(synopsis_length + 1))
+    return bounds, tube_ix[order], det_ix[order]
+
+
+def _feather_alpha(patch, box, H, W, alpha_border):
+    """Q8 (0..255) alpha on the mask box padded by alpha_border."""
+    x1, y1, x2, y2 = box
+    px1, py1 = max(x1 - alpha_border, 0), max(y1 - alpha_border, 0)
+    px2, py2 = min(x2 + alpha_border, W), min(y2 + alpha_border, H)
+    region = np.ones((py2 - py1, px2 - px1), dtype=np.uint8)
+    region[y1 - py1 : y2 - py1, x1 - px1 : x2 - px1][patch] = 0
+    dist = cv2.distanceTransform(region, cv2.DIST_L2, 5)
+    alpha = 255.0 - np.minimum(dist, alpha_border) * (255.0 / alpha_border)
+    return (px1, py1, px2, py2), (alpha + 0.5).astype(np.uint16)
+
+
+def _annotate(canvas, bbox, t_orig):
+    # draw bounding box
+    bx1, by1, bx2, by2 = (int(v) for v in bbox)
+    color = (255, 255, 0)
+    cv2.rectangle(canvas, (bx1, by1), (bx2, by2), color, 2)
+
+    # draw the original frame index
+    cv2.putText(
+        canvas,
+        f"{t_orig}",
+        (bx1, max(by1 - 10, 0)),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.5,
+        color,
+        2,
+        cv2.LINE_AA,
+    )
+
+
+def _composite(canvas, sprites, feather):
+    """
+    Paste (region, pixels, alpha, bbox, t_orig) sprites in order: copy the
+    pixels where alpha (the mask patch) is set, or with `feather` blend
+    them with Q8 alpha.
+    """
+    blended = n = 0
+    for (x1, y1, x2, y2), pixels, alpha, bbox, t_orig in sprites:
+        roi = canvas[y1:y2, x1:x2]
+        if feather:
+            A = alpha[:, :, None].astype(np.uint16)
+            mix = pixels.astype(np.uint16) * A + roi.astype(np.uint16) * (255 - A) + 127
+            roi[...] = (mix // 255).astype(np.uint8)
+        else:
+            np.copyto(roi, pixels, where=alpha[:, :, None])
+        blended += alpha.size
+        n += 1
+        _annotate(canvas, bbox, t_orig)
+    PROFILER.count("detections_composited", n)
+    PROFILER.count("pixels_blended", blended)
+    return canvas
+
+
+def composite_frame(
+    canvas, frames, tubes, tube_ix, det_ix, alpha_border=20, feather=False
+):
+    """
+    Paste the given tube detections onto one synopsis frame, in order.
+
+    Only the mask box of each detection is touched. Without `feather` the
+    object pixels are copied (alpha is 1 on every mask pixel); with it the
+    fade over alpha_border px around the mask is blended in as well, using
+    8-bit fixed-point alpha computed just for this detection.
+    """
+    H, W = canvas.shape[:2]
+
+    def sprites():
+        for k, i in zip(tube_ix, det_ix):
+            tube = tubes[k]
+            t_orig = int(tube.frames[i])
+            patch = tube.patch(i)
+            box = tuple(int(v) for v in tube.mask_boxes[i])
+            if feather:
+                with PROFILER.span("feather_alpha"):
+                    box, alpha = _feather_alpha(patch, box, H, W, alpha_border)
+            else:
+                alpha = patch
+            x1, y1, x2, y2 = box
+            src = frames[t_orig][y1:y2, x1:x2]
+            yield box, src, alpha, tube.bboxes[i], t_orig
+
+    return _composite(canvas, sprites(), feather)
+
+
+def _frame_background(background, tubes, tube_ix, det_ix, t_ref):
+    """
+    Background of one synopsis frame and the source time it stands for:
+    the BackgroundTimeline snapshot nearest to the median source time of
+    the objects shown, or t_ref (the previous frame's) when there are none.
+    """
+    if not hasattr(background, "at"):
+        return background, t_ref
+    if len(tube_ix):
+        t_ref = np.median([tubes[k].frames[i] for k, i in zip(tube_ix, det_ix)])
+    return background.at(t_ref), t_ref
+
+
+def _scale_tubes(tubes, tube_size, frames):
+    """
+    tubes found on a (W, H) = tube_size proxy of `frames`, scaled to the
+    size of `frames` (the same list when the sizes match or tube_size is
+    None).
+    """
+    H, W = frames[0].shape[:2]
+    if tube_size is None or tuple(tube_size) == (W, H):
+        return list(tubes)
+    sx, sy = W / tube_size[0], H / tube_size[1]
+    with PROFILER.span("upscale_masks"):
+        return [tube.scaled(sx, sy, W, H) for tube in tubes]
+
+
+def iter_synopsis_frames(
+    frames,
+    tubes,
+    shifts,
+    synopsis_length,
+    background,
+    alpha_border=20,
+    feather=False,
+    tube_size=None,
+):
+    """
+    Yield the synopsis frames one at a time, compositing only the tube
+    detections that land on each one; a frame is allocated when it is
+    requested, so memory does not grow with synopsis_length.
+
+    With a computeBackground.BackgroundTimeline as `background`, each
+    frame starts from the snapshot nearest to the median source time of
+    the objects shown on it (frames without objects keep the previous one).
+
+    Args: see build_synopsis_with_time
+    """
+    tubes = _scale_tubes(tubes, tube_size, frames)
+    bounds, tube_ix, det_ix = synopsis_index(tubes, shifts, synopsis_length)
+    t_ref = 0
+    for t in range(synopsis_length):
+        a, b = bounds[t], bounds[t + 1]
+        bg, t_ref = _frame_background(
+            background, tubes, tube_ix[a:b], det_ix[a:b], t_ref
+        )
+        with PROFILER.span("compose"):
+            out = composite_frame(
+                bg.copy(),
+                frames,
+                tubes,
+                tube_ix[a:b],
+                det_ix[a:b],
+                alpha_border,
+                feather,
+            )
+        yield out
+
+
+def _buffer(n, dtype, spill):
+    if spill and n:
+        return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode="w+", shape=(n,))
+    return np.empty(n, dtype=dtype)
+
+
+class SpriteCache:
+    """
+    Source pixels of every detection of a tube set, cut in one in-order
+    pass over the source frames, together with the alpha they are pasted
+    with: the mask patch, or with `feather` the Q8 fade over the mask box
+    padded by alpha_border, whose distance transform then runs once per
+    distinct mask. Synopses sharing tubes (a per-class one and the
+    all-classes one) paste from here instead of re-reading the source.
+
+    Sprites are ragged uint8 buffers; past `max_bytes` they are kept in an
+    unlinked temporary file (np.memmap) instead of memory. The cache holds
+    every detection at once, so its size grows with the whole tube set
+    (see estimate_bytes).
+    """
+
+    @staticmethod
+    def estimate_bytes(tubes, H, W, alpha_border=20, feather=False):
+        """Bytes of pixels and alpha a SpriteCache of `tubes` would hold."""
+        if not tubes:
+            return 0
+        boxes = np.concatenate([t.mask_boxes for t in tubes]).astype(np.int64)
+        if feather:
+            boxes[:, :2] = np.maximum(boxes[:, :2] - alpha_border, 0)
+            boxes[:, 2:] = np.minimum(boxes[:, 2:] + alpha_border, [W, H])
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        return 4 * int(areas.sum())
+
+    def __init__(self, frames, tubes, alpha_border=20, feather=False, max_bytes=2**30):
+        H, W = frames[0].shape[:2]
+        self.tubes = tubes
+        self.index = {id(t): k for k, t in enumerate(tubes)}
+        lens = np.array([len(t) for t in tubes], dtype=np.int64)
+        self.starts = np.zeros(len(tubes) + 1, dtype=np.int64)
+        self.starts[1:] = np.cumsum(lens)
+        n = int(self.starts[-1])
+        regions = np.zeros((n, 4), dtype=np.int64)
+        if n:
+            regions[:] = np.concatenate([t.mask_boxes for t in tubes])
+        if feather:
+            regions[:, :2] = np.maximum(regions[:, :2] - alpha_border, 0)
+            regions[:, 2:] = np.minimum(regions[:, 2:] + alpha_border, [W, H])
+        self.regions = regions
+        self._boxes = [tuple(r) for r in regions.tolist()]
+        areas = (regions[:, 2] - regions[:, 0]) * (regions[:, 3] - regions[:, 1])
+        self.offsets = np.zeros(n + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(areas)
+        total = int(self.offsets[-1])
+        spill = 4 * total > max_bytes
+        self.pixels = _buffer(3 * total, np.uint8, spill)
+        self.alpha = _buffer(total, np.uint8, spill)
+        self.feather = feather
+        PROFILER.count("sprite_bytes", 4 * total)
+
+        # alpha, tube by tube (no source pixels needed); detections sharing
+        # a mask (tube.mask_ids) with the same clipping of the padded box
+        # share one fade, so its distance transform runs once
+        g = 0
+        for tube in tubes:
+            fades = {}
+            ids = tube.mask_ids().tolist()
+            for i, patch in enumerate(tube.patches()):
+                if feather:
+                    x1, y1, x2, y2 = (int(v) for v in tube.mask_boxes[i])
+                    px1, py1, px2, py2 = self._boxes[g]
+                    key = (ids[i], x1 - px1, y1 - py1, px2 - x2, py2 - y2)
+                    a = fades.get(key)
+                    if a is None:
+                        with PROFILER.span("feather_alpha"):
+                            _, a = _feather_alpha(
+                                patch, (x1, y1, x2, y2), H, W, alpha_border
+                            )
+                        fades[key] = a
+                    else:
+                        PROFILER.count("feather_alpha_reused")
+                else:
+                    a = patch.view(np.uint8)
+                self.alpha[self.offsets[g] : self.offsets[g + 1]] = a.ravel()
+                g += 1
+
+        # pixels, in source frame order: every frame is read once
+        if n:
+            src_t = np.concatenate([t.frames for t in tubes])
+            order = np.argsort(src_t, kind="stable")
+            last, src = None, None
+            for g in order.tolist():
+                if src_t[g] != last:
+                    last = src_t[g]
+                    src = frames[int(last)]
+                    PROFILER.count("sprite_source_reads")
+                x1, y1, x2, y2 = regions[g]
+                a, b = 3 * self.offsets[g], 3 * self.offsets[g + 1]
+                self.pixels[a:b] = src[y1:y2, x1:x2].ravel()
+
+    def __len__(self):
+        return len(self.regions)
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes + self.alpha.nbytes
+
+    def sprite(self, tube, i):
+        """(region, pixels, alpha, bbox, t_orig) of detection i of `tube`."""
+        g = self.starts[self.index[id(tube)]] + i
+        x1, y1, x2, y2 = box = self._boxes[g]
+        h, w = y2 - y1, x2 - x1
+        a, b = self.offsets[g], self.offsets[g + 1]
+        pixels = self.pixels[3 * a : 3 * b].reshape(h, w, 3)
+        alpha = self.alpha[a:b].reshape(h, w)
+        if not self.feather:
+            alpha = alpha.view(bool)
+        return box, pixels, alpha, tube.bboxes[i], int(tube.frames[i])
+
+
+def iter_multi_synopsis_frames(
+    frames,
+    outputs,
+    background,
+    alpha_border=20,
+    feather=False,
+    max_sprite_bytes=2**28,
+    start=None,
+    tube_size=None,
+):
+    """
+    Render several synopses over shared tubes (e.g. one per class plus
+    the all-classes one) in a single pass: every detection's pixels and
+    alpha are cut once into a SpriteCache, reading each source frame
+    once, and all outputs are composited from it in lockstep, frame t of
+    every output before frame t + 1. Output frames are identical to
+    iter_synopsis_frames of each output.
+
+    The cache is built before the first frame and holds every detection,
+    so when it would exceed max_sprite_bytes the outputs are composited
+    straight from the source frames instead (as iter_synopsis_frames),
+    keeping memory bounded by the detections on screen.
+
+    Args:
+      outputs          : list of (tubes, shifts, synopsis_length), one per
+                         synopsis
+      max_sprite_bytes : SpriteCache budget
+      start            : per output, first synopsis frame to yield (e.g.
+                         to resume a segmented output after its finished
+                         segments; None = 0)
+      others           : see build_synopsis_with_time
+
+    Yields:
+      (output index, synopsis frame)
+    """
+    unique = {}
+    for tubes, _, _ in outputs:
+        for tube in tubes:
+            unique.setdefault(id(tube), tube)
+    # level of detail: each shared tube is upsampled once
+    unique = dict(zip(unique, _scale_tubes(unique.values(), tube_size, frames)))
+    outputs = [
+        ([unique[id(tube)] for tube in tubes], shifts, L)
+        for tubes, shifts, L in outputs
+    ]
+    H, W = frames[0].shape[:2]
+    need = SpriteCache.estimate_bytes(
+        list(unique.values()), H, W, alpha_border, feather
+    )
+    cache = None
+    if need <= max_sprite_bytes:
+        with PROFILER.span("sprites"):
+            cache = SpriteCache(
+                frames, list(unique.values()), alpha_border, feather, max_sprite_bytes
+            )
+    else:
+        print(
+            f"[INFO] sprites would take {need / 2**20:.0f} MB (budget "
+            f"{max_sprite_bytes / 2**20:.0f} MB): compositing from the source"
+        )
+    plans = [
+        (tubes, L) + synopsis_index(tubes, shifts, L) for tubes, shifts, L in outputs
+    ]
+    t_refs = [0] * len(outputs)
+    start = start or [0] * len(outputs)
+    for t in range(max((L for _, _, L in outputs), default=0)):
+        for o, (tubes, L, bounds, tube_ix, det_ix) in enumerate(plans):
+            if t >= L:
+                continue
+            a, b = bounds[t], bounds[t + 1]
+            # the background reference carries over frames, so it is
+            # advanced even through the skipped ones
+            bg, t_refs[o] = _frame_background(
+                background, tubes, tube_ix[a:b], det_ix[a:b], t_refs[o]
+            )
+            if t < start[o]:
+                continue
+            with PROFILER.span("compose"):
+                if cache is None:
+                    out = composite_frame(
+                        bg.copy(),
+                        frames,
+                        tubes,
+                        tube_ix[a:b],
+                        det_ix[a:b],
+                        alpha_border,
+                        feather,
+                    )
+                else:
+                    out = _composite(
+                        bg.copy(),
+                        (
+                            cache.sprite(tubes[k], i)
+                            for k, i in zip(tube_ix[a:b], det_ix[a:b])
+                        ),
+                        feather,
+                    )
+            yield o, out
+
+
 def build_synopsis_with_time(
+    frames,
+    tubes,
+    shifts,
+    synopsis_length,
+    background,
+    alpha_border=20,
+    feather=False,
+    tube_size=None,
+):
+    """
+    Build the final synopsis video frames:
+      - Paste each tube's mask over the background
+      - Draw a green bbox around each object
+      - Put the original source‐frame index (t_orig) above the box
+
+    Frames are composited one synopsis frame at a time, with all tubes that
+    land on it in a single pass and only their bbox regions touched. Use
+    iter_synopsis_frames + write_video to stream them to disk instead of
+    holding the whole list.
+
+    Args:
+      frames           : list of original BGR frames [(H,W,3), ...] or a
+                         loadVideo.VideoFrameSource (read by index)
+      tubes            : list of tube.Tube records
+      shifts           : list of int, start‐time for each tube
+      synopsis_length  : total number of synopsis frames to produce
+      background       : (H,W,3) uint8 background image, or a
+                         computeBackground.BackgroundTimeline
+      alpha_border     : width (px) over which to fade mask edges
+      feather          : also blend the faded edge outside the mask
+      tube_size        : (W, H) of the proxy frames the tubes were found
+                         and scheduled on when `frames` and `background`
+                         are larger (level of detail): masks are upsampled
+                         inside their boxes before compositing (None = the
+                         size of `frames`)
+
+    Returns:
+      synopsis_frames  : list of (H,W,3) uint8 frames
+    """
+    return list(
+        iter_synopsis_frames(
+            frames,
+            tubes,
+            shifts,
+            synopsis_length,
+            background,
+            alpha_border,
+            feather,
+            tube_size,
+        )
+    )
+
+
+def build_synopsis_reference(
     frames, tubes, shifts, synopsis_length, background, alpha_border=20
 ):
     """
+    Float32 renderer that precomputes every alpha map; kept as the
+    reference build_synopsis_with_time is validated against (see
+    benchmarks.bench_render).
+
     Build the final synopsis video frames:
       - Soft alpha‐blend each tube’s mask over the background
       - Draw a green bbox around each object
       - Put the original source‐frame index (t_orig) above the box
 
     Args:
-      frames           : list of original BGR frames [(H,W,3), ...]
-      tubes            : list of tube‐dicts, each with keys:
-                          "frames", "masks", "bboxes"
+      frames           : list of original BGR frames [(H,W,3), ...] or a
+                         loadVideo.VideoFrameSource (read by index)
+      tubes            : list of tube.Tube records
       shifts           : list of int, start‐time for each tube
       synopsis_length  : total number of synopsis frames to produce
       background       : (H,W,3) uint8 background image
@@ -26,16 +489,22 @@ def build_synopsis_with_time(
     """
     H, W = background.shape[:2]
 
-    # 1) precompute soft alpha masks for each tube
+    # 1) precompute soft alpha masks for each tube, on the mask's bbox
+    #    padded by alpha_border so the fade matches a full-frame transform
     soft_masks = []
     for tube in tubes:
         tube_soft = []
-        for mask in tube["masks"]:
+        for i, mask in enumerate(tube.patches()):
+            x1, y1, x2, y2 = tube.mask_boxes[i]
+            px1, py1 = max(x1 - alpha_border, 0), max(y1 - alpha_border, 0)
+            px2, py2 = min(x2 + alpha_border, W), min(y2 + alpha_border, H)
+            region = np.zeros((py2 - py1, px2 - px1), dtype=bool)
+            region[y1 - py1 : y2 - py1, x1 - px1 : x2 - px1] = mask
             # distance to background pixels
-            dist = cv2.distanceTransform((~mask).astype(np.uint8), cv2.DIST_L2, 5)
+            dist = cv2.distanceTransform((~region).astype(np.uint8), cv2.DIST_L2, 5)
             # fade over alpha_border px
             alpha = 1.0 - np.clip(dist, 0, alpha_border) / alpha_border
-            tube_soft.append(alpha)
+            tube_soft.append(((px1, py1, px2, py2), region, alpha))
         soft_masks.append(tube_soft)
 
     # 2) initialize blank synopsis frames with background
@@ -43,27 +512,27 @@ def build_synopsis_with_time(
 
     # 3) composite each tube
     for tube, soft_tube, shift in zip(tubes, soft_masks, shifts):
-        for idx, t_orig in enumerate(tube["frames"]):
+        for idx, t_orig in enumerate(tube.frames):
             t_syn = shift + idx
             if not (0 <= t_syn < synopsis_length):
                 continue
 
-            mask = tube["masks"][idx]  # bool (H,W)
-            alpha_map = soft_tube[idx]  # float (H,W)
-            box = tube["bboxes"][idx]  # (x1,y1,x2,y2)
+            (x1, y1, x2, y2), mask, alpha_map = soft_tube[idx]  # bbox-local
+            box = tube.bboxes[idx]  # (x1,y1,x2,y2)
 
-            # blend FG over BG
-            fg = frames[t_orig].astype(np.float32) / 255.0
-            bg = synopsis[t_syn].astype(np.float32) / 255.0
+            # blend FG over BG inside the padded mask box only
+            fg = frames[t_orig][y1:y2, x1:x2].astype(np.float32) / 255.0
+            roi = synopsis[t_syn][y1:y2, x1:x2]
+            bg = roi.astype(np.float32) / 255.0
             A = alpha_map[:, :, None]
             comp = fg * A + bg * (1 - A)
             comp_uint8 = (comp * 255).astype(np.uint8)
 
             # apply only where mask==True
-            synopsis[t_syn][mask] = comp_uint8[mask]
+            roi[mask] = comp_uint8[mask]
 
             # draw bounding box
-            x1, y1, x2, y2 = box
+            x1, y1, x2, y2 = (int(v) for v in box)
             color = (255, 255, 0)
             cv2.rectangle(synopsis[t_syn], (x1, y1), (x2, y2), color, 2)
 
@@ -84,10 +553,25 @@ def build_synopsis_with_time(
 
 
 #
-def write_video(frames, out_path, fps=10):
-    H, W, _ = frames[0].shape
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    w = cv2.VideoWriter(out_path, fourcc, fps, (W, H))
+def write_video(frames, out_path, fps=10, codec="mp4v", segment_len=None):
+    """
+    Encode frames to out_path as they arrive; `frames` may be a list or any
+    iterable, e.g. iter_synopsis_frames. Returns the number of frames written.
+
+    `codec` and `segment_len` select the output format, see
+    videoOutput.open_writer; use videoOutput.WriterPool to encode several
+    outputs concurrently.
+    """
+    w = None
+    n = 0
     for f in frames:
-        w.write(f)
-    w.release()
+        if w is None:
+            H, W, _ = f.shape
+            w = open_writer(out_path, W, H, fps, codec, segment_len)
+        with PROFILER.span("encode"):
+            w.write(f)
+        n += 1
+    PROFILER.count("frames_encoded", n)
+    if w is not None:
+        w.close()
+    return n